@@ -1,4 +1,9 @@
-from json import load
+from time import perf_counter
+
+STARTED = perf_counter()  # before the other imports, they're part of the startup
+
+import os
+from json import loads
 
 import NAA
 from NAA.models import APIResponse
@@ -8,13 +13,29 @@ import AlbertUnruhUtils
 from AlbertUnruhUtils.ratelimit import ServerRateLimit
 
 
+from school_messenger.cache import not_modified
 from school_messenger.config import Config, redis
+from school_messenger.metrics import registry, StartupTimer
+from school_messenger.middleware import (
+    MetricsMiddleware,
+    ConditionalMiddleware,
+    CompressionMiddleware,
+    AdmissionMiddleware,
+)
+from school_messenger.requestlog import RequestLogMiddleware, request_log
+from school_messenger.recording import RecordingMiddleware, RequestRecorder
+from school_messenger.server import serve, serve_async
+from school_messenger.workers import run_workers
 from school_messenger.statuspage import create_latency_update_runner
 from school_messenger.utils import (
     create_log_deleter_runner,
     create_message_deleter_runner,
+    create_maintenance_runner,
+    create_backup_runner,
     error_logger,
     get_user_type,
+    leader_lock,
+    database,
 )
 
 from school_messenger.versions import (
@@ -25,6 +46,38 @@ from school_messenger.versions import (
 )
 
 
+startup = StartupTimer(STARTED)
+startup.mark("imports")
+
+STARTUP_DURATION = registry.gauge(
+    "startup_duration_seconds",
+    "Time until the process was ready to serve, by phase.",
+    ("phase",),
+)
+
+
+def report_startup():
+    """
+    Logs the phases of the startup, with a warning if the budget is exceeded.
+    """
+    total = startup.total
+    for phase, seconds in startup.phases.items():
+        STARTUP_DURATION.set(phase, value=seconds)
+    STARTUP_DURATION.set("total", value=total)
+
+    budget = Config["startup"]["budget"]
+    database.add_log(
+        level=database.LOG_LEVEL["INFO" if total <= budget else "WARNING"],
+        version=None,
+        ip=None,
+        msg=f"ready to serve after {total:.3f}s (budget {budget}s)",
+        headers={
+            "pid": os.getpid(),
+            **{phase: round(seconds, 4) for phase, seconds in startup.phases.items()},
+        },
+    )
+
+
 NAA_REQUIRED_MIN_VERSION = "2021.12.16.001"
 AlbertUnruhUtils_REQUIRED_MIN_VERSION = "2022.01.08.004"
 
@@ -45,6 +98,7 @@ def check_lib_versions():
 
 
 check_lib_versions()  # in a call because so errors can be logged
+startup.mark("checks")
 
 
 api = API(
@@ -62,23 +116,143 @@ api.add_version(version=2, fallback=[V1])(V2)
 api.add_version(version=3, fallback=[V1, V2])(V3)
 
 # add default endpoint
-with open("main-response.json") as f:
-    default_response = load(f)
+with open("main-response.json", "rb") as f:
+    default_body = f.read()
+default_response = loads(default_body)
 
 
 @api.default_endpoint
 @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
 def _(*_):
+    if not_modified():
+        return 304
     return APIResponse(default_response)
 
 
-# create background tasks
-create_latency_update_runner(**Config["runner"]["latency updater"])
-create_log_deleter_runner(**Config["runner"]["log deleter"])
-create_message_deleter_runner(**Config["runner"]["message deleter"])
+startup.mark("api")
 
-run = error_logger(log_level=5, retry_timeout=60)(api.run_api)
-run(
-    debug=Config["server"]["debug"],
-    reload=Config["server"]["reload"],
-)
+
+def start_runners():
+    """
+    Schedules the background tasks (all share one scheduler-thread), with more
+    than one worker only the holder of a task's leader-lock runs it (another
+    worker takes over if it dies).
+    """
+    runners = {
+        "latency updater": create_latency_update_runner,
+        "log deleter": create_log_deleter_runner,
+        "message deleter": create_message_deleter_runner,
+        "maintenance": create_maintenance_runner,
+        "backup": create_backup_runner,
+    }
+    if Config["database"]["engine"] == "memory":
+        # nothing on the disk to back up
+        del runners["backup"]
+    for name, create_runner in runners.items():
+        kwargs = dict(Config["runner"][name])
+        if (lock := leader_lock(name)) is not None:
+            kwargs["lock"] = lock
+        create_runner(**kwargs)
+
+
+def serve_app(sock=None):
+    """
+    Parameters
+    ----------
+    sock: socket.socket, optional
+        The socket of the master process (worker mode).
+    """
+    # innermost, the statuses of all handled requests are needed
+    app = RequestLogMiddleware(api, request_log)
+    if Config["http cache"]["enabled"]:
+        app = ConditionalMiddleware(app, default_body=default_body)
+    if Config["compression"]["enabled"]:
+        app = CompressionMiddleware(
+            app,
+            min_size=Config["compression"]["min size"],
+            level=Config["compression"]["level"],
+        )
+    if Config["admission"]["enabled"]:
+        app = AdmissionMiddleware(
+            app,
+            max_in_flight=Config["admission"]["max in flight"],
+            write_share=Config["admission"]["write share"],
+            bulk_share=Config["admission"]["bulk share"],
+            max_queue=Config["admission"]["max queue"],
+            max_wait=Config["admission"]["max wait"],
+            max_db_in_flight=Config["admission"]["max db in flight"],
+            retry_after=Config["admission"]["retry after"],
+        )
+    if Config["recording"]["enabled"]:
+        # outside the others, so the timing is what the clients saw
+        app = RecordingMiddleware(
+            app,
+            RequestRecorder(
+                Config["recording"]["file"],
+                rate=Config["recording"]["rate"],
+                max_size=Config["recording"]["max size"] * 2**20,
+            ),
+        )
+    if Config["metrics"]["enabled"]:
+        app = MetricsMiddleware(
+            app,
+            path=Config["metrics"]["path"],
+            allowed_ips=Config["metrics"]["allowed ips"],
+        )
+    startup.mark("middlewares")
+    report_startup()
+
+    if Config["server"]["mode"] == "asyncio":
+        if Config["admission"]["enabled"]:
+            # the admission decides, the requests waiting for it hold a thread too
+            workers = (
+                Config["admission"]["max in flight"] + Config["admission"]["max queue"]
+            )
+        else:
+            workers = Config["server"]["workers"]
+        serve_async(
+            app,
+            host=Config["host"],
+            port=Config["port"],
+            workers=workers,
+            keep_alive=Config["server"]["keep alive"],
+            sock=sock,
+        )
+    else:
+        serve(app, host=Config["host"], port=Config["port"], sock=sock)
+
+
+def run_worker(sock):
+    # the database is already set up by the master
+    startup.restart()
+    start_runners()
+    startup.mark("runners")
+    error_logger(log_level=5, retry_timeout=60)(serve_app)(sock)
+
+
+# the tables are created once, before any worker is forked
+database.setup()
+startup.mark("database")
+
+if Config["server"]["debug"] or Config["server"]["reload"]:
+    # the development server of NAA (without the middlewares)
+    start_runners()
+    startup.mark("runners")
+    report_startup()
+    run = error_logger(log_level=5, retry_timeout=60)(api.run_api)
+    run(
+        debug=Config["server"]["debug"],
+        reload=Config["server"]["reload"],
+    )
+elif Config["workers"]["count"] > 1:
+    run_workers(
+        run_worker,
+        count=Config["workers"]["count"],
+        host=Config["host"],
+        port=Config["port"],
+    )
+else:
+    start_runners()
+    startup.mark("runners")
+    run = error_logger(log_level=5, retry_timeout=60)(serve_app)
+    run()
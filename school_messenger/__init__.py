@@ -4,5 +4,9 @@ __copyright__ = f"(c) {__author__}"
 
 from .utils import *
 from .database import *
+from .storage import *
+from .rows import *
 from .config import *
 from .statuspage import *
+from .metrics import *
+from .scheduler import *
@@ -0,0 +1,149 @@
+import os
+import typing
+from hashlib import blake2b
+from multiprocessing import Lock, RawValue
+from threading import local
+
+__all__ = (
+    "Generation",
+    "ACCOUNTS",
+    "MESSAGES",
+    "NEWEST_MESSAGE",
+    "make_etag",
+    "etag_matches",
+    "stage_revalidation",
+    "not_modified",
+)
+
+
+# whether the If-None-Match of the request handled by this thread matches its tag
+_revalidation = local()
+
+# per boot, so tags from before a restart (where the generations were reset) never match
+_SECRET = os.urandom(16)
+
+
+class Generation:
+    """
+    A counter which is bumped on every change of the data it guards.
+
+    The value lives in shared memory, created at import, so pre-forked
+    workers see the changes of each other.
+    """
+
+    def __init__(self):
+        self._value = RawValue("Q", 0)
+        self._lock = Lock()
+
+    @property
+    def value(self) -> int:
+        return self._value.value
+
+    def bump(self) -> int:
+        """
+        Returns
+        -------
+        int
+            The new value.
+        """
+        with self._lock:
+            self._value.value += 1
+            return self._value.value
+
+    def raise_to(self, value: int) -> int:
+        """
+        Sets the value if it's higher than the current one.
+
+        Parameters
+        ----------
+        value: int
+
+        Returns
+        -------
+        int
+            The new value.
+        """
+        with self._lock:
+            if value > self._value.value:
+                self._value.value = value
+            return self._value.value
+
+
+ACCOUNTS = Generation()
+# bumped on every addition and deletion, an added message isn't always the newest
+# one (e.g. one of another worker within the same millisecond)
+MESSAGES = Generation()
+# for "Last-Modified"
+NEWEST_MESSAGE = Generation()
+
+
+def make_etag(*parts: typing.Any) -> str:
+    """
+    Creates a weak ETag for the given parts (the responses contain fields
+    like the rate-limits, which differ between equal data).
+
+    The parts may contain secrets (e.g. tokens), they can't be recovered
+    from the tag.
+
+    Parameters
+    ----------
+    *parts: typing.Any
+
+    Returns
+    -------
+    str
+    """
+    digest = blake2b(key=_SECRET, digest_size=16)
+    for part in parts:
+        digest.update(str(part).encode("utf-8", "surrogateescape"))
+        digest.update(b"\0")
+    return f'W/"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: typing.Optional[str], etag: str) -> bool:
+    """
+    Parameters
+    ----------
+    if_none_match: str, optional
+        The value of the ``If-None-Match``-header.
+    etag: str
+        The current ETag.
+
+    Returns
+    -------
+    bool
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # the weak comparison of RFC 9110 (the "W/" is ignored)
+    etag = etag.removeprefix("W/")
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def stage_revalidation(matches: bool):
+    """
+    Stages whether the request handled by this thread may be answered with
+    304 (see :class:`school_messenger.middleware.ConditionalMiddleware`).
+
+    Parameters
+    ----------
+    matches: bool
+        Whether the ``If-None-Match`` of the request matches its current tag.
+    """
+    _revalidation.matches = matches
+
+
+def not_modified() -> bool:
+    """
+    For the handlers, after their checks (rate-limits, ``User-Agent``,
+    authorization) and before the database is used.
+
+    Returns
+    -------
+    bool
+        Whether the client's copy is still valid, so 304 can be answered
+        without building the response.
+    """
+    return getattr(_revalidation, "matches", False)
@@ -1,5 +1,6 @@
 from AlbertUnruhUtils.config.jsonconfig import JSONConfig
 from redis import Redis
+from .metrics import registry
 
 
 __all__ = (
@@ -17,8 +18,25 @@ DEFAULT_CONFIG = {
     "name": "School Messenger",
 
     "database": {
+        # "sqlite" or "memory" (everything is lost with the process, for tests and
+        # demo instances, only with one worker)
+        "engine": "sqlite",
         "file": "database.sqlite",
-        "log level": 0
+        "log level": 0,
+        # "WAL" is required for more than one worker
+        "journal mode": "WAL",
+        # serve the reads from an in-memory copy (ignored with more than one worker)
+        "read replica": False,
+        # write the new messages of concurrent requests with one transaction
+        "group commit": {
+            "enabled": False,
+            # how long to wait for more messages (in ms) / max messages per commit
+            "window": 5,
+            "max batch": 256,
+            # answer after the commit is on the disk ("full"), after the commit
+            # ("normal", may be lost on power loss) or once queued ("queued")
+            "durability": "full",
+        },
     },
 
     "version": {
@@ -28,7 +46,102 @@ DEFAULT_CONFIG = {
 
     "server": {
         "debug": False,
-        "reload": False
+        "reload": False,
+        # "threaded" (one thread per request) or "asyncio" (an event loop for the
+        # connections, the requests still run on threads, so it doesn't change the
+        # concurrency limit, see WHITEPAPER.md)
+        "mode": "threaded",
+        # only for "asyncio": requests handled at the same time / idle keep-alive (in s)
+        # (with "admission" its "max in flight" + "max queue" is used, the waiting
+        # requests occupy a thread too)
+        "workers": 16,
+        "keep alive": 5
+    },
+
+    # pre-forked worker processes which share the socket and the database
+    "workers": {
+        "count": 1,
+        # which worker runs the background tasks: "file" (flock) or "redis"
+        "leader lock": "file",
+        "lock directory": "."
+    },
+
+    "startup": {
+        # a warning is logged if a process needs longer until it serves (in s)
+        "budget": 2
+    },
+
+    # ETags and 304-responses for rarely changing responses
+    "http cache": {
+        "enabled": True
+    },
+
+    # gzip/deflate for large responses (negotiated via "Accept-Encoding")
+    "compression": {
+        "enabled": True,
+        "min size": 1024,  # in bytes
+        "level": 6
+    },
+
+    # the DEBUG-entry which is logged per request
+    "request log": {
+        # the part of the requests which is logged (0 - 1), per endpoint if listed
+        "rate": 0.01,
+        "endpoints": {},
+        # responses with this status or above are always logged
+        "always log status": 400,
+        # only these headers are logged, the redacted ones without their value
+        "headers": [
+            "User-Agent", "Content-Length", "Accept-Encoding",
+            "Amount", "Before", "After", "Offset", "Query", "Author", "Id", "Mode",
+        ],
+        "redacted headers": ["Authorization", "Password"],
+        "max field size": 256
+    },
+
+    # appends the requests to a JSONL-file, to replay them with
+    # `python -m school_messenger.recording` (sanitized like the request log)
+    "recording": {
+        "enabled": False,
+        "file": "./recordings/traffic.jsonl",
+        # the part of the requests which is recorded (0 - 1)
+        "rate": 1,
+        # the recording stops at this size (in MB)
+        "max size": 100
+    },
+
+    # 503 + "Retry-After" instead of queueing up in front of a busy database
+    "admission": {
+        "enabled": True,
+        # concurrently handled requests, writes / bulk writes only get a share
+        "max in flight": 64,
+        "write share": 0.75,
+        "bulk share": 0.5,
+        # requests waiting for a slot / how long they wait (in ms)
+        "max queue": 128,
+        "max wait": 250,
+        # writes are shed from this many open transactions (per process)
+        "max db in flight": 32,
+        "retry after": 1
+    },
+
+    # the in-process metrics (Prometheus text format)
+    "metrics": {
+        "enabled": True,
+        "path": "/metrics",
+        "allowed ips": ["127.0.0.1", "::1"]
+    },
+
+    "users": {
+        # how many users can be resolved with one `GET users/info`
+        "max bulk lookup": 100
+    },
+
+    "messages": {
+        # how many messages can be sent with one `POST messages/batch`
+        "max batch size": 100,
+        # how many results `GET messages/search` returns at most per request
+        "max search results": 100,
     },
 
     # the settings for redis
@@ -63,30 +176,73 @@ DEFAULT_CONFIG = {
         "api key": "YOUR-API-KEY",
         "page id": "YOUR-PAGE-ID",
         "latency metric id": "YOUR-METRIC-ID",
+        # can be set
+        "latency p95 metric id": None,
         # can be set (but isn't recommended)
-        "api base": "api.statuspage.io",
+        "api base": "api.statuspage.io",  # may contain a scheme, e.g. for a stub server
         "api version": "/v1/",  # "/" is optional
     },
 
+    # defaults of ``error_logger``
+    "errors": {
+        "max retry timeout": 60 * 5,  # the retry pause doubles up to this (seconds)
+        "breaker threshold": 5,  # failures in a row until the task is paused
+        "breaker cooldown": 60,  # seconds
+        "dedup window": 60 * 5,  # the same error is logged once per window (seconds)
+    },
+
+    # runs the background tasks (see ``runner``)
+    "scheduler": {
+        "shutdown timeout": 10,  # seconds to wait for running tasks on exit
+    },
+
     # automated background tasks
+    # each takes "cron" (e.g. "0 3 * * *", replaces "interval") and "jitter"
+    # (max random delay in seconds) too
     "runner": {
         "latency updater": {
             "start_after": 15,
             "interval": 60 * 5,  # 5 minutes
+            # only pinged if there was no traffic during the interval
             "target": f"http://127.0.0.1:{3333}",  # default port from this config
             "method": "GET",
-            "header": {"User-Agent": "Server LatencyUpdater"}
+            "header": {"User-Agent": "Server LatencyUpdater"},
+            "buffer_size": 288,  # 1 day of submissions
         },
         "log deleter": {
             "start_after": 10,
             "interval": 60 * 60,  # 60 minutes / 1 hour
+            "jitter": 60,
             "up_to": 7,  # 7 days / 1 week
         },
         "message deleter": {
             "start_after": 5,
             "interval": 60 * 60,  # 60 minutes / 1 hour
+            "jitter": 60,
             "up_to": 7,  # 7 days / 1 week
         },
+        # WAL-checkpoint, incremental vacuum and statistics of the query planner
+        "maintenance": {
+            "start_after": 60 * 2,
+            "interval": 60 * 60 * 6,  # 6 hours
+            "jitter": 60 * 5,
+            "vacuum_pages": 256,  # pages freed per step (4 KiB each by default)
+            "vacuum_pause": 0.05,  # between the steps, lets the writers through
+            "max_vacuum_steps": 1000,
+            # converts a database from before the incremental auto-vacuum with one
+            # full VACUUM (blocks the writers meanwhile, needs its size on the disk)
+            "convert": False,
+        },
+        # online copies of the database (also started by `POST admin/backup`)
+        "backup": {
+            "start_after": 60 * 10,
+            "interval": 60 * 60 * 24,  # 1 day
+            "jitter": 60 * 10,
+            "directory": "./backups",
+            "pages": 256,  # pages copied per step (4 KiB each by default)
+            "pause": 0.05,  # between the steps, lets the writers through
+            "keep": 7,  # the older backups are deleted
+        },
     },
 }
 # fmt: on
@@ -97,7 +253,23 @@ Config = JSONConfig(
     default_config=DEFAULT_CONFIG,
 )
 
-redis = Redis(
+REDIS_CALLS = registry.counter(
+    "redis_calls_total", "Commands sent to redis.", ("command",)
+)
+
+
+class InstrumentedRedis(Redis):
+    """
+    A :class:`Redis` which counts the executed commands.
+    """
+
+    def execute_command(self, *args, **options):
+        # ServerRateLimit sends some commands as one string ("ZADD key score member")
+        REDIS_CALLS.inc(str(args[0]).split(None, 1)[0].upper() if args else "UNKNOWN")
+        return super().execute_command(*args, **options)
+
+
+redis = InstrumentedRedis(
     host=Config["redis"]["host"],
     port=Config["redis"]["port"],
     db=Config["redis"]["db"],
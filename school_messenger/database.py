@@ -1,15 +1,81 @@
+import os
+import re
+import sys
+import atexit
 import sqlite3
+import threading
+import traceback
 import typing
-from hashlib import sha512
-from secrets import token_bytes
+from concurrent.futures import Future
 from base64 import b64encode, b64decode
 from datetime import datetime, timedelta
-
-
-__all__ = ("DataBase",)
+from time import time, perf_counter, monotonic, sleep
+from .cache import ACCOUNTS, MESSAGES, NEWEST_MESSAGE
+from .metrics import registry
+from .rows import AccountRow, MessageRow, LogRow, pack_headers, unpack_headers
+from .storage import AccountStorage, MessageStorage, LogStorage, Storage
+
+__all__ = (
+    "DataBase",
+    "SQLiteStorage",
+)
+
+
+QUERIES = registry.counter(
+    "sqlite_queries_total", "Executed SQLite statements.", ("statement",)
+)
+QUERY_DURATION = registry.histogram(
+    "sqlite_query_duration_seconds",
+    "Time spent executing SQLite statements.",
+    ("statement",),
+)
+LOG_QUEUE_DEPTH = registry.gauge(
+    "log_queue_depth", "Log entries which are waiting to be written."
+)
+
+DB_IN_FLIGHT = registry.gauge(
+    "sqlite_transactions_in_flight", "Open (outermost) SQLite transactions."
+)
+GROUP_COMMIT_SIZE = registry.histogram(
+    "group_commit_size",
+    "Messages written with one group commit.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+
+MAINTENANCE_DURATION = registry.histogram(
+    "sqlite_maintenance_duration_seconds",
+    "Time spent on the steps of the database maintenance.",
+    ("step",),
+)
+MAINTENANCE_RECLAIMED = registry.counter(
+    "sqlite_maintenance_reclaimed_bytes_total",
+    "Bytes the database files shrank by the maintenance.",
+)
+
+BACKUP_DURATION = registry.histogram(
+    "sqlite_backup_duration_seconds",
+    "Time the online backups took.",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+BACKUP_LAST_SUCCESS = registry.gauge(
+    "sqlite_backup_last_success_timestamp_seconds",
+    "When the last online backup was finished.",
+)
+
+# the writes which restart a backup without a snapshot until it's given up
+_BACKUP_MAX_RESTARTS = 3
+
+# the table a writing statement changes
+_WRITE_TABLE = re.compile(
+    r"\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+['\"]?(\w+)", re.IGNORECASE
+)
 
 
 class DatabaseBase:
+    _uri = False
+    # whether the transactions count as work on the database file
+    _tracked = True
+
     def __init__(self, database):
         """
         Parameters
@@ -17,33 +83,101 @@ class DatabaseBase:
         database: str
         """
         self._database = database
+        # every thread has its own connection, nested ``with`` blocks share it
+        self._local = threading.local()
+        self._replica: typing.Optional[ReadReplica] = None
 
     def __enter__(self):
-        self._connection = sqlite3.connect(self._database)
-        self._cursor = self._connection.cursor()
+        local = self._local
+        if not getattr(local, "depth", 0):
+            local.connection = sqlite3.connect(self._database, uri=self._uri)
+            local.cursor = local.connection.cursor()
+            local.depth = 0
+            local.on_commit = []
+            local.replicate = []
+            if self._tracked:
+                DB_IN_FLIGHT.inc()
+        local.depth += 1
         return self
 
     def __exit__(self, *_):
+        local = self._local
+        local.depth -= 1
+        if local.depth:
+            return
+
         try:
             # commit
             self.commit()
 
             # close
-            self._cursor.close()
-            self._connection.close()
+            local.cursor.close()
+            local.connection.close()
+        finally:
+            if self._tracked:
+                DB_IN_FLIGHT.dec()
+
+        # delete
+        del local.cursor
+        del local.connection
+
+        # the replica is updated before the callbacks announce the changes
+        writes, local.replicate = local.replicate, []
+        if writes and self._replica is not None:
+            try:
+                self._replica.apply(writes)
+            except sqlite3.Error:
+                # the copy diverged, the reads fall back to the database
+                traceback.print_exc(file=sys.stderr)
+                self._replica = None
+
+        callbacks, local.on_commit = local.on_commit, []
+        for callback in callbacks:
+            callback()
+
+    @property
+    def _cursor(self):
+        return self._local.cursor
+
+    @property
+    def _connection(self):
+        return self._local.connection
 
-            # delete
-            del self._cursor
-            del self._connection
+    def on_commit(self, callback):
+        """
+        Calls ``callback`` once the current (outermost) transaction is committed.
 
-        # already triggered?
-        except AttributeError:
-            pass
+        Parameters
+        ----------
+        callback: typing.Callable[[], typing.Any]
+        """
+        if getattr(self._local, "depth", 0):
+            self._local.on_commit.append(callback)
+        else:
+            callback()
 
     @property
     def database(self):
         return self._database
 
+    def reader(self) -> "DatabaseBase":
+        """
+        Returns
+        -------
+        DatabaseBase
+            The read replica if there is one, otherwise the database itself
+            (also within a transaction, so its own writes are visible).
+        """
+        if self._replica is None or getattr(self._local, "depth", 0):
+            return self
+        return self._replica
+
+    def _replicate(self, sql, parameters, many):
+        if self._replica is None:
+            return
+        if (match := _WRITE_TABLE.match(sql)) and match[1] in self._replica.tables:
+            self._local.replicate.append((sql, parameters, many))
+
     def execute(self, __sql, __parameters=()):
         """
         Shortcut for `sqlite3.Cursor.execute`
@@ -53,7 +187,36 @@ class DatabaseBase:
         __sql: str
         __parameters: typing.Iterable
         """
-        return self._cursor.execute(__sql, __parameters)
+        statement = __sql.lstrip()[:6].upper()
+        start = perf_counter()
+        try:
+            cursor = self._cursor.execute(__sql, __parameters)
+        finally:
+            QUERIES.inc(statement)
+            QUERY_DURATION.observe(perf_counter() - start, statement)
+        self._replicate(__sql, __parameters, False)
+        return cursor
+
+    def executemany(self, __sql, __seq_of_parameters):
+        """
+        Shortcut for `sqlite3.Cursor.executemany`
+
+        Parameters
+        ----------
+        __sql: str
+        __seq_of_parameters: typing.Iterable[typing.Iterable]
+        """
+        if self._replica is not None:
+            __seq_of_parameters = list(__seq_of_parameters)
+        statement = __sql.lstrip()[:6].upper()
+        start = perf_counter()
+        try:
+            cursor = self._cursor.executemany(__sql, __seq_of_parameters)
+        finally:
+            QUERIES.inc(statement)
+            QUERY_DURATION.observe(perf_counter() - start, statement)
+        self._replicate(__sql, __seq_of_parameters, True)
+        return cursor
 
     def fetchone(self):
         """
@@ -141,7 +304,78 @@ class DatabaseBase:
             )
 
 
-class AccountDB(DatabaseBase):
+class ReadReplica(DatabaseBase):
+    """
+    An in-memory copy of some tables of a database which serves the reads.
+
+    The copy is seeded with ``VACUUM INTO``, afterwards the writes to
+    the copied tables are applied as soon as they're committed to the
+    database (see :meth:`DatabaseBase.reader`).
+    Only the process which created it sees its changes, so it can't be used
+    with several worker processes.
+    """
+
+    _uri = True
+    _tracked = False
+
+    def __init__(self, database, tables):
+        """
+        Parameters
+        ----------
+        database: str
+            The database to copy.
+        tables: typing.Iterable[str]
+            The tables to keep (with their FTS shadow tables).
+        """
+        super().__init__(f"file:/school-messenger-replica-{id(self)}?vfs=memdb")
+        self.tables = frozenset(tables)
+        # the in-memory database lives as long as a connection to it is open
+        self._anchor = sqlite3.connect(
+            self._database, uri=True, check_same_thread=False
+        )
+
+        # unlike the backup API it resets the journal mode, the memdb-VFS
+        # can't open a copy in WAL-mode
+        source = sqlite3.connect(database)
+        try:
+            source.execute("VACUUM INTO ?", (self._database,))
+        finally:
+            source.close()
+
+        names = self._anchor.execute(
+            "SELECT name FROM sqlite_master WHERE type=='table'"
+        ).fetchall()
+        for (name,) in names:
+            if name.startswith("sqlite_"):
+                continue
+            if not any(
+                name == table or name.startswith(f"{table}_") for table in self.tables
+            ):
+                self._anchor.execute(f"DROP TABLE IF EXISTS {name!r}")
+        self._anchor.commit()
+
+    def apply(self, writes):
+        """
+        Applies writes which are committed to the database.
+
+        Parameters
+        ----------
+        writes: list[tuple[str, typing.Iterable, bool]]
+            The statements with their parameters and whether they're
+            executed with ``executemany``.
+        """
+        with self as db:
+            for sql, parameters, many in writes:
+                if many:
+                    db.executemany(sql, parameters)
+                else:
+                    db.execute(sql, parameters)
+
+    def close(self):
+        self._anchor.close()
+
+
+class AccountDB(DatabaseBase, AccountStorage):
     __TABLE_ACCOUNTS__ = "accounts"
 
     def setup_accounts(self):
@@ -173,24 +407,18 @@ class AccountDB(DatabaseBase):
         with self as db:
             try:
                 assert not name.isnumeric(), "This can be an ID!"
-                name = b64encode(name.encode("utf-8", "ignore")).decode("utf-8")
+                name = self._encode(name)
                 assert not db.findone(
                     self.__TABLE_ACCOUNTS__, "name", name
                 ), "User already registered!"
                 id = generate_id(1)  # noqa
-                password += str(id)
-                password = sha512(password.encode("utf-8", "ignore"))
-                password = password.hexdigest()
+                password = self._hash_password(password, id)
             except (AssertionError, ValueError):
                 return False
             else:
-                token = (
-                    b64encode(str(id).encode()).decode(),
-                    b64encode(token_bytes()).decode(),
-                )
-                token = token[0].rstrip("=") + "." + token[1].rstrip("=")
-                token = token.replace("+", "-").replace("/", "_")
+                token = self._new_token(id)
                 db.add(self.__TABLE_ACCOUNTS__, (id, name, password, token))
+                db.on_commit(ACCOUNTS.bump)
                 return token
 
     def account_token(self, name, password):
@@ -207,13 +435,12 @@ class AccountDB(DatabaseBase):
 
         with self as db:
             try:
-                name = b64encode(name.encode("utf-8", "ignore")).decode("utf-8")
+                name = self._encode(name)
                 user = db.findone(self.__TABLE_ACCOUNTS__, "name", name)
                 assert user is not None, "Invalid Name!"
-                password += str(user[0])
-                password += str(set_id_type(user[0], 1))
-                password = sha512(password.encode("utf-8", "ignore"))
-                password = password.hexdigest()
+                password = self._hash_password(
+                    password, user[0], set_id_type(user[0], 1)
+                )
                 assert password == user[2], "Invalid Password!"
             except AssertionError:
                 return
@@ -241,9 +468,7 @@ class AccountDB(DatabaseBase):
             with self as db:
                 try:
                     user = db.findone(self.__TABLE_ACCOUNTS__, "token", token)
-                    password += str(user[0])
-                    password = sha512(password.encode("utf-8", "ignore"))
-                    password = password.hexdigest()
+                    password = self._hash_password(password, user[0])
                     assert password == user[2], "Wrong Password!"
                     db.execute(
                         f"DELETE FROM {self.__TABLE_ACCOUNTS__!r} "
@@ -252,6 +477,7 @@ class AccountDB(DatabaseBase):
                 except AssertionError:
                     return False
                 else:
+                    db.on_commit(ACCOUNTS.bump)
                     return True
 
         elif token is None and password is None and id is not None:
@@ -272,6 +498,7 @@ class AccountDB(DatabaseBase):
                 except AssertionError:
                     return False
                 else:
+                    db.on_commit(ACCOUNTS.bump)
                     return True
 
         else:
@@ -287,20 +514,55 @@ class AccountDB(DatabaseBase):
 
         Returns
         -------
-        tuple[int, str]
+        AccountRow, optional
         """
-        with self as db:
+        with self.reader() as db:
             if query is not None:
-                if query.isnumeric():
-                    data = db.findone(self.__TABLE_ACCOUNTS__, "id", int(query))
+                if query.isdecimal():
+                    data = (
+                        db.findone(self.__TABLE_ACCOUNTS__, "id", int(query))
+                        if int(query) <= (1 << 63) - 1
+                        else None
+                    )
                 else:
-                    query = b64encode(query.encode("utf-8", "ignore")).decode("utf-8")
-                    data = db.findone(self.__TABLE_ACCOUNTS__, "name", query)
+                    data = db.findone(
+                        self.__TABLE_ACCOUNTS__, "name", self._encode(query)
+                    )
             else:
                 data = db.findone(self.__TABLE_ACCOUNTS__, "token", token)
             if data is None:
-                return ()
-            return data[0], b64decode(data[1].encode("utf-8", "ignore")).decode("utf-8")
+                return None
+            return AccountRow(data[0], data[1])
+
+    def accounts_info(self, queries):
+        """
+        Resolves many names and/or IDs with one query per kind.
+
+        Parameters
+        ----------
+        queries: list[str]
+
+        Returns
+        -------
+        dict[str, AccountRow]
+            The found accounts by query (missing queries aren't found).
+        """
+        ids, names = self._group_queries(queries)
+        names = {self._encode(name): matching for name, matching in names.items()}
+        found = {}
+        with self.reader() as db:
+            for column, values in (("id", ids), ("name", names)):
+                if not values:
+                    continue
+                db.execute(
+                    f"SELECT id, name FROM {self.__TABLE_ACCOUNTS__!r} "
+                    f"WHERE {column} IN ({', '.join('?' * len(values))})",
+                    tuple(values),
+                )
+                for id, name in db.fetchall():  # noqa
+                    for query in values[id if column == "id" else name]:
+                        found[query] = AccountRow(id, name)
+        return found
 
     def change_account_type(
         self,
@@ -327,11 +589,201 @@ class AccountDB(DatabaseBase):
                 f"WHERE id=={id}"
             )
             # fmt: on
+        ACCOUNTS.bump()
         return new_id
 
+    def export_accounts(self, after=None, amount=1000):
+        """
+        Parameters
+        ----------
+        after: int, optional
+            Only accounts with a higher ID are exported.
+        amount: int
+
+        Returns
+        -------
+        list[dict]
+            The accounts ordered by their IDs, the name decoded.
+        """
+        with self as db:
+            db.execute(
+                f"SELECT id, name, password, token FROM {self.__TABLE_ACCOUNTS__!r} "
+                f"WHERE id > ? ORDER BY id LIMIT ?",
+                (-1 if after is None else after, amount),
+            )
+            return [
+                {
+                    "id": id,
+                    "name": AccountRow(id, name).name,
+                    "password": password,
+                    "token": token,
+                }
+                for id, name, password, token in db.fetchall()  # noqa
+            ]
+
+    def import_accounts(self, rows):
+        """
+        Adds exported accounts (see :meth:`export_accounts`) with their IDs.
 
-class MessageDB(DatabaseBase):
+        Parameters
+        ----------
+        rows: list[dict]
+        """
+        with self as db:
+            db.executemany(
+                f"INSERT INTO {self.__TABLE_ACCOUNTS__!r} VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        row["id"],
+                        self._encode(row["name"]),
+                        row["password"],
+                        row["token"],
+                    )
+                    for row in rows
+                ],
+            )
+            db.on_commit(ACCOUNTS.bump)
+
+
+class GroupCommitQueue:
+    """
+    Collects the messages of concurrent writers and writes them with one
+    transaction, so many messages share one fsync.
+
+    The IDs are assigned and queued under one lock, so the messages are
+    committed in the order of their IDs.
+    """
+
+    # durability -> PRAGMA synchronous of the writer
+    DURABILITY = {
+        # answered after the commit is synced to the disk
+        "full": "FULL",
+        # answered after the commit (in WAL-mode lost on a power loss)
+        "normal": "NORMAL",
+        # answered once queued (lost if the process dies)
+        "queued": "NORMAL",
+    }
+
+    def __init__(
+        self,
+        database: "MessageDB",
+        *,
+        window: float = 5,
+        max_batch: int = 256,
+        durability: str = "full",
+    ):
+        """
+        Parameters
+        ----------
+        database: MessageDB
+        window: float
+            How long the writer waits for more messages after the first one
+            of a group (in ms).
+        max_batch: int
+            The max amount of messages per group.
+        durability: str
+            See :attr:`DURABILITY`.
+        """
+        if durability not in self.DURABILITY:
+            raise ValueError(
+                f"Invalid durability {durability!r}! "
+                f"(Must be one of {', '.join(self.DURABILITY)}!)"
+            )
+        self.database = database
+        self.window = window / 1000
+        self.max_batch = max_batch
+        self.durability = durability
+        self._pending: list[tuple[int, int, str, Future]] = []
+        self._condition = threading.Condition()
+        self._writer: typing.Optional[threading.Thread] = None
+        self._closed = False
+
+    def add(self, author, contents):
+        """
+        Parameters
+        ----------
+        author: int
+        contents: list[str]
+
+        Returns
+        -------
+        list[str]
+            The IDs (in the order of ``contents``).
+        """
+        from .utils import generate_ids  # noqa
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The queue is closed!")
+            ids = generate_ids(2, len(contents))
+            futures = []
+            for id, content in zip(ids, contents):  # noqa
+                futures.append(future := Future())
+                self._pending.append((id, author, content, future))
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._run,
+                    name="<Thread: Group Commit Writer>",
+                    daemon=True,
+                )
+                self._writer.start()
+            self._condition.notify()
+
+        if self.durability != "queued":
+            for future in futures:
+                future.result()
+        return [str(id) for id in ids]  # noqa
+
+    def close(self):
+        """
+        Writes the queued messages and stops the writer.
+        """
+        with self._condition:
+            self._closed = True
+            writer = self._writer
+            self._condition.notify()
+        if writer is not None:
+            writer.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                # let concurrent writers join the group
+                deadline = monotonic() + self.window
+                while (
+                    len(self._pending) < self.max_batch
+                    and not self._closed
+                    and (remaining := deadline - monotonic()) > 0
+                ):
+                    self._condition.wait(remaining)
+                batch = self._pending[: self.max_batch]
+                del self._pending[: self.max_batch]
+            self._write(batch)
+
+    def _write(self, batch):
+        GROUP_COMMIT_SIZE.observe(len(batch))
+        try:
+            with self.database as db:
+                db.execute(f"PRAGMA synchronous={self.DURABILITY[self.durability]}")
+                db._insert_messages([row[:3] for row in batch])  # noqa
+        except Exception as e:  # noqa
+            traceback.print_exc(file=sys.stderr)
+            for *_, future in batch:
+                future.set_exception(e)
+        else:
+            for id, *_, future in batch:  # noqa
+                future.set_result(id)
+
+
+class MessageDB(DatabaseBase, MessageStorage):
     __TABLE_MESSAGES__ = "messages"
+    # full-text index, the rowid is the id of the message
+    __TABLE_MESSAGES_FTS__ = "messages_fts"
+    _group_commit: typing.Optional[GroupCommitQueue] = None
 
     def setup_messages(self):
         with self as db:
@@ -344,30 +796,128 @@ class MessageDB(DatabaseBase):
             )
             """
             )
+            db.execute(f"SELECT max(id) FROM {self.__TABLE_MESSAGES__!r}")
+            NEWEST_MESSAGE.raise_to(db.fetchone()[0] or 0)
 
-    def add_message(self, author, content):
+            db.execute(
+                "SELECT null FROM sqlite_master WHERE name==?",
+                (self.__TABLE_MESSAGES_FTS__,),
+            )
+            if db.fetchone() is None:
+                db.execute(
+                    f"""
+                CREATE VIRTUAL TABLE {self.__TABLE_MESSAGES_FTS__!r} USING fts5(
+                    content,
+                    author  UNINDEXED
+                )
+                """
+                )
+                # index the already existing messages
+                db.execute(f"SELECT * FROM {self.__TABLE_MESSAGES__!r}")
+                while msgs := db.fetchmany(1000):
+                    db._connection.executemany(
+                        f"INSERT INTO {self.__TABLE_MESSAGES_FTS__!r} "
+                        f"(rowid, content, author) VALUES (?, ?, ?)",
+                        [
+                            (id, b64decode(content.encode("utf-8")).decode(), author)
+                            for id, author, content in msgs  # noqa
+                        ],
+                    )
+
+    def add_messages(self, author, contents):
         """
+        Adds all messages within one transaction (or with the next group
+        commit, see :class:`GroupCommitQueue`).
+
         Parameters
         ----------
         author: int
-        content: str
+        contents: list[str]
 
         Returns
         -------
-        str
+        list[str]
+            The IDs (in the order of ``contents``).
         """
-        from .utils import generate_id  # noqa
+        # within a transaction the queue would wait for this thread's own lock
+        if self._group_commit is not None and not getattr(self._local, "depth", 0):
+            return self._group_commit.add(author, contents)
+
+        from .utils import generate_ids  # noqa
 
+        ids = generate_ids(2, len(contents))
+        self._insert_messages(list(zip(ids, [author] * len(ids), contents)))
+        return [str(id) for id in ids]  # noqa
+
+    def _insert_messages(self, rows):
+        """
+        Parameters
+        ----------
+        rows: list[tuple[int, int, str]]
+            The IDs, authors and contents of the messages.
+        """
+        with self as db:
+            db.executemany(
+                f"INSERT INTO {self.__TABLE_MESSAGES__!r} VALUES (?, ?, ?)",
+                [
+                    (id, author, b64encode(content.encode("utf-8", "ignore")).decode())
+                    for id, author, content in rows  # noqa
+                ],
+            )
+            db.executemany(
+                f"INSERT INTO {self.__TABLE_MESSAGES_FTS__!r} "
+                f"(rowid, content, author) VALUES (?, ?, ?)",
+                [(id, content, author) for id, author, content in rows],  # noqa
+            )
+            newest = max((row[0] for row in rows), default=0)
+            db.on_commit(lambda: NEWEST_MESSAGE.raise_to(newest))
+            # a message of another worker can be older than the newest one
+            db.on_commit(MESSAGES.bump)
+
+    def export_messages(self, after=None, amount=1000):
+        """
+        Parameters
+        ----------
+        after: int, optional
+            Only messages with a higher ID are exported.
+        amount: int
+
+        Returns
+        -------
+        list[dict]
+            The messages ordered by their IDs, the content decoded.
+        """
         with self as db:
-            id = generate_id(2)  # noqa
-            content = b64encode(content.encode("utf-8", "ignore")).decode("utf-8")
-            db.add(self.__TABLE_MESSAGES__, (id, author, content))
-            return str(id)
+            db.execute(
+                f"SELECT id, author, content FROM {self.__TABLE_MESSAGES__!r} "
+                f"WHERE id > ? ORDER BY id LIMIT ?",
+                (-1 if after is None else after, amount),
+            )
+            return [
+                {
+                    "id": id,
+                    "author": author,
+                    "content": MessageRow(id, author, content).content,
+                }
+                for id, author, content in db.fetchall()  # noqa
+            ]
+
+    def import_messages(self, rows):
+        """
+        Adds exported messages (see :meth:`export_messages`) with their IDs.
+
+        Parameters
+        ----------
+        rows: list[dict]
+        """
+        self._insert_messages(
+            [(row["id"], row["author"], row["content"]) for row in rows]
+        )
 
     def delete_message(
         self,
         id: typing.Union[str, int],  # noqa
-    ) -> typing.Optional[tuple[int, int, str]]:
+    ) -> typing.Optional[MessageRow]:
         """
         Parameters
         ----------
@@ -375,7 +925,7 @@ class MessageDB(DatabaseBase):
 
         Returns
         -------
-        tuple[int, int, str], optional
+        MessageRow, optional
         """
         if not (msg := self.findone(self.__TABLE_MESSAGES__, "id", int(id))):
             return
@@ -385,8 +935,13 @@ class MessageDB(DatabaseBase):
                 f"DELETE FROM {self.__TABLE_MESSAGES__} " 
                 f"WHERE id=={id}"
             )
+            db.execute(
+                f"DELETE FROM {self.__TABLE_MESSAGES_FTS__} "
+                f"WHERE rowid=={id}"
+            )
             # fmt: on
-        return msg
+        MESSAGES.bump()
+        return MessageRow(*msg)
 
     def get_messages(self, maximum=20, before=-1, after=-1):
         """
@@ -396,29 +951,70 @@ class MessageDB(DatabaseBase):
 
         Returns
         -------
-        list[tuple[str, int, str]]
+        list[MessageRow]
         """
-        if before == -1:
-            # 18446744073709551615 -> 1111111111111111111111111111111111111111111111111111111111111111
-            before = 18446744073709551615
-        else:
-            before = ((before - 1609455600000) << 16) + 65535
-        if after == -1:
-            # 0 -> 0000000000000000000000000000000000000000000000000000000000000000
-            after = 0
-        else:
-            after = (after - 1609455600000) << 16
+        after, before = self._id_range(before, after)
 
-        with self as db:
+        with self.reader() as db:
             db.execute(
                 f"SELECT * FROM {self.__TABLE_MESSAGES__!r} "
-                f"WHERE {before} > id > {after} ORDER BY id DESC"
+                f"WHERE ? > id AND id > ? ORDER BY id DESC",
+                (before, after),
             )
-            msgs = db.fetchmany(maximum)
-            return [
-                (str(msg[0]), msg[1], b64decode(msg[2].encode("utf-8")).decode())
-                for msg in msgs
-            ]
+            return [MessageRow(*msg) for msg in db.fetchmany(maximum)]
+
+    def search_messages(
+        self,
+        query: str,
+        *,
+        author: int = None,
+        maximum: int = 20,
+        offset: int = 0,
+        before: int = -1,
+        after: int = -1,
+    ) -> list[MessageRow]:
+        """
+        Searches the messages, the best matches come first.
+
+        Parameters
+        ----------
+        query: str
+            The words to search for (all of them must be in the message).
+        author: int, optional
+            Only messages from this author.
+        maximum, offset: int
+            For the pagination.
+        before, after: int
+            UTC-timestamps (in ms), -1 to ignore them.
+
+        Returns
+        -------
+        list[MessageRow]
+        """
+        # every word is a quoted phrase, so no FTS5 syntax can be injected
+        match = " ".join(
+            '"{}"'.format(word.replace('"', '""')) for word in query.split()
+        )
+        if not match:
+            return []
+
+        sql = (
+            f"SELECT rowid, author, content FROM {self.__TABLE_MESSAGES_FTS__!r} "
+            f"WHERE {self.__TABLE_MESSAGES_FTS__} MATCH ?"
+        )
+        parameters = [match]
+        if author is not None:
+            sql += " AND author == ?"
+            parameters.append(int(author))
+        if before != -1 or after != -1:
+            sql += " AND rowid > ? AND rowid < ?"
+            parameters += self._id_range(before, after)
+        sql += " ORDER BY rank LIMIT ? OFFSET ?"
+        parameters += [maximum, offset]
+
+        with self.reader() as db:
+            db.execute(sql, parameters)
+            return [MessageRow(*msg, encoded=False) for msg in db.fetchall()]
 
     def delete_old_messages(
         self,
@@ -444,12 +1040,7 @@ class MessageDB(DatabaseBase):
         int
             The amount of deleted messages.
         """
-        if not already_id:
-            if isinstance(up_to, int):
-                up_to = datetime.now() - timedelta(days=up_to)
-            if isinstance(up_to, datetime):
-                up_to = up_to.timestamp() * 1000
-            up_to = int(up_to - 1609455600000) << 16
+        up_to = self._up_to_id(up_to, already_id)
 
         with self as db:
             # fmt: off
@@ -462,7 +1053,18 @@ class MessageDB(DatabaseBase):
                 f"DELETE FROM {self.__TABLE_MESSAGES__} "
                 f"WHERE id < {up_to}"
             )
+            db.execute(
+                f"DELETE FROM {self.__TABLE_MESSAGES_FTS__} "
+                f"WHERE rowid < {up_to}"
+            )
             # fmt: on
+            if many:
+                # merges the index segments, so the deleted entries are dropped
+                db.execute(
+                    f"INSERT INTO {self.__TABLE_MESSAGES_FTS__!r} "
+                    f"({self.__TABLE_MESSAGES_FTS__}) VALUES ('optimize')"
+                )
+                db.on_commit(MESSAGES.bump)
 
         # if we run this class directly and not from :class:`DataBase`
         if not isinstance(self, LogDB):
@@ -470,49 +1072,145 @@ class MessageDB(DatabaseBase):
         else:
             log_db = self
 
-        date = datetime.fromtimestamp(((up_to >> 16) + 1609455600000) / 1000).isoformat(
-            sep=" "
-        )
         log_db.add_log(
             level=log_db.LOG_LEVEL["INFO"],
             version=None,
             ip=None,
             msg=f"{many} messages deleted from database",
-            headers={"reason": f"older than {date}"},
+            headers={"reason": f"older than {self._id_date(up_to)}"},
         )
 
         return many
 
 
-class LogDB(DatabaseBase):
+class LogDB(DatabaseBase, LogStorage):
     __TABLE_LOGS__ = "logs"
-    LOG_LEVEL = {
-        "UNSET": 0,
-        "DEBUG": 1,
-        "INFO": 2,
-        "ERROR": 3,
-        "WARNING": 4,
-        "CRITICAL": 5,
-    }
+    # the versions, IPs and user agents of the logs (referenced by their id)
+    __TABLE_LOG_STRINGS__ = "log_strings"
 
-    def __init__(self, database, log_level=LOG_LEVEL["UNSET"]):
+    def __init__(self, database, log_level=LogStorage.LOG_LEVEL["UNSET"]):
         super().__init__(database)
         self._log_level = log_level
 
     def setup_logs(self):
         with self as db:
+            db.execute(
+                f"""
+            CREATE TABLE IF NOT EXISTS {self.__TABLE_LOG_STRINGS__!r} (
+                'id'        INTEGER PRIMARY KEY,
+                'value'     TEXT    UNIQUE  NOT NULL
+            )
+            """
+            )
+
+            db.execute(f"PRAGMA table_info({self.__TABLE_LOGS__!r})")
+            columns = {column[1] for column in db.fetchall()}
+            legacy = bool(columns) and "user_agent" not in columns
+            if legacy:
+                db.execute(
+                    f"ALTER TABLE {self.__TABLE_LOGS__!r} "
+                    f"RENAME TO {self.__TABLE_LOGS__ + '_legacy'!r}"
+                )
+
             db.execute(
                 f"""
             CREATE TABLE IF NOT EXISTS {self.__TABLE_LOGS__!r} (
-                'date'      TEXT    PRIMARY KEY,
-                'level'     INTEGER,
-                'version'   TEXT,
-                'ip'        TEXT,
-                'log'       TEXT,
-                'headers'   TEXT
+                'date'          TEXT    PRIMARY KEY,
+                'level'         INTEGER,
+                'version'       INTEGER,
+                'ip'            INTEGER,
+                'user_agent'    INTEGER,
+                'log'           TEXT,
+                'headers'       BLOB
             )
             """
             )
+            if legacy:
+                self._migrate_logs(self.__TABLE_LOGS__ + "_legacy")
+
+    def _migrate_logs(self, legacy):
+        """
+        Converts the logs of the old format (base64 and ``str(headers)``).
+
+        Parameters
+        ----------
+        legacy: str
+            The table with the old logs, it's dropped afterwards.
+        """
+        from ast import literal_eval
+
+        with self as db:
+            rows = db._connection.execute(f"SELECT * FROM {legacy!r}")  # noqa
+            while logs := rows.fetchmany(1000):
+                converted = []
+                for date, level, version, ip, msg, headers in logs:
+                    headers = b64decode(headers.encode("utf-8")).decode("utf-8")
+                    try:
+                        headers = literal_eval(headers)
+                        assert isinstance(headers, dict)
+                    except (ValueError, SyntaxError, AssertionError):
+                        headers = {"<raw>": headers}
+                    converted.append(
+                        self._pack_log(
+                            db,
+                            date,
+                            level,
+                            version,
+                            ip,
+                            b64decode(msg.encode("utf-8")).decode("utf-8"),
+                            headers,
+                        )
+                    )
+                db.executemany(
+                    f"INSERT OR IGNORE INTO {self.__TABLE_LOGS__!r} "
+                    f"VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    converted,
+                )
+            db.execute(f"DROP TABLE {legacy!r}")
+
+    def _intern(self, db, value):
+        """
+        Parameters
+        ----------
+        db: LogDB
+            The database within a transaction.
+        value: str, optional
+
+        Returns
+        -------
+        int, optional
+            The id of the value in the strings table.
+        """
+        # not cached, :meth:`delete_old_logs` deletes the unused strings and the
+        # other processes couldn't forget their cached ids then (within this
+        # write-transaction the id stays valid)
+        if value is None:
+            return None
+        db.execute(
+            f"INSERT OR IGNORE INTO {self.__TABLE_LOG_STRINGS__!r} (value) VALUES (?)",
+            (value,),
+        )
+        db.execute(
+            f"SELECT id FROM {self.__TABLE_LOG_STRINGS__!r} WHERE value==?",
+            (value,),
+        )
+        return db.fetchone()[0]
+
+    def _pack_log(self, db, date, level, version, ip, msg, headers):
+        headers = dict(headers or {})
+        agent = None
+        for name in list(headers):
+            if name.lower() == "user-agent":
+                agent = str(headers.pop(name))
+        return (
+            date,
+            level,
+            self._intern(db, version),
+            self._intern(db, ip),
+            self._intern(db, agent),
+            msg,
+            pack_headers(headers),
+        )
 
     def add_log(self, level, version, ip, msg, headers):
         """
@@ -523,24 +1221,21 @@ class LogDB(DatabaseBase):
         msg: str
         headers: dict, optional
         """
-        if level >= self._log_level:
+        if level < self._log_level:
+            return
+        LOG_QUEUE_DEPTH.inc()
+        try:
             with self as db:
                 now = datetime.utcnow().isoformat(sep=" ")
                 ip = ip or "nA"
                 version = version or "nA"
-                msg = b64encode(msg.encode("utf-8", "ignore")).decode("utf-8")
-                headers = b64encode(
-                    str(headers or {}).encode("utf-8", "ignore")
-                ).decode("utf-8")
-                db.add(self.__TABLE_LOGS__, (now, level, version, ip, msg, headers))
-                print(
-                    f"\033[32m{now}\033[0m\t"
-                    f"\033[31m{level}\033[0m\t"
-                    f"\033[36m{version}\033[0m\t"
-                    f"\033[37m{ip:15}\033[0m\t"
-                    f"\033[35m{b64decode(msg.encode('utf-8')).decode('utf-8')}\033[0m\t"
-                    f"\033[30m{b64decode(headers.encode('utf-8')).decode('utf-8')}\033[0m"
+                db.execute(
+                    f"INSERT INTO {self.__TABLE_LOGS__!r} VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    self._pack_log(db, now, level, version, ip, msg, headers),
                 )
+                self._echo_log(now, level, version, ip, msg, headers)
+        finally:
+            LOG_QUEUE_DEPTH.dec()
 
     def get_logs(self, maximum=-1, before=-1, after=-1):
         """
@@ -550,35 +1245,89 @@ class LogDB(DatabaseBase):
 
         Returns
         -------
-        list[tuple[str, str, str, str, str, str]]
+        list[LogRow]
         """
-        if before == -1:
-            before = datetime(9999, 12, 31, 23, 59, 59, 59)
-        else:
-            before = datetime.fromtimestamp(before / 1000)
-        if after == -1:
-            after = datetime(1, 1, 1)
-        else:
-            after = datetime.fromtimestamp(after / 1000)
+        after, before = self._date_range(before, after)
 
+        strings = self.__TABLE_LOG_STRINGS__
         with self as db:
             db.execute(
-                f"SELECT * FROM {self.__TABLE_LOGS__!r} "
-                f"WHERE {before.isoformat(sep=' ')!r} > date > {after.isoformat(sep=' ')!r} ORDER BY date DESC"
+                f"SELECT log.date, log.level, version.value, ip.value, agent.value, "
+                f"log.log, log.headers FROM {self.__TABLE_LOGS__!r} AS log "
+                f"LEFT JOIN {strings!r} AS version ON version.id == log.version "
+                f"LEFT JOIN {strings!r} AS ip ON ip.id == log.ip "
+                f"LEFT JOIN {strings!r} AS agent ON agent.id == log.user_agent "
+                f"WHERE ? > log.date AND log.date > ? ORDER BY log.date DESC",
+                (before, after),
+            )
+            return [LogRow(*log) for log in db.fetchmany(maximum)]
+
+    def export_logs(self, after=None, amount=1000):
+        """
+        Parameters
+        ----------
+        after: str, optional
+            Only logs with a later date are exported.
+        amount: int
+
+        Returns
+        -------
+        list[dict]
+            The logs ordered by their dates, the headers unpacked.
+        """
+        strings = self.__TABLE_LOG_STRINGS__
+        with self as db:
+            db.execute(
+                f"SELECT log.date, log.level, version.value, ip.value, agent.value, "
+                f"log.log, log.headers FROM {self.__TABLE_LOGS__!r} AS log "
+                f"LEFT JOIN {strings!r} AS version ON version.id == log.version "
+                f"LEFT JOIN {strings!r} AS ip ON ip.id == log.ip "
+                f"LEFT JOIN {strings!r} AS agent ON agent.id == log.user_agent "
+                f"WHERE log.date > ? ORDER BY log.date LIMIT ?",
+                ("" if after is None else after, amount),
             )
-            logs = db.fetchmany(maximum)
             return [
-                (
-                    log[0],
-                    str(log[1]),
-                    log[2],
-                    log[3],
-                    b64decode(log[4].encode("utf-8")).decode(),
-                    b64decode(log[5].encode("utf-8")).decode(),
-                )
-                for log in logs
+                {
+                    "date": date,
+                    "level": level,
+                    "version": version,
+                    "ip": ip,
+                    "user_agent": agent,
+                    "message": message,
+                    "headers": unpack_headers(headers),
+                }
+                for date, level, version, ip, agent, message, headers in db.fetchall()
             ]
 
+    def import_logs(self, rows):
+        """
+        Adds exported logs (see :meth:`export_logs`) with their dates.
+
+        Parameters
+        ----------
+        rows: list[dict]
+        """
+        with self as db:
+            db.executemany(
+                f"INSERT INTO {self.__TABLE_LOGS__!r} VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    self._pack_log(
+                        db,
+                        row["date"],
+                        row["level"],
+                        row["version"],
+                        row["ip"],
+                        row["message"],
+                        (
+                            row["headers"]
+                            if row["user_agent"] is None
+                            else {**row["headers"], "User-Agent": row["user_agent"]}
+                        ),
+                    )
+                    for row in rows
+                ],
+            )
+
     def delete_old_logs(self, up_to: typing.Union[datetime, int]):
         """
         Deletes old logs.
@@ -607,25 +1356,460 @@ class LogDB(DatabaseBase):
                 f"DELETE FROM {self.__TABLE_LOGS__} "
                 f"WHERE date < {up_to.isoformat(sep=' ')!r}"
             )
+            # the user agents and IPs are chosen by the clients, the strings
+            # of the deleted logs would pile up otherwise
+            strings = db.execute(
+                f"DELETE FROM {self.__TABLE_LOG_STRINGS__!r} WHERE id NOT IN ("
+                f"SELECT version FROM {self.__TABLE_LOGS__!r} WHERE version NOT NULL "
+                f"UNION SELECT ip FROM {self.__TABLE_LOGS__!r} WHERE ip NOT NULL "
+                f"UNION SELECT user_agent FROM {self.__TABLE_LOGS__!r} "
+                f"WHERE user_agent NOT NULL)"
+            ).rowcount
 
         self.add_log(
             level=self.LOG_LEVEL["INFO"],
             version=None,
             ip=None,
             msg=f"{many} logs deleted from log",
-            headers={"reason": f"older than {up_to.isoformat(sep=' ')}"},
+            headers={
+                "reason": f"older than {up_to.isoformat(sep=' ')}",
+                "strings deleted": strings,
+            },
         )
 
         return many
 
 
-class DataBase(AccountDB, MessageDB, LogDB):
+class DataBase(AccountDB, MessageDB, LogDB, Storage):
     """
     A morph of all DataBase models (AccountDB, MessageDB, LogDB).
+    The SQLite-engine of :class:`school_messenger.storage.Storage`.
     """
 
-    def __init__(self, database, log_level=0):
+    # the tables of :attr:`Storage.KEYS`
+    _tables = {
+        "accounts": AccountDB.__TABLE_ACCOUNTS__,
+        "messages": MessageDB.__TABLE_MESSAGES__,
+        "logs": LogDB.__TABLE_LOGS__,
+    }
+
+    def __init__(
+        self,
+        database,
+        log_level=0,
+        journal_mode=None,
+        read_replica=False,
+        group_commit=None,
+    ):
+        """
+        The database is set up with its first use (or :meth:`setup`), so
+        creating it is free.
+
+        Parameters
+        ----------
+        database: str
+        log_level: int
+        journal_mode: str, optional
+            E.g. ``"WAL"`` to let several processes share the file.
+        read_replica: bool
+            Whether the accounts and messages are read from an in-memory
+            copy (see :class:`ReadReplica`, only for a single process).
+        group_commit: dict, optional
+            The arguments for a :class:`GroupCommitQueue` which writes
+            the new messages.
+        """
         super().__init__(database=database, log_level=log_level)
-        self.setup_accounts()
-        self.setup_messages()
-        self.setup_logs()
+        if group_commit is not None:
+            self._group_commit = GroupCommitQueue(self, **group_commit)
+            atexit.register(self._group_commit.close)
+        self._journal_mode = journal_mode
+        self._read_replica = read_replica
+        self._ready = False
+        self._setting_up = False
+        self._setup_lock = threading.RLock()
+        self._backup_lock = threading.Lock()
+        self._backup_status: dict[str, typing.Any] = {"running": False}
+
+    def __enter__(self):
+        if not self._ready:
+            self.setup()
+        return super().__enter__()
+
+    def setup(self):
+        """
+        Creates the tables (within one transaction) and the read replica.
+        Other threads wait until it's done.
+        """
+        with self._setup_lock:
+            # the thread which sets up uses the database meanwhile
+            if self._ready or self._setting_up:
+                return
+            self._setting_up = True
+            try:
+                with self as db:
+                    db.execute("SELECT count(*) FROM sqlite_master")
+                    if not db.fetchone()[0]:
+                        # only possible before the first table is created,
+                        # lets the maintenance give free pages back
+                        db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                    if self._journal_mode is not None:
+                        # can't be changed within a transaction
+                        db.execute(f"PRAGMA journal_mode={self._journal_mode}")
+                    db.execute("BEGIN")
+                    self.setup_accounts()
+                    self.setup_messages()
+                    self.setup_logs()
+                if self._read_replica:
+                    self._replica = ReadReplica(
+                        self.database,
+                        (
+                            self.__TABLE_ACCOUNTS__,
+                            self.__TABLE_MESSAGES__,
+                            self.__TABLE_MESSAGES_FTS__,
+                        ),
+                    )
+                self._ready = True
+            finally:
+                self._setting_up = False
+
+    def count(self, table: str) -> int:
+        """
+        Parameters
+        ----------
+        table: str
+            One of :attr:`KEYS`.
+
+        Returns
+        -------
+        int
+        """
+        with self as db:
+            db.execute(f"SELECT count(*) FROM {self._tables[table]!r}")
+            return db.fetchone()[0]
+
+    def last_key(self, table: str) -> typing.Any:
+        """
+        Parameters
+        ----------
+        table: str
+            One of :attr:`KEYS`.
+
+        Returns
+        -------
+        typing.Any
+        """
+        with self as db:
+            db.execute(f"SELECT max({self.KEYS[table]}) FROM {self._tables[table]!r}")
+            return db.fetchone()[0]
+
+    def size(self) -> int:
+        """
+        Returns
+        -------
+        int
+            The size of the database files (with the WAL) in bytes.
+        """
+        return sum(
+            os.path.getsize(path)
+            for path in (self.database, f"{self.database}-wal")
+            if os.path.exists(path)
+        )
+
+    def maintain(
+        self,
+        *,
+        vacuum_pages: int = 256,
+        vacuum_pause: float = 0.05,
+        max_vacuum_steps: int = 1000,
+        convert: bool = False,
+    ) -> dict[str, typing.Any]:
+        """
+        Checkpoints the WAL, gives free pages back to the file system (in
+        small steps, so writers aren't blocked for long) and updates the
+        statistics of the query planner.
+
+        Parameters
+        ----------
+        vacuum_pages: int
+            The max amount of pages freed per step.
+        vacuum_pause: float
+            The pause between two steps (in s).
+        max_vacuum_steps: int
+            The max amount of steps per maintenance.
+        convert: bool
+            Whether a database without incremental auto-vacuum is converted.
+            That's one full ``VACUUM``, which blocks all writers until it's
+            done and needs free disk space of the database's size, so it's
+            opt-in. It's skipped if the database is busy.
+
+        Returns
+        -------
+        dict[str, typing.Any]
+            The report (durations in s, sizes in bytes).
+        """
+        report = {"size before": self.size()}
+
+        def step(name, function):
+            start = perf_counter()
+            result = function()
+            duration = perf_counter() - start
+            MAINTENANCE_DURATION.observe(duration, name)
+            report[f"{name} duration"] = round(duration, 4)
+            return result
+
+        def pragma(*statements):
+            with self as db:
+                for sql in statements:
+                    db.execute(sql)
+                return db.fetchall()
+
+        if pragma("PRAGMA auto_vacuum")[0][0] != 2 and convert:  # 2: incremental
+            try:
+                # the mode is kept by the connection until the VACUUM, which
+                # fails at once instead of waiting for the other writers
+                step(
+                    "convert",
+                    lambda: pragma(
+                        "PRAGMA busy_timeout=0",
+                        "PRAGMA auto_vacuum=INCREMENTAL",
+                        "VACUUM",
+                    ),
+                )
+            except sqlite3.OperationalError as error:
+                if "locked" not in str(error) and "busy" not in str(error):
+                    raise
+                # it's tried again with the next maintenance
+                report["convert"] = "skipped (busy)"
+
+        def vacuum():
+            steps = 0
+            while steps < max_vacuum_steps and pragma("PRAGMA freelist_count")[0][0]:
+                with self:
+                    # a cursor stops the pragma after its first page
+                    self._local.connection.executescript(
+                        f"PRAGMA incremental_vacuum({int(vacuum_pages)})"
+                    )
+                steps += 1
+                sleep(vacuum_pause)
+            return steps
+
+        if pragma("PRAGMA auto_vacuum")[0][0] == 2:
+            report["free pages"] = pragma("PRAGMA freelist_count")[0][0]
+            report["vacuum steps"] = step("vacuum", vacuum)
+
+        def analyze():
+            if not pragma("SELECT null FROM sqlite_master WHERE name=='sqlite_stat1'"):
+                pragma("ANALYZE")  # the first statistics
+            pragma("PRAGMA optimize")
+
+        step("analyze", analyze)
+
+        if pragma("PRAGMA journal_mode")[0][0].lower() == "wal":
+            # the vacuumed pages only leave the file with the checkpoint
+            # (busy, pages in the WAL, pages checkpointed)
+            report["checkpoint"] = step(
+                "checkpoint", lambda: pragma("PRAGMA wal_checkpoint(TRUNCATE)")[0]
+            )
+
+        report["size after"] = self.size()
+        report["reclaimed"] = max(0, report["size before"] - report["size after"])
+        MAINTENANCE_RECLAIMED.inc(amount=report["reclaimed"])
+
+        self.add_log(
+            level=self.LOG_LEVEL["INFO"],
+            version=None,
+            ip=None,
+            msg=f"database maintained, {report['reclaimed']} bytes reclaimed",
+            headers=report,
+        )
+        return report
+
+    def backup(
+        self,
+        directory: str,
+        *,
+        pages: int = 256,
+        pause: float = 0.05,
+        keep: int = 7,
+        background: bool = False,
+    ) -> dict[str, typing.Any]:
+        """
+        Copies the database while it's used, with the online backup API of
+        SQLite, into ``<directory>/<name>-<UTC date>.sqlite``.
+
+        The pages are copied in small steps with pauses between, so the
+        writers are only blocked briefly. In WAL-mode the copy is taken from
+        one snapshot, so writes during the backup don't restart it. Without
+        WAL the backup is given up if it's restarted too often, instead of
+        copying the rest at once (which would block the writers meanwhile).
+
+        Parameters
+        ----------
+        directory: str
+        pages: int
+            The pages copied per step.
+        pause: float
+            The pause between two steps (in s).
+        keep: int
+            How many backups are kept, the oldest ones are deleted.
+        background: bool
+            Whether the backup runs in a thread, this returns once it's
+            started.
+
+        Returns
+        -------
+        dict[str, typing.Any]
+            The report, or with ``background`` the status (see
+            :meth:`backup_status`).
+
+        Raises
+        ------
+        RuntimeError
+            If a backup is already running.
+        """
+        if not self._backup_lock.acquire(blocking=False):
+            raise RuntimeError("A backup is already running!")
+        self._backup_status = {**self._backup_status, "running": True}
+        if not background:
+            return self._locked_backup(directory, pages=pages, pause=pause, keep=keep)
+
+        def run():
+            try:
+                self._locked_backup(directory, pages=pages, pause=pause, keep=keep)
+            except Exception as e:  # noqa
+                traceback.print_exc(file=sys.stderr)
+                self.add_log(
+                    level=self.LOG_LEVEL["ERROR"],
+                    version=None,
+                    ip=None,
+                    msg=f"database backup failed: {type(e).__name__}: {e}",
+                    headers=self.backup_status(),
+                )
+
+        threading.Thread(
+            target=run, name="<Thread: Requested Backup>", daemon=True
+        ).start()
+        return self.backup_status()
+
+    def _locked_backup(self, directory, **kwargs):
+        # however the backup ends (also before it has its status), it's no
+        # longer running and the lock is free again
+        try:
+            return self._backup(directory, **kwargs)
+        except BaseException as e:
+            self._backup_status["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self._backup_status["running"] = False
+            self._backup_lock.release()
+
+    def _backup(self, directory, *, pages, pause, keep):
+        self.setup()
+        os.makedirs(directory, exist_ok=True)
+        name = os.path.splitext(os.path.basename(self.database))[0]
+        started = datetime.utcnow()
+        path = os.path.join(directory, f"{name}-{started:%Y%m%d-%H%M%S}.sqlite")
+        status = self._backup_status = {
+            "running": True,
+            "file": path,
+            "started": started.isoformat(timespec="seconds"),
+            "pages": None,
+            "remaining": None,
+            "last": self._backup_status.get("last"),
+        }
+        restarts = 0
+
+        def progress(_, remaining, total):
+            nonlocal restarts
+            if status["remaining"] is not None and remaining > status["remaining"]:
+                restarts += 1  # the database was changed meanwhile
+                if restarts > _BACKUP_MAX_RESTARTS:
+                    raise InterruptedError(f"restarted {restarts} times")
+            status["pages"], status["remaining"] = total, remaining
+            if remaining:
+                sleep(pause)
+
+        start = perf_counter()
+        source = sqlite3.connect(self.database, isolation_level=None)
+        target = sqlite3.connect(f"{path}.part")
+        try:
+            wal = source.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            if wal:
+                # a read-transaction doesn't block the writers in WAL-mode
+                source.execute("BEGIN")
+                source.execute("SELECT count(*) FROM sqlite_master").fetchall()
+            source.backup(target, pages=pages, progress=progress)
+            if wal:
+                source.execute("COMMIT")
+            # a single file without the WAL
+            target.execute("PRAGMA journal_mode=DELETE").fetchall()
+        except BaseException:
+            target.close()
+            os.remove(f"{path}.part")
+            raise
+        finally:
+            source.close()
+        target.close()
+        os.replace(f"{path}.part", path)
+        duration = perf_counter() - start
+        BACKUP_DURATION.observe(duration)
+        BACKUP_LAST_SUCCESS.set(value=time())
+
+        backups = self.backups(directory)
+        for file in backups[: max(0, len(backups) - keep)]:
+            os.remove(file)
+
+        status.update(
+            running=False,
+            last={
+                "file": path,
+                "size": os.path.getsize(path),
+                "duration": round(duration, 3),
+                "restarts": restarts,
+                "finished": datetime.utcnow().isoformat(timespec="seconds"),
+            },
+        )
+        self.add_log(
+            level=self.LOG_LEVEL["INFO"],
+            version=None,
+            ip=None,
+            msg=f"database backed up to {path}",
+            headers=status["last"],
+        )
+        return status["last"]
+
+    def backups(self, directory: str) -> list[str]:
+        """
+        Parameters
+        ----------
+        directory: str
+
+        Returns
+        -------
+        list[str]
+            The paths of the backups in ``directory``, the oldest first.
+        """
+        if not os.path.isdir(directory):
+            return []
+        name = os.path.splitext(os.path.basename(self.database))[0]
+        # the names sort by their dates
+        return [
+            os.path.join(directory, file)
+            for file in sorted(os.listdir(directory))
+            if file.startswith(f"{name}-") and file.endswith(".sqlite")
+        ]
+
+    def backup_status(self) -> dict[str, typing.Any]:
+        """
+        Returns
+        -------
+        dict[str, typing.Any]
+            Whether a backup is running (with its ``pages`` and the
+            ``remaining`` ones) and the report of the ``last`` one (``file``,
+            ``size`` in bytes, ``duration`` in s, ``finished``) of this
+            process.
+        """
+        return dict(self._backup_status)
+
+
+SQLiteStorage = DataBase
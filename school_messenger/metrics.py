@@ -0,0 +1,430 @@
+import typing
+from bisect import bisect_left
+from random import randrange
+from threading import Lock
+from time import perf_counter
+
+
+__all__ = (
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "Registry",
+    "Reservoir",
+    "StartupTimer",
+    "percentile",
+    "registry",
+    "CACHE_HITS",
+    "CACHE_MISSES",
+)
+
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    """
+    Parameters
+    ----------
+    labelnames, labelvalues: tuple[str, ...]
+    extra: tuple[tuple[str, str], ...]
+
+    Returns
+    -------
+    str
+    """
+    pairs = [*zip(labelnames, labelvalues), *extra]
+    if not pairs:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            '{}="{}"'.format(
+                k,
+                str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'),
+            )
+            for k, v in pairs
+        )
+        + "}"
+    )
+
+
+def _format_value(value):
+    """
+    Parameters
+    ----------
+    value: float
+
+    Returns
+    -------
+    str
+    """
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Parameters
+        ----------
+        name, documentation: str
+        labelnames: tuple[str, ...]
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = Lock()
+
+    def _check(self, labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(
+                "%s expects the labels %r, got %r"
+                % (self.name, self.labelnames, labelvalues)
+            )
+
+    def samples(self) -> typing.Iterator[tuple[str, str, float]]:
+        """
+        Yields ``(name, labels, value)`` for every series of this metric.
+        """
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            yield self.name, _format_labels(self.labelnames, labelvalues), value
+
+    def render(self) -> str:
+        """
+        Renders the metric in the Prometheus text format.
+
+        Returns
+        -------
+        str
+        """
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labelvalues, amount=1.0):
+        """
+        Parameters
+        ----------
+        *labelvalues: str
+        amount: float
+        """
+        self._check(labelvalues)
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def get(self, *labelvalues) -> float:
+        """
+        Parameters
+        ----------
+        *labelvalues: str
+
+        Returns
+        -------
+        float
+        """
+        return self._values.get(labelvalues, 0.0)
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labelvalues, amount=1.0):
+        """
+        Parameters
+        ----------
+        *labelvalues: str
+        amount: float
+        """
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, *labelvalues, value):
+        """
+        Parameters
+        ----------
+        *labelvalues: str
+        value: float
+        """
+        self._check(labelvalues)
+        with self._lock:
+            self._values[labelvalues] = float(value)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        Parameters
+        ----------
+        name, documentation: str
+        labelnames: tuple[str, ...]
+        buckets: tuple[float, ...]
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        """
+        Parameters
+        ----------
+        value: float
+            The observed value (in s for durations).
+        *labelvalues: str
+        """
+        self._check(labelvalues)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            if (series := self._values.get(labelvalues)) is None:
+                # [bucket counts..., +Inf count, sum]
+                series = self._values[labelvalues] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self) -> typing.Iterator[tuple[str, str, float]]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for labelvalues, series in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), series):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(
+                        self.labelnames, labelvalues, (("le", _format_value(bound)),)
+                    ),
+                    cumulative,
+                )
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_count", labels, cumulative
+            yield f"{self.name}_sum", labels, series[-1]
+
+
+class Registry:
+    """
+    An in-process collection of metrics which can be rendered for Prometheus.
+    """
+
+    def __init__(self, prefix="school_messenger"):
+        """
+        Parameters
+        ----------
+        prefix: str
+            Is prepended to every metric name.
+        """
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = Lock()
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        name = f"{self.prefix}_{name}" if self.prefix else name
+        with self._lock:
+            if (metric := self._metrics.get(name)) is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as {metric.type}")
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        """
+        Parameters
+        ----------
+        name, documentation: str
+        labelnames: tuple[str, ...]
+
+        Returns
+        -------
+        Counter
+        """
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        """
+        Parameters
+        ----------
+        name, documentation: str
+        labelnames: tuple[str, ...]
+
+        Returns
+        -------
+        Gauge
+        """
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        """
+        Parameters
+        ----------
+        name, documentation: str
+        labelnames: tuple[str, ...]
+        buckets: tuple[float, ...]
+
+        Returns
+        -------
+        Histogram
+        """
+        return self._get_or_create(
+            Histogram, name, documentation, labelnames, buckets=buckets
+        )
+
+    def render(self) -> str:
+        """
+        Renders all metrics in the Prometheus text format (version 0.0.4).
+
+        Returns
+        -------
+        str
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+class Reservoir:
+    """
+    Keeps a uniform sample of the values observed since the last drain.
+    """
+
+    def __init__(self, size=4096):
+        """
+        Parameters
+        ----------
+        size: int
+            The maximum amount of kept values.
+        """
+        self.size = size
+        self._values = []
+        self._seen = 0
+        self._lock = Lock()
+
+    def add(self, value):
+        """
+        Parameters
+        ----------
+        value: float
+        """
+        with self._lock:
+            self._seen += 1
+            if len(self._values) < self.size:
+                self._values.append(value)
+            elif (index := randrange(self._seen)) < self.size:
+                self._values[index] = value
+
+    def drain(self) -> list[float]:
+        """
+        Returns the kept values and starts a new sample.
+
+        Returns
+        -------
+        list[float]
+        """
+        with self._lock:
+            values, self._values, self._seen = self._values, [], 0
+        return values
+
+
+class StartupTimer:
+    """
+    Measures how long the phases of the startup take.
+    """
+
+    def __init__(self, started: float = None):
+        """
+        Parameters
+        ----------
+        started: float, optional
+            The ``time.perf_counter`` of the start (now by default).
+        """
+        self.phases: dict[str, float] = {}
+        self._last = perf_counter() if started is None else started
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def mark(self, phase: str) -> float:
+        """
+        Ends a phase, the next one starts now.
+
+        Parameters
+        ----------
+        phase: str
+
+        Returns
+        -------
+        float
+            The duration of the phase (in s).
+        """
+        now = perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+        return self.phases[phase]
+
+    def restart(self):
+        """
+        Forgets all phases (e.g. in a forked worker).
+        """
+        self.phases.clear()
+        self._last = perf_counter()
+
+
+def percentile(values, q) -> typing.Optional[float]:
+    """
+    Parameters
+    ----------
+    values: typing.Iterable[float]
+    q: float
+        The percentile (0 - 100).
+
+    Returns
+    -------
+    float, optional
+        The nearest-rank percentile or None if no values are given.
+    """
+    if not (values := sorted(values)):
+        return None
+    rank = max(1, min(len(values), round(q / 100 * len(values) + 0.5)))
+    return values[rank - 1]
+
+
+registry = Registry()
+
+CACHE_HITS = registry.counter(
+    "cache_hits_total", "Lookups answered from an in-process cache.", ("cache",)
+)
+CACHE_MISSES = registry.counter(
+    "cache_misses_total", "Lookups which missed an in-process cache.", ("cache",)
+)
@@ -0,0 +1,593 @@
+import re
+import json
+import zlib
+import typing
+from email.utils import formatdate
+from time import perf_counter
+from threading import Lock, Condition
+from .cache import (
+    ACCOUNTS,
+    MESSAGES,
+    NEWEST_MESSAGE,
+    make_etag,
+    etag_matches,
+    stage_revalidation,
+)
+from .config import Config
+from .database import DB_IN_FLIGHT
+from .metrics import registry, Reservoir, CACHE_HITS, CACHE_MISSES
+
+__all__ = (
+    "parse_path",
+    "MetricsMiddleware",
+    "ConditionalMiddleware",
+    "CompressionMiddleware",
+    "AdmissionMiddleware",
+    "REQUEST_LATENCIES",
+)
+
+
+REQUESTS = registry.counter(
+    "http_requests_total",
+    "Handled HTTP requests.",
+    ("version", "endpoint", "status"),
+)
+REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds",
+    "Time spent handling HTTP requests.",
+    ("version", "endpoint", "status"),
+)
+# raw samples (in ms) for the percentiles on statuspage.io
+REQUEST_LATENCIES = Reservoir()
+REQUESTS_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight", "HTTP requests which are currently handled."
+)
+
+ADMISSION_WAIT = registry.histogram(
+    "admission_queue_wait_seconds",
+    "Time requests waited for a free slot, by priority.",
+    ("priority",),
+)
+ADMISSION_SHED = registry.counter(
+    "admission_shed_total",
+    "Requests rejected with 503, by priority and reason.",
+    ("priority", "reason"),
+)
+ADMISSION_IN_FLIGHT = registry.gauge(
+    "admission_in_flight", "Admitted requests which are currently handled."
+)
+
+_VERSION_RE = re.compile(
+    "^/?"
+    + re.escape(Config["version"]["pattern"]).replace(
+        re.escape("{version}"), r"(?P<version>\d+)"
+    )
+    + r"(?=/|$)"
+)
+
+
+def parse_path(path: str) -> tuple[str, str]:
+    """
+    Splits a requested path into the version and the endpoint.
+
+    Parameters
+    ----------
+    path: str
+        The requested path (e.g. ``/v1/users/info``).
+
+    Returns
+    -------
+    tuple[str, str]
+        The version (the default version if none is given) and the endpoint
+        without leading or trailing slashes (``""`` for the default endpoint).
+    """
+    if match := _VERSION_RE.match(path):
+        return match.group("version"), path[match.end() :].strip("/")
+    return str(Config["version"]["default"]), path.strip("/")
+
+
+class MetricsMiddleware:
+    """
+    WSGI-middleware which records request metrics and serves them.
+    """
+
+    UNMATCHED = "<unmatched>"
+
+    def __init__(
+        self,
+        app,
+        *,
+        path: str = "/metrics",
+        allowed_ips: typing.Iterable[str] = ("127.0.0.1", "::1"),
+    ):
+        """
+        Parameters
+        ----------
+        app: callable
+            The WSGI-application to wrap.
+        path: str
+            The path the metrics are served at.
+        allowed_ips: typing.Iterable[str]
+            The IPs which are allowed to fetch the metrics.
+        """
+        self.app = app
+        self.path = path
+        self.allowed_ips = frozenset(allowed_ips)
+        # only endpoints which answered once with 2xx/3xx get their own label, so
+        # random paths can't blow up the series (the checks answering 401, 403,
+        # 429 or the 503 of the admission run for any path)
+        self._known_endpoints = set()
+        self._lock = Lock()
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO") == self.path:
+            return self.serve_metrics(environ, start_response)
+
+        status = ["500"]
+
+        def _start_response(status_line, headers, exc_info=None):
+            status[0] = status_line.split(None, 1)[0]
+            return start_response(status_line, headers, exc_info)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = perf_counter()
+        try:
+            return self.app(environ, _start_response)
+        finally:
+            duration = perf_counter() - start
+            REQUESTS_IN_FLIGHT.dec()
+            self.observe(environ.get("PATH_INFO", "/"), status[0], duration)
+
+    def observe(self, path: str, status: str, duration: float):
+        """
+        Parameters
+        ----------
+        path: str
+            The requested path.
+        status: str
+            The status code of the response.
+        duration: float
+            The time it took to handle the request (in s).
+        """
+        version, endpoint = parse_path(path)
+        if endpoint not in self._known_endpoints:
+            if status[:1] not in ("2", "3"):
+                version, endpoint = self.UNMATCHED, self.UNMATCHED
+            else:
+                with self._lock:
+                    self._known_endpoints.add(endpoint)
+        REQUESTS.inc(version, endpoint, status)
+        REQUEST_DURATION.observe(duration, version, endpoint, status)
+        REQUEST_LATENCIES.add(duration * 1000)
+
+    def serve_metrics(self, environ, start_response):
+        if environ.get("REMOTE_ADDR") not in self.allowed_ips:
+            start_response("403 Forbidden", [("Content-Length", "0")])
+            return [b""]
+        body = registry.render().encode("utf-8")
+        start_response(
+            "200 OK",
+            [
+                ("Content-Type", "text/plain; version=0.0.4; charset=utf-8"),
+                ("Content-Length", str(len(body))),
+            ],
+        )
+        return [body]
+
+
+class ConditionalMiddleware:
+    """
+    WSGI-middleware which adds ETags to rarely changing responses.
+
+    Whether the ``If-None-Match`` matches is staged for the handlers
+    (see :func:`school_messenger.cache.not_modified`), they answer 304 after
+    their checks (e.g. the rate-limits and the ``User-Agent``) and before they
+    use the database. The body of a 304 is dropped here.
+
+    The tags are built from the request and generations of the data
+    (see :mod:`school_messenger.cache`), never from the database.
+    """
+
+    def __init__(self, app, *, default_body: bytes):
+        """
+        Parameters
+        ----------
+        app: callable
+            The WSGI-application to wrap.
+        default_body: bytes
+            The static content of the default endpoint.
+        """
+        self.app = app
+        self.default_etag = make_etag("default", default_body)
+        self.rules = {
+            "": lambda _, __: (self.default_etag, []),
+            "users/info": self.user_etag,
+            "users/whoami": self.user_etag,
+            "messages": self.messages_etag,
+        }
+
+    @staticmethod
+    def user_etag(version: str, environ: dict) -> tuple[str, list]:
+        # the token is part of the tag, so the tags of the users never match
+        etag = make_etag(
+            version,
+            environ.get("PATH_INFO"),
+            environ.get("QUERY_STRING"),
+            environ.get("HTTP_AUTHORIZATION"),
+            environ.get("HTTP_QUERY"),
+            environ.get("HTTP_QUERIES"),
+            ACCOUNTS.value,
+        )
+        return etag, []
+
+    @staticmethod
+    def messages_etag(version: str, environ: dict) -> tuple[str, list]:
+        newest = NEWEST_MESSAGE.value
+        etag = make_etag(
+            version,
+            environ.get("PATH_INFO"),
+            environ.get("QUERY_STRING"),
+            environ.get("HTTP_AUTHORIZATION"),
+            environ.get("HTTP_AMOUNT"),
+            environ.get("HTTP_BEFORE"),
+            environ.get("HTTP_AFTER"),
+            newest,
+            MESSAGES.value,
+            ACCOUNTS.value,  # the names of the authors
+        )
+        headers = []
+        if newest:
+            # see WHITEPAPER.md (ID)
+            unix = ((newest >> 16) + 1609455600000) / 1000
+            headers.append(("Last-Modified", formatdate(unix, usegmt=True)))
+        return etag, headers
+
+    def __call__(self, environ, start_response):
+        if environ.get("REQUEST_METHOD") not in ("GET", "HEAD"):
+            return self.app(environ, start_response)
+        path = environ.get("PATH_INFO", "/")
+        version, endpoint = parse_path(path)
+        if (rule := self.rules.get(endpoint)) is None or (
+            not endpoint and path.strip("/")
+        ):
+            return self.app(environ, start_response)
+
+        etag, headers = rule(version, environ)
+        if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+        matches = etag_matches(if_none_match, etag)
+        not_modified = [False]
+
+        def _start_response(status, response_headers, exc_info=None):
+            if status.startswith("304") and matches:
+                not_modified[0] = True
+                status = "304 Not Modified"
+                response_headers = [
+                    (name, value)
+                    for name, value in response_headers
+                    if name.lower() not in ("content-length", "content-type")
+                ]
+            elif not status.startswith("200"):
+                return start_response(status, response_headers, exc_info)
+            if if_none_match:
+                (CACHE_HITS if not_modified[0] else CACHE_MISSES).inc("etag")
+            response_headers = [*response_headers, ("ETag", etag), *headers]
+            return start_response(status, response_headers, exc_info)
+
+        stage_revalidation(matches)
+        try:
+            result = self.app(environ, _start_response)
+        finally:
+            stage_revalidation(False)
+        if not matches:
+            return result
+        return self._without_body(result, not_modified)
+
+    @staticmethod
+    def _without_body(result, not_modified: list[bool]):
+        # the status may only be known while iterating
+        try:
+            for chunk in result:
+                if not not_modified[0]:
+                    yield chunk
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+
+class CompressionMiddleware:
+    """
+    WSGI-middleware which compresses large responses with gzip or deflate
+    (negotiated via ``Accept-Encoding``).
+
+    zlib releases the GIL while compressing, so other requests aren't
+    serialized behind a large response.
+    """
+
+    ENCODINGS = ("gzip", "deflate")
+
+    def __init__(self, app, *, min_size=1024, level=6):
+        """
+        Parameters
+        ----------
+        app: callable
+            The WSGI-application to wrap.
+        min_size: int
+            Smaller bodies are sent uncompressed (in bytes).
+        level: int
+            The compression level (1 - 9).
+        """
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+
+    @classmethod
+    def negotiate(cls, accept_encoding: str) -> typing.Optional[str]:
+        """
+        Parameters
+        ----------
+        accept_encoding: str
+            The value of the ``Accept-Encoding``-header.
+
+        Returns
+        -------
+        str, optional
+            The encoding to use or None.
+        """
+        accepted = {}
+        for part in accept_encoding.lower().split(","):
+            coding, _, params = part.strip().partition(";")
+            q = 1.0
+            if (params := params.strip()).startswith("q="):
+                try:
+                    q = float(params[2:])
+                except ValueError:
+                    q = 0.0
+            accepted[coding.strip()] = q
+        best = None
+        for encoding in cls.ENCODINGS:
+            q = accepted.get(encoding, accepted.get("*", 0.0))
+            if q > 0 and (best is None or q > best[1]):
+                best = encoding, q
+        return best and best[0]
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        """
+        Parameters
+        ----------
+        body: bytes
+        encoding: str
+            ``"gzip"`` or ``"deflate"``.
+
+        Returns
+        -------
+        bytes
+        """
+        wbits = 31 if encoding == "gzip" else 15
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, wbits)
+        return compressor.compress(body) + compressor.flush()
+
+    @staticmethod
+    def vary(headers: list) -> list:
+        """
+        Adds ``Accept-Encoding`` to ``Vary``, so shared caches don't serve an
+        uncompressed response to a client which accepts a compressed one (or
+        the other way around).
+
+        Parameters
+        ----------
+        headers: list[tuple[str, str]]
+
+        Returns
+        -------
+        list[tuple[str, str]]
+        """
+        headers = list(headers)
+        if any(name.lower() == "content-encoding" for name, _ in headers):
+            return headers  # encoded by the application, not by this middleware
+        for i, (name, value) in enumerate(headers):
+            if name.lower() == "vary":
+                if "accept-encoding" not in value.lower() and value.strip() != "*":
+                    headers[i] = (name, f"{value}, Accept-Encoding")
+                return headers
+        return headers + [("Vary", "Accept-Encoding")]
+
+    def __call__(self, environ, start_response):
+        encoding = self.negotiate(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        # the ETags are weak, so they're the same for all encodings
+        if encoding is None or environ.get("REQUEST_METHOD") == "HEAD":
+
+            def _vary_response(status, headers, exc_info=None):
+                return start_response(status, self.vary(headers), exc_info)
+
+            return self.app(environ, _vary_response)
+
+        response = []
+
+        def _start_response(status, headers, exc_info=None):
+            response[:] = [status, headers, exc_info]
+            return lambda data: body.append(data)  # legacy write()
+
+        body = []
+        result = self.app(environ, _start_response)
+        try:
+            body.extend(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        status, headers, exc_info = response
+        body = b"".join(body)
+
+        names = {name.lower() for name, _ in headers}
+        if (
+            len(body) < self.min_size
+            or "content-encoding" in names
+            or status[:3] in ("204", "304")
+        ):
+            start_response(status, self.vary(headers), exc_info)
+            return [body]
+
+        body = self.compress(body, encoding)
+        headers = [
+            (name, value)
+            for name, value in self.vary(headers)
+            if name.lower() != "content-length"
+        ]
+        headers += [
+            ("Content-Encoding", encoding),
+            ("Content-Length", str(len(body))),
+        ]
+        start_response(status, headers, exc_info)
+        return [body]
+
+
+class AdmissionMiddleware:
+    """
+    WSGI-middleware which limits the concurrently handled requests and
+    rejects requests with 503 (and ``Retry-After``) instead of letting them
+    queue up in front of a saturated database.
+
+    Reads and administration requests may use all slots, other writes only
+    a part of them and bulk writes the smallest part, so they're shed first.
+    While the database is saturated, all writes are shed right away.
+    """
+
+    HIGH = "high"  # reads and administration
+    NORMAL = "normal"  # writes
+    LOW = "low"  # bulk writes
+
+    BULK_ENDPOINTS = frozenset({"messages/batch"})
+
+    def __init__(
+        self,
+        app,
+        *,
+        max_in_flight: int = 64,
+        write_share: float = 0.75,
+        bulk_share: float = 0.5,
+        max_queue: int = 128,
+        max_wait: float = 250,
+        max_db_in_flight: int = 32,
+        retry_after: int = 1,
+    ):
+        """
+        Parameters
+        ----------
+        app: callable
+            The WSGI-application to wrap.
+        max_in_flight: int
+            The max amount of concurrently handled requests.
+        write_share, bulk_share: float
+            The part of ``max_in_flight`` writes and bulk writes may use.
+        max_queue: int
+            The max amount of requests waiting for a slot.
+        max_wait: float
+            How long a request waits for a slot (in ms).
+        max_db_in_flight: int
+            From how many open transactions on the database file (in this
+            process) writes are shed.
+        retry_after: int
+            The value of the ``Retry-After``-header (in s).
+        """
+        self.app = app
+        self.limits = {
+            self.HIGH: max_in_flight,
+            self.NORMAL: max(1, int(max_in_flight * write_share)),
+            self.LOW: max(1, int(max_in_flight * bulk_share)),
+        }
+        self.max_queue = max_queue
+        self.max_wait = max_wait / 1000
+        self.max_db_in_flight = max_db_in_flight
+        self.retry_after = retry_after
+        self._in_flight = 0
+        self._waiting = 0
+        self._condition = Condition()
+
+    def priority(self, environ) -> str:
+        """
+        Parameters
+        ----------
+        environ: dict
+
+        Returns
+        -------
+        str
+            :attr:`HIGH`, :attr:`NORMAL` or :attr:`LOW`.
+        """
+        _, endpoint = parse_path(environ.get("PATH_INFO", "/"))
+        if environ.get("REQUEST_METHOD") in ("GET", "HEAD", "OPTIONS"):
+            return self.HIGH
+        if endpoint == "admin" or endpoint.startswith("admin/"):
+            return self.HIGH
+        if endpoint in self.BULK_ENDPOINTS:
+            return self.LOW
+        return self.NORMAL
+
+    def acquire(self, priority: str) -> typing.Optional[str]:
+        """
+        Waits for a slot.
+
+        Parameters
+        ----------
+        priority: str
+
+        Returns
+        -------
+        str, optional
+            Why the request is shed or None if it's admitted.
+        """
+        if priority != self.HIGH and DB_IN_FLIGHT.get() >= self.max_db_in_flight:
+            return "database"
+
+        limit = self.limits[priority]
+        start = perf_counter()
+        with self._condition:
+            if self._in_flight >= limit:
+                if self._waiting >= self.max_queue:
+                    return "queue"
+                self._waiting += 1
+                try:
+                    deadline = start + self.max_wait
+                    while self._in_flight >= limit:
+                        if (remaining := deadline - perf_counter()) <= 0:
+                            return "timeout"
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_flight += 1
+        ADMISSION_WAIT.observe(perf_counter() - start, priority)
+        ADMISSION_IN_FLIGHT.inc()
+        return None
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+        ADMISSION_IN_FLIGHT.dec()
+
+    def __call__(self, environ, start_response):
+        priority = self.priority(environ)
+        if (reason := self.acquire(priority)) is not None:
+            ADMISSION_SHED.inc(priority, reason)
+            # like the responses of the application (see WHITEPAPER.md)
+            body = json.dumps({"message": "Server overloaded! (Retry later!)"})
+            body = body.encode("utf-8")
+            start_response(
+                "503 Service Unavailable",
+                [
+                    ("Content-Type", "application/json"),
+                    ("Content-Length", str(len(body))),
+                    ("Retry-After", str(self.retry_after)),
+                ],
+            )
+            return [body]
+
+        try:
+            result = self.app(environ, start_response)
+            # the body may still be produced while it's iterated
+            try:
+                return list(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+        finally:
+            self.release()
@@ -0,0 +1,499 @@
+"""
+Records the incoming requests and replays them against a server, e.g. to
+benchmark a change with the traffic of the production server::
+
+    python -m school_messenger.recording recordings/traffic.jsonl --speed 2
+
+The recording is written by :class:`RecordingMiddleware` (see the
+``"recording"`` config) as one JSON-object per request::
+
+    {"time": 1760000000.123, "version": "3", "method": "GET",
+     "path": "/v3/messages?amount=20", "headers": {"Amount": "20"},
+     "status": 200, "duration": 3.412}
+
+The headers and query parameters are sanitized like those of the request log,
+so redacted headers (e.g. ``Authorization``) must be given to the replay with
+``--header``. The conditional headers (``If-None-Match``, ``If-Modified-Since``)
+are always recorded. The tags of the recorded server don't match on the replayed
+one, so a replayed conditional request sends the validators the target sent for
+the same request before, which reproduces the share of 304s.
+The bodies aren't recorded, so only ``GET``, ``HEAD`` and ``OPTIONS`` are
+replayed unless ``--writes`` is given (then without a body).
+"""
+
+import os
+import sys
+import json
+import typing
+import argparse
+import threading
+from random import random
+from time import time, perf_counter, sleep
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from .config import Config
+from .metrics import percentile
+from .middleware import parse_path
+from .requestlog import RequestLog, request_log
+
+__all__ = (
+    "RequestRecorder",
+    "RecordingMiddleware",
+    "load_recording",
+    "replay",
+)
+
+
+# the methods which are replayed without ``--writes``
+READ_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+# recorded besides the headers of the request log (they contain no secrets), and
+# the response headers which provide their values in the replay
+CONDITIONAL_HEADERS = {
+    "If-None-Match": "ETag",
+    "If-Modified-Since": "Last-Modified",
+}
+
+
+def _environ_headers(environ) -> dict[str, str]:
+    headers = {}
+    for key, value in environ.items():
+        if key.startswith("HTTP_"):
+            headers[key[5:].replace("_", "-").title()] = value
+        elif key in ("CONTENT_LENGTH", "CONTENT_TYPE") and value:
+            headers[key.replace("_", "-").title()] = value
+    return headers
+
+
+class RequestRecorder:
+    """
+    Appends the requests to a JSONL-file.
+
+    Each request is one ``write`` to a file opened with ``O_APPEND``, so the
+    lines of several threads and workers don't mix.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        log: RequestLog = request_log,
+        rate: float = 1.0,
+        max_size: int = 100 * 2**20,
+    ):
+        """
+        Parameters
+        ----------
+        path: str
+            The file, it's created with its directory.
+        log: RequestLog
+            Sanitizes the headers and caps the path.
+        rate: float
+            The part of the requests which is recorded (0 - 1).
+        max_size: int
+            The recording stops once the file has this size (in bytes).
+        """
+        self.path = path
+        self.log = log
+        self.rate = rate
+        self.max_size = max_size
+        self.recording = True
+        self._fd: typing.Optional[int] = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def sanitize_headers(self, headers: dict[str, str]) -> dict[str, str]:
+        """
+        Parameters
+        ----------
+        headers: dict[str, str]
+
+        Returns
+        -------
+        dict[str, str]
+            The headers sanitized by :attr:`log`, with the
+            :data:`CONDITIONAL_HEADERS`.
+        """
+        conditional = {
+            name: self.log.cap(headers.pop(name))
+            for name in CONDITIONAL_HEADERS
+            if name in headers
+        }
+        return {**self.log.sanitize_headers(headers), **conditional}
+
+    def record(
+        self,
+        environ,
+        status: typing.Optional[int],
+        started: float,
+        duration: float,
+    ):
+        """
+        Parameters
+        ----------
+        environ: dict
+            The WSGI-environ of the request.
+        status: int, optional
+            The status of the response (None if it failed).
+        started: float
+            When the request came in (as from ``time.time``).
+        duration: float
+            The time it took to handle the request (in s).
+        """
+        if not self.recording or (self.rate < 1 and random() >= self.rate):
+            return
+        path = environ.get("PATH_INFO", "/")
+        version, _ = parse_path(path)
+        if query := environ.get("QUERY_STRING"):
+            path = f"{path}?{self.log.sanitize_query(query)}"
+        line = json.dumps(
+            {
+                "time": round(started, 6),
+                "version": version,
+                "method": environ.get("REQUEST_METHOD", "GET"),
+                "path": self.log.cap(path),
+                "headers": self.sanitize_headers(_environ_headers(environ)),
+                "status": status,
+                "duration": round(duration * 1000, 3),
+            },
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        data = f"{line}\n".encode("utf-8")
+
+        with self._lock:
+            try:
+                if self._fd is None:
+                    if directory := os.path.dirname(self.path):
+                        os.makedirs(directory, exist_ok=True)
+                    self._fd = os.open(
+                        self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600
+                    )
+                    self._size = os.fstat(self._fd).st_size
+                if self._size + len(data) > self.max_size:
+                    self.recording = False
+                    return
+                os.write(self._fd, data)
+                self._size += len(data)
+            except OSError:
+                # a full disk mustn't break the requests
+                self.recording = False
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class RecordingMiddleware:
+    """
+    WSGI-middleware which passes each handled request to a
+    :class:`RequestRecorder`.
+    """
+
+    def __init__(self, app, recorder: RequestRecorder):
+        """
+        Parameters
+        ----------
+        app: callable
+            The WSGI-application to wrap.
+        recorder: RequestRecorder
+        """
+        self.app = app
+        self.recorder = recorder
+
+    def __call__(self, environ, start_response):
+        status = [None]
+
+        def _start_response(status_line, headers, exc_info=None):
+            status[0] = int(status_line.split(None, 1)[0])
+            return start_response(status_line, headers, exc_info)
+
+        started = time()
+        start = perf_counter()
+        try:
+            return self.app(environ, _start_response)
+        finally:
+            self.recorder.record(environ, status[0], started, perf_counter() - start)
+
+
+def load_recording(path: str) -> list[dict]:
+    """
+    Parameters
+    ----------
+    path: str
+
+    Returns
+    -------
+    list[dict]
+        The requests in the order they came in, broken lines (e.g. the last
+        one of a killed server) are skipped.
+    """
+    entries = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entry, dict) and {"time", "method", "path"} <= entry.keys():
+                entries.append(entry)
+    entries.sort(key=lambda entry: entry["time"])
+    return entries
+
+
+def _endpoint(entry: typing.Mapping) -> str:
+    version, endpoint = parse_path(urlsplit(entry["path"]).path)
+    pattern = Config["version"]["pattern"].format(version=version)
+    return f"{entry['method']} {pattern}/{endpoint}"
+
+
+def _distribution(values: list[float]) -> dict[str, typing.Optional[float]]:
+    def _round(value):
+        return None if value is None else round(value, 3)
+
+    return {
+        "mean": _round(sum(values) / len(values)) if values else None,
+        "p50": _round(percentile(values, 50)),
+        "p90": _round(percentile(values, 90)),
+        "p95": _round(percentile(values, 95)),
+        "p99": _round(percentile(values, 99)),
+        "max": _round(max(values, default=None)),
+    }
+
+
+def replay(
+    entries: typing.Sequence[typing.Mapping],
+    target: str,
+    *,
+    speed: float = 1.0,
+    concurrency: int = 16,
+    writes: bool = False,
+    headers: typing.Mapping[str, str] = None,
+    timeout: float = 10,
+    progress: bool = False,
+) -> dict[str, typing.Any]:
+    """
+    Sends the recorded requests again, with the pauses of the recording.
+
+    Parameters
+    ----------
+    entries: typing.Sequence[typing.Mapping]
+        See :func:`load_recording`.
+    target: str
+        The server, e.g. ``http://127.0.0.1:3333``.
+    speed: float
+        Scales the pauses between the requests (2 is twice as fast), 0 sends
+        them as fast as possible.
+    concurrency: int
+        The max requests which are sent at the same time. If all are busy,
+        the requests are sent late, which is reported as ``lag``.
+    writes: bool
+        Whether the requests of other methods than :data:`READ_METHODS` are
+        replayed too (without their body).
+    headers: typing.Mapping[str, str], optional
+        Added to each request, e.g. for the redacted ``Authorization``.
+    timeout: float
+        Per request (in s).
+    progress: bool
+        Whether the progress is shown on stderr.
+
+    Returns
+    -------
+    dict[str, typing.Any]
+        The latencies (in ms, with the ones of the recording for comparison),
+        per endpoint too, and the statuses.
+    """
+    from requests import Session, RequestException
+
+    sent = [entry for entry in entries if writes or entry["method"] in READ_METHODS]
+    target = target.rstrip("/")
+    extra = dict(headers or {})
+    local = threading.local()
+    results = []  # (entry, status, latency, lag)
+    # the validators the target sent per request (see CONDITIONAL_HEADERS)
+    validators: dict[tuple, dict[str, str]] = {}
+
+    def send(entry, due):
+        if not hasattr(local, "session"):
+            local.session = Session()
+        lag = (perf_counter() - due) * 1000
+        request_headers = {
+            name: value
+            for name, value in entry.get("headers", {}).items()
+            if not name.startswith("<")
+            and value != RequestLog.REDACTED
+            and name.lower() != "content-length"
+            and name not in CONDITIONAL_HEADERS
+        }
+        request_headers.update(extra)
+        key = (entry["method"], entry["path"], tuple(sorted(request_headers.items())))
+        request_headers.update(
+            (name, value)
+            for name, value in validators.get(key, {}).items()
+            if name in entry.get("headers", {})
+        )
+        start = perf_counter()
+        try:
+            response = local.session.request(
+                entry["method"],
+                target + entry["path"],
+                headers=request_headers,
+                timeout=timeout,
+            )
+            response.content  # noqa
+            status = response.status_code
+            if seen := {
+                name: response.headers[header]
+                for name, header in CONDITIONAL_HEADERS.items()
+                if header in response.headers
+            }:
+                validators[key] = seen
+        except RequestException:
+            status = None
+        results.append((entry, status, (perf_counter() - start) * 1000, lag))
+
+    started = perf_counter()
+    shown = started
+    with ThreadPoolExecutor(concurrency) as executor:
+        first = sent[0]["time"] if sent else 0
+        for number, entry in enumerate(sent, 1):
+            due = started + ((entry["time"] - first) / speed if speed > 0 else 0)
+            if (pause := due - perf_counter()) > 0:
+                sleep(pause)
+            executor.submit(send, entry, due)
+            if progress and (now := perf_counter()) - shown >= 1:
+                shown = now
+                print(
+                    f"\r{number}/{len(sent)} requests ({len(results)} answered)",
+                    end="",
+                    file=sys.stderr,
+                    flush=True,
+                )
+    duration = perf_counter() - started
+    if progress:
+        print(f"\r{len(sent)}/{len(sent)} requests", file=sys.stderr, flush=True)
+
+    statuses: dict[str, int] = {}
+    per_endpoint: dict[str, tuple[list, list]] = {}
+    for entry, status, latency, _ in results:
+        key = "error" if status is None else str(status)
+        statuses[key] = statuses.get(key, 0) + 1
+        latencies, recorded = per_endpoint.setdefault(_endpoint(entry), ([], []))
+        latencies.append(latency)
+        if entry.get("duration") is not None:
+            recorded.append(entry["duration"])
+
+    return {
+        "requests": len(results),
+        "skipped": len(entries) - len(sent),
+        "duration": round(duration, 3),
+        "throughput": round(len(results) / duration, 3) if duration else None,
+        "statuses": statuses,
+        "latency": _distribution([result[2] for result in results]),
+        "recorded latency": _distribution(
+            [e["duration"] for e, *_ in results if e.get("duration") is not None]
+        ),
+        "lag": _distribution([result[3] for result in results]),
+        "endpoints": {
+            endpoint: {
+                "requests": len(latencies),
+                "latency": _distribution(latencies),
+                "recorded latency": _distribution(recorded),
+            }
+            for endpoint, (latencies, recorded) in sorted(
+                per_endpoint.items(), key=lambda item: -len(item[1][0])
+            )
+        },
+    }
+
+
+def _print_report(report: typing.Mapping):
+    def _line(distribution):
+        return "  ".join(
+            f"{name} {'-' if value is None else f'{value:g}'}"
+            for name, value in distribution.items()
+        )
+
+    print(
+        f"{report['requests']} requests in {report['duration']}s "
+        f"({report['throughput']}/s), {report['skipped']} skipped"
+    )
+    print(f"statuses: {report['statuses']}")
+    print(f"latency (ms):  {_line(report['latency'])}")
+    print(f"recorded (ms): {_line(report['recorded latency'])}")
+    print(f"lag (ms):      {_line(report['lag'])}")
+    for endpoint, summary in report["endpoints"].items():
+        print(f"{endpoint}: {summary['requests']} requests")
+        print(f"    latency (ms):  {_line(summary['latency'])}")
+        print(f"    recorded (ms): {_line(summary['recorded latency'])}")
+
+
+def main(argv: typing.Sequence[str] = None):
+    """
+    The command line of :func:`replay`.
+
+    Parameters
+    ----------
+    argv: typing.Sequence[str], optional
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m school_messenger.recording",
+        description="Replays recorded requests and reports their latencies.",
+    )
+    parser.add_argument("file", help="the recording (JSONL)")
+    parser.add_argument(
+        "--target",
+        default=f"http://127.0.0.1:{Config['port']}",
+        help="the server (default: the port from the config)",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="scales the pauses (2 is twice as fast, 0 as fast as possible)",
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--limit", type=int, help="replay only the first requests")
+    parser.add_argument(
+        "--writes", action="store_true", help="replay POST, DELETE, ... too"
+    )
+    parser.add_argument(
+        "--header",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="added to each request, e.g. for the redacted headers",
+    )
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    headers = {}
+    for header in args.header:
+        name, separator, value = header.partition("=")
+        if not separator:
+            parser.error(f"Invalid header {header!r}! (Must be NAME=VALUE!)")
+        headers[name.strip()] = value.strip()
+
+    entries = load_recording(args.file)
+    if args.limit is not None:
+        entries = entries[: args.limit]
+    report = replay(
+        entries,
+        args.target,
+        speed=args.speed,
+        concurrency=args.concurrency,
+        writes=args.writes,
+        headers=headers,
+        timeout=args.timeout,
+        progress=not args.json,
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
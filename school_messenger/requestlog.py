@@ -0,0 +1,254 @@
+import typing
+from random import random
+from threading import local
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from .config import Config
+from .middleware import parse_path
+from .utils import database
+
+
+__all__ = (
+    "RequestLog",
+    "RequestLogMiddleware",
+    "request_log",
+)
+
+
+class RequestLog:
+    """
+    Writes a sample of the requests into the log, without secrets (the query
+    parameters are sanitized like the headers of the same name).
+
+    The entry of a request is staged while it's handled (see
+    :class:`RequestLogMiddleware`), so requests answered with an error are
+    always logged, even if they aren't sampled.
+    Without the middleware the sampled requests are logged immediately.
+    """
+
+    REDACTED = "<redacted>"
+
+    def __init__(
+        self,
+        *,
+        rate: float = 0.01,
+        endpoint_rates: typing.Mapping[str, float] = None,
+        always_status: int = 400,
+        allowed_headers: typing.Iterable[str] = (),
+        redacted_headers: typing.Iterable[str] = ("Authorization", "Password"),
+        max_field_size: int = 256,
+    ):
+        """
+        Parameters
+        ----------
+        rate: float
+            The part of the requests which is logged (0 - 1).
+        endpoint_rates: typing.Mapping[str, float], optional
+            Rates for single endpoints (e.g. ``{"users/registration": 1}``).
+        always_status: int
+            Responses with this status or above are always logged.
+        allowed_headers: typing.Iterable[str]
+            The headers which are logged, the others are only counted.
+        redacted_headers: typing.Iterable[str]
+            The headers which are logged without their value.
+        max_field_size: int
+            The max length of the logged URL and of each header value.
+        """
+        self.rate = rate
+        self.endpoint_rates = dict(endpoint_rates or {})
+        self.always_status = always_status
+        self.allowed_headers = {h.lower() for h in allowed_headers}
+        self.redacted_headers = {h.lower() for h in redacted_headers}
+        self.max_field_size = max_field_size
+        self._local = local()
+
+    def cap(self, value: typing.Any) -> str:
+        """
+        Parameters
+        ----------
+        value: typing.Any
+
+        Returns
+        -------
+        str
+            The value, shortened to :attr:`max_field_size`.
+        """
+        value = str(value)
+        if (cut := len(value) - self.max_field_size) > 0:
+            return f"{value[: self.max_field_size]}... (+{cut})"
+        return value
+
+    def sanitize_headers(self, headers: typing.Mapping[str, str]) -> dict[str, str]:
+        """
+        Parameters
+        ----------
+        headers: typing.Mapping[str, str]
+
+        Returns
+        -------
+        dict[str, str]
+            The allowed headers with capped values, the redacted ones
+            without their value.
+        """
+        sanitized = {}
+        dropped = 0
+        for name, value in (headers or {}).items():
+            key = name.lower()
+            if key in self.redacted_headers:
+                sanitized[name] = self.REDACTED
+            elif key in self.allowed_headers:
+                sanitized[name] = self.cap(value)
+            else:
+                dropped += 1
+        if dropped:
+            sanitized["<dropped>"] = str(dropped)
+        return sanitized
+
+    def sanitize_query(self, query: str) -> str:
+        """
+        Parameters
+        ----------
+        query: str
+            The query string of a URL (without ``?``).
+
+        Returns
+        -------
+        str
+            The query with the capped values of the allowed parameters, the
+            values of the others are redacted (their names are kept).
+        """
+        parameters = []
+        for name, value in parse_qsl(query, keep_blank_values=True):
+            key = name.lower()
+            if key in self.allowed_headers and key not in self.redacted_headers:
+                parameters.append((name, self.cap(value)))
+            else:
+                parameters.append((name, self.REDACTED))
+        return urlencode(parameters, safe="<>")
+
+    def sanitize_url(self, url: typing.Any) -> str:
+        """
+        Parameters
+        ----------
+        url: typing.Any
+
+        Returns
+        -------
+        str
+            The URL with a sanitized query (see :meth:`sanitize_query`).
+        """
+        parts = urlsplit(str(url))
+        if not parts.query:
+            return urlunsplit(parts._replace(fragment=""))
+        query = self.sanitize_query(parts.query)
+        return urlunsplit(parts._replace(query=query, fragment=""))
+
+    def sampled(self, endpoint: str) -> bool:
+        """
+        Parameters
+        ----------
+        endpoint: str
+
+        Returns
+        -------
+        bool
+        """
+        return random() < self.endpoint_rates.get(endpoint, self.rate)
+
+    def stage(self, request):
+        """
+        Logs the request (if it's sampled) or stages it until
+        :meth:`finish` knows the status of the response.
+
+        Parameters
+        ----------
+        request: NAA.APIRequest
+        """
+        _, endpoint = parse_path(urlsplit(str(request.url)).path)
+        entry = (request, self.sampled(endpoint))
+        if getattr(self._local, "active", False):
+            self._local.entry = entry
+        elif entry[1]:
+            self.write(request)
+
+    def begin(self):
+        """
+        Starts staging the entries of this thread (a request is handled).
+        """
+        self._local.active = True
+        self._local.entry = None
+
+    def finish(self, status: typing.Optional[int]):
+        """
+        Logs the staged entry if it's sampled or the response is an error.
+
+        Parameters
+        ----------
+        status: int, optional
+            The status of the response (None if it failed).
+        """
+        entry, self._local.entry = getattr(self._local, "entry", None), None
+        self._local.active = False
+        if entry is None:
+            return
+        request, sampled = entry
+        if sampled or status is None or status >= self.always_status:
+            self.write(request, status)
+
+    def write(self, request, status: int = None):
+        """
+        Parameters
+        ----------
+        request: NAA.APIRequest
+        status: int, optional
+        """
+        headers = self.sanitize_headers(request.headers)
+        if status is not None:
+            headers["<status>"] = str(status)
+        database.add_log(
+            level=database.LOG_LEVEL["DEBUG"],
+            version=request.version,
+            ip=request.ip,
+            msg=self.cap(f"{request.method} {self.sanitize_url(request.url)}"),
+            headers=headers,
+        )
+
+
+class RequestLogMiddleware:
+    """
+    WSGI-middleware which lets :class:`RequestLog` log a request after its
+    response status is known.
+    """
+
+    def __init__(self, app, log: RequestLog):
+        """
+        Parameters
+        ----------
+        app: callable
+            The WSGI-application to wrap.
+        log: RequestLog
+        """
+        self.app = app
+        self.log = log
+
+    def __call__(self, environ, start_response):
+        status = [None]
+
+        def _start_response(status_line, headers, exc_info=None):
+            status[0] = int(status_line.split(None, 1)[0])
+            return start_response(status_line, headers, exc_info)
+
+        self.log.begin()
+        try:
+            return self.app(environ, _start_response)
+        finally:
+            self.log.finish(status[0])
+
+
+request_log = RequestLog(
+    rate=Config["request log"]["rate"],
+    endpoint_rates=Config["request log"]["endpoints"],
+    always_status=Config["request log"]["always log status"],
+    allowed_headers=Config["request log"]["headers"],
+    redacted_headers=Config["request log"]["redacted headers"],
+    max_field_size=Config["request log"]["max field size"],
+)
@@ -0,0 +1,231 @@
+import json
+import zlib
+import typing
+from base64 import b64decode
+
+
+__all__ = (
+    "AccountRow",
+    "MessageRow",
+    "LogRow",
+)
+
+
+def _decode(value: str) -> str:
+    return b64decode(value.encode("utf-8", "ignore")).decode("utf-8")
+
+
+def pack_headers(headers: typing.Mapping) -> bytes:
+    """
+    Parameters
+    ----------
+    headers: typing.Mapping
+
+    Returns
+    -------
+    bytes
+        The headers as JSON, zlib-compressed if that's smaller.
+    """
+    data = json.dumps(
+        headers, default=str, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+    if len(packed := zlib.compress(data)) < len(data):
+        return b"z" + packed
+    return b"j" + data
+
+
+def unpack_headers(data: bytes) -> dict:
+    """
+    The counterpart of :func:`pack_headers`.
+
+    Parameters
+    ----------
+    data: bytes
+
+    Returns
+    -------
+    dict
+    """
+    if data[:1] == b"z":
+        return json.loads(zlib.decompress(data[1:]))
+    return json.loads(data[1:])
+
+
+class _Plain(dict):
+    # the keys as they are, if no shape is given
+    def __missing__(self, key):
+        return key
+
+
+_plain = _Plain()
+
+
+class AccountRow:
+    """
+    The public part of an account, the name is decoded on first access.
+    """
+
+    __slots__ = ("id", "_name", "_encoded")
+
+    def __init__(self, id: int, name: str, *, encoded: bool = True):  # noqa
+        """
+        Parameters
+        ----------
+        id: int
+        name: str
+        encoded: bool
+            Whether ``name`` is still base64-encoded (as in the database).
+        """
+        self.id = id
+        self._name = name
+        self._encoded = encoded
+
+    @property
+    def name(self) -> str:
+        if self._encoded:
+            self._name = _decode(self._name)
+            self._encoded = False
+        return self._name
+
+    def to_json(self, shape: typing.Mapping[str, str] = None) -> dict:
+        """
+        Parameters
+        ----------
+        shape: typing.Mapping[str, str], optional
+            Translates the keys (see :class:`versions.base.ResponseShape`).
+
+        Returns
+        -------
+        dict
+        """
+        key = _plain if shape is None else shape
+        return {key["name"]: self.name, key["id"]: str(self.id)}
+
+    def __repr__(self):
+        return f"<{type(self).__name__} id={self.id}>"
+
+
+class MessageRow:
+    """
+    A message, the content is decoded on first access.
+    """
+
+    __slots__ = ("id", "author", "_content", "_encoded")
+
+    def __init__(
+        self,
+        id: int,  # noqa
+        author: int,
+        content: str,
+        *,
+        encoded: bool = True,
+    ):
+        """
+        Parameters
+        ----------
+        id, author: int
+        content: str
+        encoded: bool
+            Whether ``content`` is still base64-encoded (as in the database).
+        """
+        self.id = id
+        self.author = author
+        self._content = content
+        self._encoded = encoded
+
+    @property
+    def content(self) -> str:
+        if self._encoded:
+            self._content = _decode(self._content)
+            self._encoded = False
+        return self._content
+
+    def to_json(
+        self,
+        author: typing.Optional[AccountRow],
+        shape: typing.Mapping[str, str] = None,
+    ) -> dict:
+        """
+        Parameters
+        ----------
+        author: AccountRow, optional
+            The author of the message (None if the account is deleted).
+        shape: typing.Mapping[str, str], optional
+            Translates the keys (see :class:`versions.base.ResponseShape`).
+
+        Returns
+        -------
+        dict
+        """
+        key = _plain if shape is None else shape
+        return {
+            key["id"]: str(self.id),
+            key["content"]: self.content,
+            key["author"]: None if author is None else author.to_json(shape),
+        }
+
+    def __repr__(self):
+        return f"<{type(self).__name__} id={self.id} author={self.author}>"
+
+
+class LogRow:
+    """
+    A log entry, the headers are decoded on first access.
+    """
+
+    __slots__ = ("date", "level", "version", "ip", "message", "_headers", "_agent")
+
+    def __init__(
+        self,
+        date: str,
+        level: int,
+        version: str,
+        ip: str,
+        user_agent: typing.Optional[str],
+        message: str,
+        headers: bytes,
+    ):
+        """
+        Parameters
+        ----------
+        date: str
+        level: int
+        version, ip: str
+        user_agent: str, optional
+            The ``User-Agent``, which is stored apart from the other headers.
+        message: str
+        headers: bytes
+            Packed with :func:`pack_headers` (as in the database).
+        """
+        self.date = date
+        self.level = level
+        self.version = version
+        self.ip = ip
+        self.message = message
+        self._headers = headers
+        self._agent = user_agent
+
+    @property
+    def headers(self) -> str:
+        headers = unpack_headers(self._headers)
+        if self._agent is not None:
+            headers["User-Agent"] = self._agent
+        return str(headers)
+
+    def to_json(self) -> dict:
+        """
+        Returns
+        -------
+        dict
+        """
+        return {
+            "date": self.date,
+            "level": str(self.level),
+            "version": self.version,
+            "ip": self.ip,
+            "message": self.message,
+            "headers": self.headers,
+        }
+
+    def __repr__(self):
+        return f"<{type(self).__name__} date={self.date!r} level={self.level}>"
@@ -0,0 +1,465 @@
+import heapq
+import typing
+import threading
+from random import uniform
+from datetime import datetime, timedelta, timezone
+from time import time, perf_counter
+from .metrics import registry
+
+
+__all__ = (
+    "Every",
+    "Cron",
+    "Job",
+    "Scheduler",
+)
+
+
+JOB_DURATION = registry.histogram(
+    "job_duration_seconds",
+    "Time the runs of the background jobs took.",
+    ("job",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900),
+)
+JOB_RUNS = registry.counter(
+    "job_runs_total",
+    "Runs of the background jobs by result (ok, error or skipped).",
+    ("job", "result"),
+)
+JOB_RUNNING = registry.gauge(
+    "job_running",
+    "Whether a background job is running right now.",
+    ("job",),
+)
+
+
+class Every:
+    """
+    A schedule with a fixed interval.
+    """
+
+    def __init__(self, interval: float):
+        """
+        Parameters
+        ----------
+        interval: float
+            In s.
+        """
+        if interval <= 0:
+            raise ValueError(f"Invalid interval {interval!r}! (Must be positive!)")
+        self.interval = interval
+
+    def first(self, now: float) -> float:
+        """
+        Parameters
+        ----------
+        now: float
+            The earliest time for the first run (as from ``time.time``).
+
+        Returns
+        -------
+        float
+        """
+        return now
+
+    def next(self, previous: float) -> float:
+        """
+        Parameters
+        ----------
+        previous: float
+            The previous scheduled (not actual) time of the job, so the
+            runs don't drift.
+
+        Returns
+        -------
+        float
+        """
+        return previous + self.interval
+
+    def __str__(self):
+        return f"every {self.interval:g}s"
+
+
+class Cron:
+    """
+    A schedule like a crontab-line (``minute hour day month weekday``, in
+    local time).
+
+    Each field takes ``*``, a number, a range (``1-5``), a step (``*/15`` or
+    ``0-30/10``) or a list of those (``0,30``). The weekday is 0 - 6 from
+    sunday on (7 is sunday too). As with cron, a day matches if either the
+    day or the weekday matches when both are restricted.
+    """
+
+    _FIELDS = (
+        ("minute", 0, 59),
+        ("hour", 0, 23),
+        ("day", 1, 31),
+        ("month", 1, 12),
+        ("weekday", 0, 7),
+    )
+
+    def __init__(self, expression: str):
+        """
+        Parameters
+        ----------
+        expression: str
+            E.g. ``"30 3 * * *"`` (daily at 03:30).
+        """
+        fields = expression.split()
+        if len(fields) != len(self._FIELDS):
+            raise ValueError(
+                f"Invalid cron expression {expression!r}! (Must have 5 fields!)"
+            )
+        self.expression = expression
+        (
+            self.minutes,
+            self.hours,
+            self.days,
+            self.months,
+            self.weekdays,
+        ) = (
+            self._parse(field, *spec) for field, spec in zip(fields, self._FIELDS)
+        )
+        if 7 in self.weekdays:
+            self.weekdays = self.weekdays - {7} | {0}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, name: str, low: int, high: int) -> frozenset[int]:
+        values = set()
+        for part in field.split(","):
+            part, _, step = part.partition("/")
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, _, end = part.partition("-")
+            else:
+                start = end = part
+            try:
+                start, end, step = int(start), int(end), int(step or 1)
+            except ValueError:
+                raise ValueError(f"Invalid {name} {field!r}!") from None
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(
+                    f"Invalid {name} {field!r}! (Must be within {low} - {high}!)"
+                )
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        weekday = (moment.isoweekday() % 7) in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def first(self, now: float) -> float:
+        """
+        Parameters
+        ----------
+        now: float
+            The earliest time for the first run (as from ``time.time``).
+
+        Returns
+        -------
+        float
+        """
+        return self.next(now - 1)
+
+    def next(self, previous: float) -> float:
+        """
+        Parameters
+        ----------
+        previous: float
+            The previous scheduled time of the job.
+
+        Returns
+        -------
+        float
+            The first matching minute after ``previous``.
+        """
+        moment = datetime.fromtimestamp(previous).replace(second=0, microsecond=0)
+        moment += timedelta(minutes=1)
+        # jumps over whole months, days and hours which don't match
+        for _ in range(100_000):
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1) + timedelta(days=32)).replace(
+                    day=1, hour=0, minute=0
+                )
+            elif not self._day_matches(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError(f"The cron expression {self.expression!r} never matches!")
+
+    def __str__(self):
+        return f"cron {self.expression!r}"
+
+
+def _iso(timestamp: typing.Optional[float]) -> typing.Optional[str]:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(
+        timespec="seconds"
+    )
+
+
+class Job:
+    """
+    A function which is run by the :class:`Scheduler`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function: typing.Callable[[], typing.Any],
+        schedule: typing.Union[Every, Cron],
+        *,
+        jitter: float = 0,
+    ):
+        """
+        Parameters
+        ----------
+        name: str
+        function: typing.Callable[[], typing.Any]
+        schedule: Every, Cron
+        jitter: float
+            The max random delay of a run (in s), so the jobs of several
+            servers don't run at the same moment.
+        """
+        self.name = name
+        self.function = function
+        self.schedule = schedule
+        self.jitter = jitter
+        self.slot: typing.Optional[float] = None  # scheduled time, without jitter
+        self.next_run: typing.Optional[float] = None
+        self.last_run: typing.Optional[float] = None
+        self.last_duration: typing.Optional[float] = None
+        self.last_result: typing.Optional[str] = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+
+    def status(self) -> dict[str, typing.Any]:
+        """
+        Returns
+        -------
+        dict[str, typing.Any]
+            The state of the job (times in UTC, durations in s).
+        """
+        return {
+            "name": self.name,
+            "schedule": str(self.schedule),
+            "running": self.running,
+            "last run": _iso(self.last_run),
+            "last duration": (
+                None if self.last_duration is None else round(self.last_duration, 3)
+            ),
+            "last result": self.last_result,
+            "next run": _iso(self.next_run),
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+        }
+
+    def __repr__(self):
+        return f"<{type(self).__name__} name={self.name!r} schedule={self.schedule}>"
+
+
+class Scheduler:
+    """
+    Runs the background jobs from one dispatcher thread, each run gets a
+    short-lived thread.
+
+    A job never overlaps with itself, a run which is due while the previous
+    one is still running is skipped. The next run is computed from the
+    scheduled time of the previous one (not from when it ended), so the jobs
+    don't drift, and runs which were missed are skipped rather than caught
+    up on.
+
+    The jobs and their status are per process (like the metrics).
+    """
+
+    def __init__(self):
+        self._jobs: dict[str, Job] = {}
+        self._queue: list[tuple[float, int, Job]] = []
+        self._counter = 0
+        self._condition = threading.Condition()
+        self._dispatcher: typing.Optional[threading.Thread] = None
+        self._threads: set[threading.Thread] = set()
+        self._stopped = False
+
+    @property
+    def jobs(self) -> list[Job]:
+        return list(self._jobs.values())
+
+    def add(
+        self,
+        name: str,
+        function: typing.Callable[[], typing.Any],
+        *,
+        interval: float = None,
+        cron: str = None,
+        start_after: float = 0,
+        jitter: float = 0,
+    ) -> Job:
+        """
+        Parameters
+        ----------
+        name: str
+            Must be unique.
+        function: typing.Callable[[], typing.Any]
+            Exceptions are counted as failures, they should be logged by the
+            function itself (e.g. with ``error_logger``).
+        interval: float, optional
+            In s.
+        cron: str, optional
+            See :class:`Cron`, used instead of ``interval`` if given.
+        start_after: float
+            The pause before the first run (in s).
+        jitter: float
+            See :class:`Job`.
+
+        Returns
+        -------
+        Job
+        """
+        if cron:
+            schedule = Cron(cron)
+        elif interval is not None:
+            schedule = Every(interval)
+        else:
+            raise ValueError("Either `interval` or `cron` must be given!")
+        job = Job(name, function, schedule, jitter=jitter)
+
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("The scheduler is shut down!")
+            if name in self._jobs:
+                raise ValueError(f"The job {name!r} already exists!")
+            self._jobs[name] = job
+            job.slot = schedule.first(time() + start_after)
+            self._push(job)
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(
+                    target=self._run,
+                    name="<Thread: Job Scheduler>",
+                    daemon=True,
+                )
+                self._dispatcher.start()
+            self._condition.notify()
+        return job
+
+    def remove(self, name: str):
+        """
+        Unschedules a job, a running run is finished.
+
+        Parameters
+        ----------
+        name: str
+        """
+        with self._condition:
+            job = self._jobs.pop(name)
+            self._queue = [entry for entry in self._queue if entry[2] is not job]
+            heapq.heapify(self._queue)
+            job.next_run = None
+
+    def status(self) -> list[dict[str, typing.Any]]:
+        """
+        Returns
+        -------
+        list[dict[str, typing.Any]]
+            See :meth:`Job.status`.
+        """
+        with self._condition:
+            return [job.status() for job in self._jobs.values()]
+
+    def shutdown(self, timeout: typing.Optional[float] = 10):
+        """
+        Stops scheduling and waits for the running jobs.
+
+        Parameters
+        ----------
+        timeout: float, optional
+            The max time to wait for the running jobs (in s), forever if None.
+        """
+        with self._condition:
+            self._stopped = True
+            self._queue.clear()
+            dispatcher, threads = self._dispatcher, list(self._threads)
+            self._condition.notify()
+        if dispatcher is not None:
+            dispatcher.join()
+        deadline = None if timeout is None else perf_counter() + timeout
+        for thread in threads:
+            thread.join(None if deadline is None else max(0, deadline - perf_counter()))
+
+    def _push(self, job: Job):
+        job.next_run = job.slot + (uniform(0, job.jitter) if job.jitter else 0)
+        self._counter += 1
+        heapq.heappush(self._queue, (job.next_run, self._counter, job))
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                if not self._queue:
+                    self._condition.wait()
+                    continue
+                if (delay := self._queue[0][0] - time()) > 0:
+                    self._condition.wait(delay)
+                    continue
+                _, _, job = heapq.heappop(self._queue)
+                self._dispatch(job)
+
+                now = time()
+                slot = job.schedule.next(job.slot)
+                while slot <= now:
+                    # missed while the process slept or the job was too long
+                    slot = job.schedule.next(slot)
+                job.slot = slot
+                self._push(job)
+
+    def _dispatch(self, job: Job):
+        if job.running:
+            job.skipped += 1
+            JOB_RUNS.inc(job.name, "skipped")
+            return
+        job.running = True
+        JOB_RUNNING.set(job.name, value=1)
+        thread = threading.Thread(
+            target=self._execute,
+            args=(job,),
+            name=f"<Thread: Job {job.name}>",
+            daemon=True,
+        )
+        self._threads.add(thread)
+        thread.start()
+
+    def _execute(self, job: Job):
+        started = time()
+        start = perf_counter()
+        result = "ok"
+        try:
+            job.function()
+        except Exception:  # noqa
+            result = "error"
+        finally:
+            duration = perf_counter() - start
+            JOB_DURATION.observe(duration, job.name)
+            JOB_RUNS.inc(job.name, result)
+            JOB_RUNNING.set(job.name, value=0)
+            with self._condition:
+                job.running = False
+                job.last_run = started
+                job.last_duration = duration
+                job.last_result = result
+                job.runs += 1
+                job.failures += result == "error"
+                self._threads.discard(threading.current_thread())
@@ -0,0 +1,307 @@
+import io
+import sys
+import json
+import socket
+import asyncio
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from socketserver import ThreadingMixIn
+from urllib.parse import unquote_to_bytes
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+__all__ = (
+    "serve",
+    "serve_async",
+    "AsyncWSGIServer",
+)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, *_):
+        # requests are already logged into the database
+        pass
+
+
+def serve(app, *, host: str, port: int, sock: socket.socket = None):
+    """
+    Serves a WSGI-application with one thread per request.
+
+    Parameters
+    ----------
+    app: callable
+        The WSGI-application.
+    host: str
+    port: int
+    sock: socket.socket, optional
+        An already bound socket to serve on instead of ``host``/``port``, it
+        stays open (it belongs to the caller, e.g. the master process).
+    """
+    if sock is None:
+        server = make_server(
+            host,
+            port,
+            app,
+            server_class=ThreadingWSGIServer,
+            handler_class=QuietWSGIRequestHandler,
+        )
+    else:
+        server = ThreadingWSGIServer(
+            (host, port), QuietWSGIRequestHandler, bind_and_activate=False
+        )
+        server.socket.close()
+        # the server closes its copy, so a restarted server can use ``sock`` again
+        server.socket = sock.dup()
+        server.server_address = sock.getsockname()[:2]
+        server.server_name = socket.getfqdn(host)
+        server.server_port = port
+        server.setup_environ()
+        server.set_app(app)
+
+    with server:
+        server.serve_forever()
+
+
+class AsyncWSGIServer:
+    """
+    An asyncio HTTP/1.1-server for a WSGI-application.
+
+    Connections (accepting, reading, writing and keep-alive) are handled by
+    the event loop, the application itself runs on a bounded executor, so
+    idle or slow clients don't occupy a thread and the amount of concurrent
+    database/redis work is capped by ``workers``.
+
+    The open connections aren't limited by ``workers``, but the requests
+    handled at the same time are (the others wait for a free thread), so it
+    has to be at least the concurrency of the application (e.g. the limits
+    of :class:`school_messenger.middleware.AdmissionMiddleware`). The
+    application (the endpoints, the rate-limits and redis) is synchronous, so
+    this doesn't raise the concurrency limit, it only keeps idle connections
+    from using it up.
+    """
+
+    MAX_HEAD_SIZE = 64 * 1024
+    MAX_BODY_SIZE = 1024 * 1024
+
+    def __init__(self, app, *, host: str, port: int, workers=16, keep_alive=5.0):
+        """
+        Parameters
+        ----------
+        app: callable
+            The WSGI-application.
+        host: str
+        port: int
+        workers: int
+            The max amount of requests which are handled at the same time.
+        keep_alive: float
+            How long an idle connection is kept open (in s).
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.keep_alive = keep_alive
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="<Thread: Request Worker>"
+        )
+
+    async def serve_forever(self, *, sock=None):
+        """
+        Parameters
+        ----------
+        sock: socket.socket, optional
+            An already bound socket to serve on instead of ``host``/``port``.
+        """
+        if sock is not None:
+            # the server closes its copy, the caller's socket stays open
+            server = await asyncio.start_server(
+                self._handle, sock=sock.dup(), limit=self.MAX_HEAD_SIZE
+            )
+        else:
+            server = await asyncio.start_server(
+                self._handle, self.host, self.port, limit=self.MAX_HEAD_SIZE
+            )
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info("peername") or ("", 0)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), self.keep_alive
+                    )
+                except (
+                    asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError,
+                    asyncio.TimeoutError,
+                    ConnectionError,
+                ):
+                    return
+
+                try:
+                    environ = self._build_environ(head, peer)
+                except ValueError:
+                    await self._write_error(writer, HTTPStatus.BAD_REQUEST)
+                    return
+
+                if environ.get("HTTP_TRANSFER_ENCODING", "identity") != "identity":
+                    await self._write_error(writer, HTTPStatus.LENGTH_REQUIRED)
+                    return
+                length = int(environ.get("CONTENT_LENGTH") or 0)
+                if length > self.MAX_BODY_SIZE:
+                    await self._write_error(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                    return
+                try:
+                    body = await reader.readexactly(length) if length else b""
+                except asyncio.IncompleteReadError:
+                    # the connection was closed within the body
+                    await self._write_error(writer, HTTPStatus.BAD_REQUEST)
+                    return
+                environ["wsgi.input"] = io.BytesIO(body)
+
+                try:
+                    status, headers, chunks = await loop.run_in_executor(
+                        self.executor, self._call_app, environ
+                    )
+                except Exception:  # noqa
+                    # like wsgiref, the traceback goes to stderr
+                    traceback.print_exc()
+                    await self._write_error(writer, HTTPStatus.INTERNAL_SERVER_ERROR)
+                    return
+
+                keep_alive = self._keep_alive(environ)
+                names = {name.lower() for name, _ in headers}
+                if "content-length" not in names:
+                    headers.append(("Content-Length", str(sum(map(len, chunks)))))
+                headers.append(("Connection", "keep-alive" if keep_alive else "close"))
+
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status}\r\n"
+                        + "".join(f"{name}: {value}\r\n" for name, value in headers)
+                        + "\r\n"
+                    ).encode("latin-1")
+                )
+                if environ["REQUEST_METHOD"] != "HEAD":
+                    writer.writelines(chunks)
+                await writer.drain()
+
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _build_environ(self, head: bytes, peer) -> dict:
+        request_line, *lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+        method, target, protocol = request_line.split(" ")
+        if not protocol.startswith("HTTP/"):
+            raise ValueError(protocol)
+        path, _, query = target.partition("?")
+
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote_to_bytes(path).decode("latin-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": self.host,
+            "SERVER_PORT": str(self.port),
+            "SERVER_PROTOCOL": protocol,
+            "REMOTE_ADDR": peer[0],
+            "REMOTE_PORT": str(peer[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for line in lines:
+            name, value = line.split(":", 1)
+            name = name.strip().upper().replace("-", "_")
+            value = value.strip()
+            if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                environ[name] = value
+            elif (key := f"HTTP_{name}") in environ:
+                environ[key] += f",{value}"
+            else:
+                environ[key] = value
+        if not environ.get("CONTENT_LENGTH", "0").isdigit():
+            raise ValueError(environ["CONTENT_LENGTH"])
+        return environ
+
+    @staticmethod
+    def _keep_alive(environ) -> bool:
+        connection = environ.get("HTTP_CONNECTION", "").lower()
+        if environ["SERVER_PROTOCOL"] == "HTTP/1.1":
+            return connection != "close"
+        return connection == "keep-alive"
+
+    def _call_app(self, environ):
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [status, list(headers)]
+
+        result = self.app(environ, start_response)
+        try:
+            chunks = [chunk for chunk in result if chunk]
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return response[0], response[1], chunks
+
+    @staticmethod
+    async def _write_error(writer, status: HTTPStatus):
+        # like the responses of the application (see WHITEPAPER.md)
+        body = json.dumps({"message": status.phrase}).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        try:
+            await writer.drain()
+        except ConnectionError:
+            # the client is already gone
+            pass
+
+
+def serve_async(
+    app,
+    *,
+    host: str,
+    port: int,
+    workers=16,
+    keep_alive=5.0,
+    sock: socket.socket = None,
+):
+    """
+    Serves a WSGI-application with :class:`AsyncWSGIServer`.
+
+    Parameters
+    ----------
+    app: callable
+        The WSGI-application.
+    host: str
+    port: int
+    workers: int
+        The max amount of requests which are handled at the same time.
+    keep_alive: float
+        How long an idle connection is kept open (in s).
+    sock: socket.socket, optional
+        An already bound socket to serve on instead of ``host``/``port``, it
+        stays open.
+    """
+    server = AsyncWSGIServer(
+        app, host=host, port=port, workers=workers, keep_alive=keep_alive
+    )
+    asyncio.run(server.serve_forever(sock=sock))
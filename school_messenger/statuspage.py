@@ -1,17 +1,24 @@
-from threading import Thread
-from time import time, sleep, perf_counter
-from requests import request
+import typing
+from collections import deque
+from threading import Lock
+from time import time, perf_counter
 from .config import Config
-from .utils import database, error_logger
+from .metrics import percentile
+from .middleware import REQUEST_LATENCIES
+from .scheduler import Job
+from .utils import database, error_logger, scheduler
 
 
 __all__ = (
     "API_KEY",
     "PAGE_ID",
     "METRIC_LATENCY",
+    "METRIC_LATENCY_P95",
     "BASE_URL",
+    "build_base_url",
     "build_header",
     "update_latency",
+    "StatusPageReporter",
     "create_latency_update_runner",
 )
 
@@ -19,10 +26,41 @@ __all__ = (
 API_KEY = Config["statuspage.io"]["api key"]
 PAGE_ID = Config["statuspage.io"]["page id"]
 METRIC_LATENCY = Config["statuspage.io"]["latency metric id"]
+METRIC_LATENCY_P95 = Config["statuspage.io"]["latency p95 metric id"]
 
-BASE_URL = "https://{base}/{version}/pages/{page}/".format(
-    base=Config["statuspage.io"]["api base"].lstrip("https://").rstrip("/"),
-    version=Config["statuspage.io"]["api version"].strip("/"),
+
+def build_base_url(
+    *,
+    base: str,
+    version: str,
+    page: str,
+) -> str:
+    """
+    Parameters
+    ----------
+    base: str
+        The host of the API, optionally with a scheme (``https://`` by default).
+    version: str
+        The version of the API.
+    page: str
+        The id of the page.
+
+    Returns
+    -------
+    str
+    """
+    if "://" not in base:
+        base = f"https://{base}"
+    return "{base}/{version}/pages/{page}/".format(
+        base=base.rstrip("/"),
+        version=version.strip("/"),
+        page=page,
+    )
+
+
+BASE_URL = build_base_url(
+    base=Config["statuspage.io"]["api base"],
+    version=Config["statuspage.io"]["api version"],
     page=PAGE_ID,
 )
 
@@ -49,6 +87,112 @@ def build_header(
     }
 
 
+class StatusPageReporter:
+    """
+    Submits metric-data to StatusPage.io over one persistent session.
+
+    Data which can't be submitted stays buffered and is replayed in bulk with
+    the next flush.
+    ``requests`` is imported by the first reporter, not at the startup.
+    """
+
+    def __init__(
+        self,
+        *,
+        base_url: str = BASE_URL,
+        key: str = API_KEY,
+        buffer_size: int = 288,
+        timeout: float = 10,
+    ):
+        """
+        Parameters
+        ----------
+        base_url: str
+            The URL of the page (see :func:`build_base_url`).
+        key: str
+            The API-key.
+        buffer_size: int
+            The max amount of buffered data points, the oldest are dropped first.
+        timeout: float
+            The timeout for the API-requests (in s).
+        """
+        from requests import Session
+
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = Session()
+        self.session.headers.update(build_header(key=key))
+        self._buffer = deque(maxlen=buffer_size)
+        self._lock = Lock()
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    def add(self, metric: str, value: float, timestamp: float = None):
+        """
+        Buffers a data point until the next :meth:`flush`.
+
+        Parameters
+        ----------
+        metric: str
+            The id of the metric.
+        value: float
+        timestamp: float, optional
+            The UNIX-timestamp of the value (now by default).
+        """
+        with self._lock:
+            self._buffer.append((metric, int(timestamp or time()), value))
+
+    def flush(self) -> bool:
+        """
+        Submits all buffered data points with one request.
+
+        Returns
+        -------
+        bool
+            Whether everything is submitted.
+        """
+        from requests import RequestException
+
+        # swapped out, so adding isn't blocked by the request
+        with self._lock:
+            pending, self._buffer = self._buffer, deque(maxlen=self._buffer.maxlen)
+        if not pending:
+            return True
+        data = {}
+        for metric, timestamp, value in pending:
+            data.setdefault(metric, []).append({"timestamp": timestamp, "value": value})
+
+        try:
+            response = self.session.post(
+                f"{self.base_url}/metrics/data",
+                json={"data": data},
+                timeout=self.timeout,
+            )
+            ok, text = response.ok, response.text
+        except RequestException as e:
+            ok, text = False, repr(e)
+
+        if not ok:
+            with self._lock:
+                # in front of the newer ones, the oldest are dropped first
+                pending.extend(self._buffer)
+                self._buffer = pending
+
+        database.add_log(
+            level=2 + (not ok),  # 3 if request fails
+            version=None,
+            ip=None,
+            msg=text,
+            headers={"submitted": len(pending), "buffered": len(self._buffer)},
+        )
+        return ok
+
+    def close(self):
+        self.session.close()
+
+
 def update_latency(
     *,
     ms: float,
@@ -70,71 +214,108 @@ def update_latency(
     key: str
         The API-key.
     """
-    header = build_header(key=key)
-    url = "{base}/metrics/{metric}/data".format(
-        base=BASE_URL.rstrip("/"),
-        metric=metric,
-    )
-    data = {
-        "data[timestamp]": timestamp or time(),
-        "data[value]": ms,
-    }
-
-    response = request("POST", url=url, headers=header, params=data)
-
-    lvl = 2 + (not response.ok)  # 3 if requests fails
-    database.add_log(
-        level=lvl, version=None, ip=None, msg=response.text, headers={**header, **data}
-    )
+    reporter = StatusPageReporter(key=key, buffer_size=1)
+    try:
+        reporter.add(metric, ms, timestamp)
+        reporter.flush()
+    finally:
+        reporter.close()
 
 
 def create_latency_update_runner(
     *,
     start_after: float = 10,
     interval: float = 60 * 5,
+    cron: str = None,
+    jitter: float = 0,
     target: str = f"http://127.0.0.1:{Config['port']}",
     method: str = "GET",
     header: dict[str, str] = None,
-) -> Thread:
+    buffer_size: int = 288,
+    reporter: typing.Optional[StatusPageReporter] = None,
+    lock=None,
+) -> Job:
     """
-    Creates a thread which automatically updates the latency displayed on statuspage.io.
+    Schedules a job which automatically updates the latency displayed on statuspage.io.
+
+    The p50 (and p95 if a metric is configured for it) of the requests handled
+    since the previous run are submitted.
+    The target is only pinged if no request is handled meanwhile.
+    The first run only drops the samples of the warm-up.
 
     Parameters
     ----------
     start_after: float
-        The pause before pinging first time (in s).
+        The pause before the first run (in s).
     interval: float
         The update interval (in s).
+    cron: str, optional
+        A schedule like ``"*/5 * * * *"``, used instead of ``interval`` if given
+        (see :class:`school_messenger.scheduler.Cron`).
+    jitter: float
+        The max random delay of a run (in s).
     target: str
-        The target to ping.
+        The target to ping if there was no traffic.
     method: str
         The method which should be used for the target.
     header: dict[str, str]
         The header which should be used for the target.
+    buffer_size: int
+        How many data points are kept while statuspage.io is unreachable.
+    reporter: StatusPageReporter, optional
+        The reporter to use (e.g. one for a local stub server).
+    lock: school_messenger.workers.FileLock, school_messenger.workers.RedisLock, optional
+        If given, only submits while this process holds the lock.
+        (The percentiles are then sampled from this worker's traffic.)
 
     Returns
     -------
-    Thread
+    Job
     """
     if header is None:
         header = {"Authorization": "User Server.LatencyUpdater"}
+    session = None
+    warmed_up = False
+
+    def ping() -> list[float]:
+        t1 = perf_counter()
+        session.request(method, target, headers=header, timeout=interval)
+        t2 = perf_counter()
+        REQUEST_LATENCIES.drain()  # the ping itself isn't traffic
+        return [(t2 - t1) * 1000]
+
+    @error_logger(retry_on_error=False, raise_on_error=True)
+    def update():
+        nonlocal reporter, session, warmed_up
+        from requests import Session
+
+        # created here, so ``requests`` isn't imported before the server runs
+        if reporter is None:
+            reporter = StatusPageReporter(buffer_size=buffer_size)
+        if session is None:
+            session = Session()
 
-    @error_logger(retry_timeout=60)
-    def runner():
-        sleep(start_after)
-        while True:
-            t1 = perf_counter()
-            request(method, target, headers=header)
-            t2 = perf_counter()
+        if not warmed_up:
+            REQUEST_LATENCIES.drain()  # drop the warm-up
+            warmed_up = True
+            return
 
-            update_latency(ms=(t2 - t1) * 1000)
+        if lock is not None and not lock.acquire():
+            REQUEST_LATENCIES.drain()
+            return
 
-            sleep(interval)
+        samples = REQUEST_LATENCIES.drain() or ping()
+        now = time()
+        reporter.add(METRIC_LATENCY, percentile(samples, 50), now)
+        if METRIC_LATENCY_P95:
+            reporter.add(METRIC_LATENCY_P95, percentile(samples, 95), now)
+        reporter.flush()
 
-    updater = Thread(
-        target=runner,
-        name="<Thread: Automatic Latency Updater>",
-        daemon=True,
+    return scheduler.add(
+        "latency updater",
+        update,
+        interval=interval,
+        cron=cron,
+        start_after=start_after,
+        jitter=jitter,
     )
-    updater.start()
-    return updater
@@ -0,0 +1,942 @@
+import re
+import typing
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from hashlib import sha512
+from secrets import token_bytes
+from base64 import b64encode
+from datetime import datetime, timedelta
+from .cache import ACCOUNTS, MESSAGES, NEWEST_MESSAGE
+from .rows import AccountRow, MessageRow, LogRow, pack_headers
+
+__all__ = (
+    "AccountStorage",
+    "MessageStorage",
+    "LogStorage",
+    "Storage",
+    "MemoryStorage",
+)
+
+
+# the epoch of the IDs (2021-01-01, see WHITEPAPER.md) in ms
+_EPOCH = 1609455600000
+# the integers of SQLite, the bounds of the ID ranges are clamped into them
+_MIN_ID = -(1 << 63)
+_MAX_ID = (1 << 63) - 1
+# like the default tokenizer of FTS5 (unicode61)
+_WORD = re.compile(r"\w+")
+
+
+class AccountStorage(ABC):
+    """
+    The accounts of a :class:`Storage`, the engines store them with the
+    (base64-encoded) name, the password-hash and the token.
+    """
+
+    @staticmethod
+    def _encode(value: str) -> str:
+        return b64encode(value.encode("utf-8", "ignore")).decode("utf-8")
+
+    @staticmethod
+    def _hash_password(password: str, *salts: typing.Any) -> str:
+        for salt in salts:
+            password += str(salt)
+        return sha512(password.encode("utf-8", "ignore")).hexdigest()
+
+    @staticmethod
+    def _new_token(id: int) -> str:  # noqa
+        token = (
+            b64encode(str(id).encode()).decode(),
+            b64encode(token_bytes()).decode(),
+        )
+        token = token[0].rstrip("=") + "." + token[1].rstrip("=")
+        return token.replace("+", "-").replace("/", "_")
+
+    @staticmethod
+    def _group_queries(
+        queries: typing.Iterable[str],
+    ) -> tuple[dict[int, list[str]], dict[str, list[str]]]:
+        """
+        Splits the queries of :meth:`accounts_info` into IDs and names, each
+        with all queries which ask for it (e.g. ``"7"`` and ``"007"``).
+        IDs which can't exist are left out.
+        """
+        ids, names = {}, {}
+        for query in queries:
+            if query.isdecimal():
+                if (id := int(query)) <= _MAX_ID:  # noqa
+                    ids.setdefault(id, []).append(query)
+            else:
+                names.setdefault(query, []).append(query)
+        return ids, names
+
+    @abstractmethod
+    def add_account(self, name, password):
+        """
+        Parameters
+        ----------
+        name: str
+        password: str
+
+        Returns
+        -------
+        Literal[False, str]
+            The token (False if the name is taken or numeric).
+        """
+
+    @abstractmethod
+    def account_token(self, name, password):
+        """
+        Parameters
+        ----------
+        name, password: str
+
+        Returns
+        -------
+        str, optional
+        """
+
+    @abstractmethod
+    def account_delete(self, token=None, password=None, id=None):  # noqa
+        """
+        Parameters
+        ----------
+        token, password: str, optional
+        id: str, int, optional
+            Either ``token`` and ``password`` or ``id`` must be given.
+
+        Returns
+        -------
+        bool
+            Whether the account could be deleted.
+        """
+
+    @abstractmethod
+    def account_info(self, *, query=None, token=None):
+        """
+        Parameters
+        ----------
+        query, token: str, optional
+            The name or ID, or the token.
+
+        Returns
+        -------
+        AccountRow, optional
+        """
+
+    @abstractmethod
+    def accounts_info(self, queries):
+        """
+        Parameters
+        ----------
+        queries: list[str]
+            Names and/or IDs.
+
+        Returns
+        -------
+        dict[str, AccountRow]
+            The found accounts by query.
+        """
+
+    @abstractmethod
+    def change_account_type(self, id, type):  # noqa
+        """
+        Parameters
+        ----------
+        id, type: str, int
+
+        Returns
+        -------
+        int
+            The new ID.
+        """
+
+    @abstractmethod
+    def export_accounts(self, after=None, amount=1000):
+        """
+        Parameters
+        ----------
+        after: int, optional
+            Only accounts with a higher ID are exported.
+        amount: int
+
+        Returns
+        -------
+        list[dict]
+            The accounts (``id``, ``name``, ``password``, ``token``) ordered
+            by their IDs, the name decoded.
+        """
+
+    @abstractmethod
+    def import_accounts(self, rows):
+        """
+        Adds exported accounts (see :meth:`export_accounts`) with their IDs.
+
+        Parameters
+        ----------
+        rows: list[dict]
+        """
+
+
+class MessageStorage(ABC):
+    """
+    The messages of a :class:`Storage`.
+    """
+
+    @staticmethod
+    def _id_range(before: int, after: int) -> tuple[int, int]:
+        """
+        Parameters
+        ----------
+        before, after: int
+            UTC-timestamps (in ms), -1 to ignore them.
+
+        Returns
+        -------
+        tuple[int, int]
+            The IDs between which (exclusive) the messages are, within the
+            integers of SQLite (the timestamps come from the headers).
+        """
+        if before == -1:
+            upper = _MAX_ID
+        else:
+            upper = max(_MIN_ID, min(((before - _EPOCH) << 16) + 65535, _MAX_ID))
+        if after == -1:
+            lower = 0
+        else:
+            lower = max(_MIN_ID, min((after - _EPOCH) << 16, _MAX_ID))
+        return lower, upper
+
+    @staticmethod
+    def _up_to_id(up_to: typing.Union[datetime, int], already_id: bool) -> int:
+        if already_id:
+            return up_to  # type: ignore
+        if isinstance(up_to, int):
+            up_to = datetime.now() - timedelta(days=up_to)
+        if isinstance(up_to, datetime):
+            up_to = up_to.timestamp() * 1000
+        return int(up_to - _EPOCH) << 16
+
+    @staticmethod
+    def _id_date(id: int) -> str:  # noqa
+        return datetime.fromtimestamp(((id >> 16) + _EPOCH) / 1000).isoformat(sep=" ")
+
+    def add_message(self, author, content):
+        """
+        Parameters
+        ----------
+        author: int
+        content: str
+
+        Returns
+        -------
+        str
+            The ID.
+        """
+        return self.add_messages(author, [content])[0]
+
+    @abstractmethod
+    def add_messages(self, author, contents):
+        """
+        Parameters
+        ----------
+        author: int
+        contents: list[str]
+
+        Returns
+        -------
+        list[str]
+            The IDs (in the order of ``contents``).
+        """
+
+    @abstractmethod
+    def delete_message(self, id):  # noqa
+        """
+        Parameters
+        ----------
+        id: str, int
+
+        Returns
+        -------
+        MessageRow, optional
+            The deleted message.
+        """
+
+    @abstractmethod
+    def get_messages(self, maximum=20, before=-1, after=-1):
+        """
+        Parameters
+        ----------
+        maximum: int
+        before, after: int
+            UTC-timestamps (in ms), -1 to ignore them.
+
+        Returns
+        -------
+        list[MessageRow]
+            The newest first.
+        """
+
+    @abstractmethod
+    def search_messages(
+        self, query, *, author=None, maximum=20, offset=0, before=-1, after=-1
+    ):
+        """
+        Parameters
+        ----------
+        query: str
+            The words to search for (all of them must be in the message).
+        author: int, optional
+            Only messages from this author.
+        maximum, offset: int
+            For the pagination.
+        before, after: int
+            UTC-timestamps (in ms), -1 to ignore them.
+
+        Returns
+        -------
+        list[MessageRow]
+            The best matches first.
+        """
+
+    @abstractmethod
+    def delete_old_messages(self, up_to, *, already_id=False):
+        """
+        Parameters
+        ----------
+        up_to: datetime, int
+            The date (or the age in days, or an ID if ``already_id``) until
+            which the messages are deleted.
+        already_id: bool
+
+        Returns
+        -------
+        int
+            The amount of deleted messages.
+        """
+
+    @abstractmethod
+    def export_messages(self, after=None, amount=1000):
+        """
+        Parameters
+        ----------
+        after: int, optional
+            Only messages with a higher ID are exported.
+        amount: int
+
+        Returns
+        -------
+        list[dict]
+            The messages (``id``, ``author``, ``content``) ordered by their
+            IDs, the content decoded.
+        """
+
+    @abstractmethod
+    def import_messages(self, rows):
+        """
+        Adds exported messages (see :meth:`export_messages`) with their IDs.
+
+        Parameters
+        ----------
+        rows: list[dict]
+        """
+
+
+class LogStorage(ABC):
+    """
+    The logs of a :class:`Storage`.
+    """
+
+    LOG_LEVEL = {
+        "UNSET": 0,
+        "DEBUG": 1,
+        "INFO": 2,
+        "ERROR": 3,
+        "WARNING": 4,
+        "CRITICAL": 5,
+    }
+
+    @staticmethod
+    def _echo_log(now, level, version, ip, msg, headers):
+        print(
+            f"\033[32m{now}\033[0m\t"
+            f"\033[31m{level}\033[0m\t"
+            f"\033[36m{version}\033[0m\t"
+            f"\033[37m{ip:15}\033[0m\t"
+            f"\033[35m{msg}\033[0m\t"
+            f"\033[30m{headers or {}}\033[0m"
+        )
+
+    @staticmethod
+    def _date_range(before: int, after: int) -> tuple[str, str]:
+        """
+        Parameters
+        ----------
+        before, after: int
+            UTC-timestamps (in ms), -1 to ignore them.
+
+        Returns
+        -------
+        tuple[str, str]
+            The dates between which (exclusive) the logs are.
+        """
+        if before == -1:
+            upper = datetime(9999, 12, 31, 23, 59, 59, 59)
+        else:
+            upper = datetime.utcfromtimestamp(before / 1000)
+        if after == -1:
+            lower = datetime(1, 1, 1)
+        else:
+            lower = datetime.utcfromtimestamp(after / 1000)
+        return lower.isoformat(sep=" "), upper.isoformat(sep=" ")
+
+    @abstractmethod
+    def add_log(self, level, version, ip, msg, headers):
+        """
+        Parameters
+        ----------
+        level: int
+        version, ip: str, optional
+        msg: str
+        headers: dict, optional
+        """
+
+    @abstractmethod
+    def get_logs(self, maximum=-1, before=-1, after=-1):
+        """
+        Parameters
+        ----------
+        maximum: int
+        before, after: int
+            UTC-timestamps (in ms), -1 to ignore them.
+
+        Returns
+        -------
+        list[LogRow]
+            The newest first.
+        """
+
+    @abstractmethod
+    def delete_old_logs(self, up_to):
+        """
+        Parameters
+        ----------
+        up_to: datetime, int
+            The date (or the age in days) until which the logs are deleted.
+
+        Returns
+        -------
+        int
+            The amount of deleted logs.
+        """
+
+    @abstractmethod
+    def export_logs(self, after=None, amount=1000):
+        """
+        Parameters
+        ----------
+        after: str, optional
+            Only logs with a later date are exported.
+        amount: int
+
+        Returns
+        -------
+        list[dict]
+            The logs (``date``, ``level``, ``version``, ``ip``,
+            ``user_agent``, ``message``, ``headers``) ordered by their dates.
+        """
+
+    @abstractmethod
+    def import_logs(self, rows):
+        """
+        Adds exported logs (see :meth:`export_logs`) with their dates.
+
+        Parameters
+        ----------
+        rows: list[dict]
+        """
+
+
+class Storage(AccountStorage, MessageStorage, LogStorage):
+    """
+    What the server needs from its database, implemented by the engines
+    :class:`school_messenger.database.DataBase` (SQLite) and
+    :class:`MemoryStorage`.
+
+    The maintenance and backups are optional, by default there's nothing to
+    maintain and no backup.
+    """
+
+    # the ordered key of each table (see :meth:`last_key`)
+    KEYS = {
+        "accounts": "id",
+        "messages": "id",
+        "logs": "date",
+    }
+
+    def setup(self):
+        """
+        Prepares the storage, called before it's used first.
+        """
+
+    @abstractmethod
+    def count(self, table: str) -> int:
+        """
+        Parameters
+        ----------
+        table: str
+            One of :attr:`KEYS`.
+
+        Returns
+        -------
+        int
+            The amount of rows.
+        """
+
+    @abstractmethod
+    def last_key(self, table: str) -> typing.Any:
+        """
+        Parameters
+        ----------
+        table: str
+            One of :attr:`KEYS`.
+
+        Returns
+        -------
+        typing.Any
+            The highest key of the table (None if it's empty).
+        """
+
+    def size(self) -> int:
+        """
+        Returns
+        -------
+        int
+            The size of the stored data in bytes (0 if unknown).
+        """
+        return 0
+
+    def maintain(self, **_) -> dict[str, typing.Any]:
+        """
+        Returns
+        -------
+        dict[str, typing.Any]
+            The report.
+        """
+        return {}
+
+    def backup(self, directory: str, **_) -> dict[str, typing.Any]:
+        """
+        Parameters
+        ----------
+        directory: str
+
+        Returns
+        -------
+        dict[str, typing.Any]
+            The report.
+
+        Raises
+        ------
+        NotImplementedError
+            If the storage can't be backed up (e.g. in memory).
+        """
+        raise NotImplementedError(f"{type(self).__name__} has no backups!")
+
+    def backups(self, directory: str) -> list[str]:
+        """
+        Parameters
+        ----------
+        directory: str
+
+        Returns
+        -------
+        list[str]
+            The paths of the backups, the oldest first.
+        """
+        return []
+
+    def backup_status(self) -> dict[str, typing.Any]:
+        """
+        Returns
+        -------
+        dict[str, typing.Any]
+        """
+        return {"running": False}
+
+
+class MemoryStorage(Storage):
+    """
+    Keeps everything in dicts (with indexes for the lookups) and sorted
+    arrays of the IDs, e.g. for tests, benchmarks and demo instances.
+
+    The data is lost with the process and isn't shared between processes.
+    The search is an inverted index of the words, all words must be in a
+    message (but not next to each other like within a phrase of FTS5) and
+    the matches are ranked by how often the words occur.
+    """
+
+    def __init__(self, log_level: int = LogStorage.LOG_LEVEL["UNSET"]):
+        """
+        Parameters
+        ----------
+        log_level: int
+            The logs below this level aren't stored.
+        """
+        self._log_level = log_level
+        self._lock = threading.RLock()
+        # id -> [id, name, password, token], the name decoded
+        self._accounts: dict[int, list] = {}
+        self._account_names: dict[str, int] = {}
+        self._account_tokens: dict[str, int] = {}
+        self._account_ids: list[int] = []
+        # id -> (author, content)
+        self._messages: dict[int, tuple[int, str]] = {}
+        self._message_ids: list[int] = []
+        # word -> ids
+        self._words: dict[str, set[int]] = {}
+        # date -> (level, version, ip, user agent, message, packed headers)
+        self._logs: dict[str, tuple] = {}
+        self._log_dates: list[str] = []
+
+    # accounts
+
+    def _insert_account(self, id, name, password, token):  # noqa
+        self._accounts[id] = [id, name, password, token]
+        self._account_names[name] = id
+        self._account_tokens[token] = id
+        insort(self._account_ids, id)
+
+    def _remove_account(self, id):  # noqa
+        _, name, _, token = self._accounts.pop(id)
+        del self._account_names[name]
+        del self._account_tokens[token]
+        del self._account_ids[bisect_left(self._account_ids, id)]
+
+    def add_account(self, name, password):
+        from .utils import generate_id  # noqa
+
+        if name.isnumeric():
+            return False
+        with self._lock:
+            if name in self._account_names:
+                return False
+            id = generate_id(1)  # noqa
+            token = self._new_token(id)
+            self._insert_account(id, name, self._hash_password(password, id), token)
+        ACCOUNTS.bump()
+        return token
+
+    def account_token(self, name, password):
+        from .utils import set_id_type  # noqa
+
+        with self._lock:
+            if (id := self._account_names.get(name)) is None:  # noqa
+                return None
+            _, _, stored, token = self._accounts[id]
+        if self._hash_password(password, id, set_id_type(id, 1)) != stored:
+            return None
+        return token
+
+    def account_delete(self, token=None, password=None, id=None):  # noqa
+        from .utils import get_id_type
+
+        if token is not None and password is not None and id is None:
+            with self._lock:
+                if (id := self._account_tokens.get(token)) is None:  # noqa
+                    return False
+                if self._hash_password(password, id) != self._accounts[id][2]:
+                    return False
+                self._remove_account(id)
+        elif token is None and password is None and id is not None:
+            with self._lock:
+                if int(id) not in self._accounts or get_id_type(int(id)) == 31:
+                    return False
+                self._remove_account(int(id))
+        else:
+            raise ValueError(
+                "Invalid combination of following arguments: 'token', 'password', 'id'"
+            )
+        ACCOUNTS.bump()
+        return True
+
+    def account_info(self, *, query=None, token=None):
+        with self._lock:
+            if query is not None:
+                if query.isdecimal():
+                    account = self._accounts.get(int(query))
+                else:
+                    account = self._accounts.get(self._account_names.get(query))
+            else:
+                account = self._accounts.get(self._account_tokens.get(token))
+            if account is None:
+                return None
+            return AccountRow(account[0], account[1], encoded=False)
+
+    def accounts_info(self, queries):
+        ids, names = self._group_queries(queries)
+        found = {}
+        with self._lock:
+            for id, matching in ids.items():  # noqa
+                if (account := self._accounts.get(id)) is not None:
+                    for query in matching:
+                        found[query] = AccountRow(account[0], account[1], encoded=False)
+            for name, matching in names.items():
+                if account := self._accounts.get(self._account_names.get(name)):
+                    for query in matching:
+                        found[query] = AccountRow(account[0], account[1], encoded=False)
+        return found
+
+    def change_account_type(self, id, type):  # noqa
+        from .utils import set_id_type
+
+        new_id = set_id_type(int(id), int(type))
+        with self._lock:
+            if (account := self._accounts.get(int(id))) is not None:
+                self._remove_account(int(id))
+                self._insert_account(new_id, *account[1:])
+        ACCOUNTS.bump()
+        return new_id
+
+    def export_accounts(self, after=None, amount=1000):
+        with self._lock:
+            start = 0 if after is None else bisect_right(self._account_ids, after)
+            return [
+                dict(zip(("id", "name", "password", "token"), self._accounts[id]))
+                for id in self._account_ids[start : start + amount]  # noqa
+            ]
+
+    def import_accounts(self, rows):
+        with self._lock:
+            for row in rows:
+                if row["id"] in self._accounts or row["name"] in self._account_names:
+                    raise ValueError(f"The account {row['id']} already exists!")
+            for row in rows:
+                self._insert_account(
+                    row["id"], row["name"], row["password"], row["token"]
+                )
+        ACCOUNTS.bump()
+
+    # messages
+
+    def _insert_messages(self, rows):
+        with self._lock:
+            for id, _, _ in rows:  # noqa
+                if id in self._messages:
+                    raise ValueError(f"The message {id} already exists!")
+            for id, author, content in rows:  # noqa
+                self._messages[id] = (author, content)
+                insort(self._message_ids, id)
+                for word in set(_WORD.findall(content.lower())):
+                    self._words.setdefault(word, set()).add(id)
+        NEWEST_MESSAGE.raise_to(max((row[0] for row in rows), default=0))
+        MESSAGES.bump()
+
+    def _remove_message(self, id):  # noqa
+        _, content = self._messages.pop(id)
+        for word in set(_WORD.findall(content.lower())):
+            self._words[word].discard(id)
+            if not self._words[word]:
+                del self._words[word]
+
+    def add_messages(self, author, contents):
+        from .utils import generate_ids  # noqa
+
+        ids = generate_ids(2, len(contents))
+        self._insert_messages(list(zip(ids, [author] * len(ids), contents)))
+        return [str(id) for id in ids]  # noqa
+
+    def delete_message(self, id):  # noqa
+        with self._lock:
+            if (message := self._messages.get(int(id))) is None:
+                return None
+            self._remove_message(int(id))
+            del self._message_ids[bisect_left(self._message_ids, int(id))]
+        MESSAGES.bump()
+        return MessageRow(int(id), *message, encoded=False)
+
+    def get_messages(self, maximum=20, before=-1, after=-1):
+        lower, upper = self._id_range(before, after)
+        with self._lock:
+            ids = self._message_ids[
+                bisect_right(self._message_ids, lower) : bisect_left(
+                    self._message_ids, upper
+                )
+            ]
+            if maximum >= 0:
+                ids = ids[len(ids) - maximum :] if maximum else []
+            return [
+                MessageRow(id, *self._messages[id], encoded=False)
+                for id in reversed(ids)  # noqa
+            ]
+
+    def search_messages(
+        self, query, *, author=None, maximum=20, offset=0, before=-1, after=-1
+    ):
+        if not (words := _WORD.findall(query.lower())):
+            return []
+        lower, upper = self._id_range(before, after)
+        with self._lock:
+            # the rarest word first, so the intersection stays small
+            sets = sorted((self._words.get(word, set()) for word in words), key=len)
+            ids = set(sets[0]).intersection(*sets[1:])
+            matches = []
+            for id in ids:  # noqa
+                message_author, content = self._messages[id]
+                if not lower < id < upper:
+                    continue
+                if author is not None and message_author != int(author):
+                    continue
+                found = _WORD.findall(content.lower())
+                score = sum(found.count(word) for word in words) / len(found)
+                matches.append((-score, -id, id, message_author, content))
+        matches.sort()
+        return [
+            MessageRow(id, message_author, content, encoded=False)
+            for *_, id, message_author, content in matches[  # noqa
+                offset : offset + maximum
+            ]
+        ]
+
+    def delete_old_messages(self, up_to, *, already_id=False):
+        up_to = self._up_to_id(up_to, already_id)
+        with self._lock:
+            end = bisect_left(self._message_ids, up_to)
+            for id in self._message_ids[:end]:  # noqa
+                self._remove_message(id)
+            del self._message_ids[:end]
+        if end:
+            MESSAGES.bump()
+        self.add_log(
+            level=self.LOG_LEVEL["INFO"],
+            version=None,
+            ip=None,
+            msg=f"{end} messages deleted from database",
+            headers={"reason": f"older than {self._id_date(up_to)}"},
+        )
+        return end
+
+    def export_messages(self, after=None, amount=1000):
+        with self._lock:
+            start = 0 if after is None else bisect_right(self._message_ids, after)
+            return [
+                {
+                    "id": id,
+                    "author": self._messages[id][0],
+                    "content": self._messages[id][1],
+                }
+                for id in self._message_ids[start : start + amount]  # noqa
+            ]
+
+    def import_messages(self, rows):
+        self._insert_messages(
+            [(row["id"], row["author"], row["content"]) for row in rows]
+        )
+
+    # logs
+
+    def _insert_log(self, date, level, version, ip, msg, headers):
+        headers = dict(headers or {})
+        agent = None
+        for name in list(headers):
+            if name.lower() == "user-agent":
+                agent = str(headers.pop(name))
+        with self._lock:
+            # the date is the key, like the primary key of SQLite
+            if date in self._logs:
+                raise ValueError(f"The log {date} already exists!")
+            insort(self._log_dates, date)
+            self._logs[date] = (level, version, ip, agent, msg, pack_headers(headers))
+
+    def add_log(self, level, version, ip, msg, headers):
+        if level < self._log_level:
+            return
+        now = datetime.utcnow().isoformat(sep=" ")
+        ip = ip or "nA"
+        version = version or "nA"
+        self._insert_log(now, level, version, ip, msg, headers)
+        self._echo_log(now, level, version, ip, msg, headers)
+
+    def get_logs(self, maximum=-1, before=-1, after=-1):
+        lower, upper = self._date_range(before, after)
+        with self._lock:
+            dates = self._log_dates[
+                bisect_right(self._log_dates, lower) : bisect_left(
+                    self._log_dates, upper
+                )
+            ]
+            if maximum >= 0:
+                dates = dates[len(dates) - maximum :] if maximum else []
+            return [LogRow(date, *self._logs[date]) for date in reversed(dates)]
+
+    def delete_old_logs(self, up_to):
+        if isinstance(up_to, (int, float)):
+            up_to = datetime.utcnow() - timedelta(days=up_to)
+        with self._lock:
+            end = bisect_left(self._log_dates, up_to.isoformat(sep=" "))
+            for date in self._log_dates[:end]:
+                del self._logs[date]
+            del self._log_dates[:end]
+        self.add_log(
+            level=self.LOG_LEVEL["INFO"],
+            version=None,
+            ip=None,
+            msg=f"{end} logs deleted from log",
+            headers={"reason": f"older than {up_to.isoformat(sep=' ')}"},
+        )
+        return end
+
+    def export_logs(self, after=None, amount=1000):
+        from .rows import unpack_headers
+
+        with self._lock:
+            start = 0 if after is None else bisect_right(self._log_dates, after)
+            return [
+                {
+                    "date": date,
+                    "level": level,
+                    "version": version,
+                    "ip": ip,
+                    "user_agent": agent,
+                    "message": message,
+                    "headers": unpack_headers(headers),
+                }
+                for date in self._log_dates[start : start + amount]
+                for level, version, ip, agent, message, headers in (self._logs[date],)
+            ]
+
+    def import_logs(self, rows):
+        for row in rows:
+            headers = row["headers"]
+            if row["user_agent"] is not None:
+                headers = {**headers, "User-Agent": row["user_agent"]}
+            self._insert_log(
+                row["date"],
+                row["level"],
+                row["version"],
+                row["ip"],
+                row["message"],
+                headers,
+            )
+
+    # storage
+
+    def count(self, table):
+        with self._lock:
+            return len(
+                {
+                    "accounts": self._accounts,
+                    "messages": self._messages,
+                    "logs": self._logs,
+                }[table]
+            )
+
+    def last_key(self, table):
+        with self._lock:
+            keys = {
+                "accounts": self._account_ids,
+                "messages": self._message_ids,
+                "logs": self._log_dates,
+            }[table]
+            return keys[-1] if keys else None
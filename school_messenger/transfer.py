@@ -0,0 +1,444 @@
+"""
+Moves the data between two servers as NDJSON, e.g.::
+
+    python -m school_messenger.transfer export data.ndjson --logs
+    python -m school_messenger.transfer import data.ndjson --database new.sqlite
+
+The file starts with a header, followed by the rows of each table and a
+trailer with their count and checksum::
+
+    {"format": "school-messenger", "version": 1, "tables": {"accounts": 2}}
+    {"table": "accounts", "row": {"id": 1, "name": "...", ...}}
+    {"table": "accounts", "rows": 2, "checksum": "..."}
+
+Both directions work in batches (with constant memory) and write a checkpoint
+after each one, so an interrupted transfer continues with ``--resume``.
+"""
+
+import os
+import sys
+import json
+import typing
+import argparse
+from hashlib import blake2b
+from time import perf_counter
+from .config import Config
+from .database import DataBase
+from .storage import Storage
+from .utils import database as default_database
+
+__all__ = (
+    "TABLES",
+    "Checksum",
+    "export_data",
+    "import_data",
+    "verify_file",
+)
+
+
+FORMAT = "school-messenger"
+VERSION = 1
+
+# table -> (the ordered key, the export-method, the import-method)
+TABLES = {
+    "accounts": ("id", "export_accounts", "import_accounts"),
+    "messages": ("id", "export_messages", "import_messages"),
+    "logs": ("date", "export_logs", "import_logs"),
+}
+
+
+class Checksum:
+    """
+    The count and an order-independent checksum of rows, it can be saved in
+    a checkpoint and continued later.
+    """
+
+    _MODULO = 1 << 128
+
+    def __init__(self, rows: int = 0, value: int = 0):
+        self.rows = rows
+        self.value = value
+
+    def add(self, row: typing.Mapping):
+        """
+        Parameters
+        ----------
+        row: typing.Mapping
+        """
+        data = json.dumps(
+            row, sort_keys=True, ensure_ascii=False, separators=(",", ":")
+        )
+        digest = blake2b(data.encode("utf-8", "surrogatepass"), digest_size=16)
+        self.value = (
+            self.value + int.from_bytes(digest.digest(), "big")
+        ) % self._MODULO
+        self.rows += 1
+
+    @property
+    def hex(self) -> str:
+        return f"{self.value:032x}"
+
+    def to_json(self) -> dict:
+        return {"rows": self.rows, "checksum": self.hex}
+
+    @classmethod
+    def from_json(cls, data: typing.Mapping) -> "Checksum":
+        return cls(data["rows"], int(data["checksum"], 16))
+
+    def __eq__(self, other):
+        if not isinstance(other, Checksum):
+            return NotImplemented
+        return (self.rows, self.value) == (other.rows, other.value)
+
+
+class _Progress:
+    # a single line on stderr, updated at most once per second
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._started = perf_counter()
+        self._shown = 0.0
+
+    def show(self, table: str, done: int, total: typing.Optional[int], end=False):
+        now = perf_counter()
+        if not self.enabled or (not end and now - self._shown < 1):
+            return
+        self._shown = now
+        rate = done / max(now - self._started, 1e-9)
+        of = "" if total is None else f"/{total}"
+        print(
+            f"\r{table}: {done}{of} rows ({rate:.0f} rows/s)",
+            end="\n" if end else "",
+            file=sys.stderr,
+            flush=True,
+        )
+        if end:
+            self._started = perf_counter()
+
+
+def _save_checkpoint(path: str, state: dict):
+    # replaced at once, so it's never half written
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(state, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def _load_checkpoint(path: str, resume: bool) -> typing.Optional[dict]:
+    if resume and os.path.exists(path):
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    return None
+
+
+def _dumps(data: typing.Mapping) -> bytes:
+    return (
+        json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8", "surrogatepass"
+        )
+        + b"\n"
+    )
+
+
+def export_data(
+    path: str,
+    *,
+    database: Storage = default_database,
+    tables: typing.Iterable[str] = ("accounts", "messages"),
+    batch: int = 5000,
+    resume: bool = False,
+    progress: bool = False,
+) -> dict[str, dict]:
+    """
+    Parameters
+    ----------
+    path: str
+        The NDJSON-file to write.
+    database: Storage
+    tables: typing.Iterable[str]
+        See :data:`TABLES`.
+    batch: int
+        The rows read per query.
+    resume: bool
+        Whether an interrupted export is continued (from its checkpoint).
+    progress: bool
+        Whether the progress is shown on stderr.
+
+    Returns
+    -------
+    dict[str, dict]
+        The ``rows`` and ``checksum`` per table.
+    """
+    tables = list(tables)
+    for table in tables:
+        if table not in TABLES:
+            raise ValueError(
+                f"Unknown table {table!r}! (Must be in {', '.join(TABLES)}!)"
+            )
+    checkpoint = f"{path}.export-checkpoint"
+    state = _load_checkpoint(checkpoint, resume)
+    shown = _Progress(progress)
+    database.setup()
+
+    if state is None:
+        state = {"offset": 0, "table": None, "after": None, "done": {}}
+        file = open(path, "wb")
+        totals = {table: database.count(table) for table in tables}
+        file.write(_dumps({"format": FORMAT, "version": VERSION, "tables": totals}))
+    else:
+        # the rows after the checkpoint are written again
+        file = open(path, "r+b")
+        file.truncate(state["offset"])
+        file.seek(state["offset"])
+        totals = {table: None for table in tables}
+
+    with file:
+        for table in tables:
+            if table in state["done"]:
+                continue
+            key, export, _ = TABLES[table]
+            if state["table"] == table:
+                checksum, after = Checksum.from_json(state), state["after"]
+            else:
+                checksum, after = Checksum(), None
+
+            while rows := getattr(database, export)(after, batch):
+                for row in rows:
+                    checksum.add(row)
+                    file.write(_dumps({"table": table, "row": row}))
+                after = rows[-1][key]
+                file.flush()
+                state.update(
+                    offset=file.tell(), table=table, after=after, **checksum.to_json()
+                )
+                _save_checkpoint(checkpoint, state)
+                shown.show(table, checksum.rows, totals[table])
+
+            file.write(_dumps({"table": table, **checksum.to_json()}))
+            file.flush()
+            state["done"][table] = checksum.to_json()
+            state.update(offset=file.tell(), table=None, after=None)
+            _save_checkpoint(checkpoint, state)
+            shown.show(table, checksum.rows, totals[table], end=True)
+
+    os.remove(checkpoint)
+    return {table: state["done"][table] for table in tables}
+
+
+def _read(file: typing.BinaryIO) -> typing.Iterator[tuple[dict, int]]:
+    # the entries with the offset after them
+    while line := file.readline():
+        if line.strip():
+            yield json.loads(line), file.tell()
+
+
+def _read_header(file: typing.BinaryIO) -> dict:
+    header = json.loads(file.readline() or "{}")
+    if header.get("format") != FORMAT or header.get("version") != VERSION:
+        raise ValueError(f"Not an export (version {VERSION}) of this server!")
+    return header
+
+
+def verify_file(path: str) -> dict[str, dict]:
+    """
+    Checks the counts and checksums of an exported file.
+
+    Parameters
+    ----------
+    path: str
+
+    Returns
+    -------
+    dict[str, dict]
+        The ``rows`` and ``checksum`` per table.
+
+    Raises
+    ------
+    ValueError
+        If the file is incomplete or damaged.
+    """
+    checksums: dict[str, Checksum] = {}
+    trailers = {}
+    with open(path, "rb") as file:
+        header = _read_header(file)
+        for entry, _ in _read(file):
+            table = entry["table"]
+            if "row" in entry:
+                checksums.setdefault(table, Checksum()).add(entry["row"])
+            else:
+                trailers[table] = Checksum.from_json(entry)
+                if checksums.setdefault(table, Checksum()) != trailers[table]:
+                    raise ValueError(
+                        f"The rows of {table!r} don't match their checksum!"
+                    )
+    if missing := set(header["tables"]) - set(trailers):
+        raise ValueError(f"The file is incomplete! (Missing {', '.join(missing)}!)")
+    return {table: checksum.to_json() for table, checksum in trailers.items()}
+
+
+def import_data(
+    path: str,
+    *,
+    database: Storage = default_database,
+    batch: int = 5000,
+    resume: bool = False,
+    progress: bool = False,
+) -> dict[str, dict]:
+    """
+    Imports an export (see :func:`export_data`) with the original IDs, each
+    batch within one transaction. The tables must be empty, unless an
+    interrupted import is resumed.
+
+    Afterwards the rows in the database are compared with the counts and
+    checksums of the file.
+
+    Parameters
+    ----------
+    path: str
+        The NDJSON-file to read.
+    database: Storage
+    batch: int
+        The rows written per transaction.
+    resume: bool
+        Whether an interrupted import is continued (from its checkpoint).
+    progress: bool
+        Whether the progress is shown on stderr.
+
+    Returns
+    -------
+    dict[str, dict]
+        The ``rows`` and ``checksum`` per table.
+
+    Raises
+    ------
+    ValueError
+        If the file is damaged, a table isn't empty or the imported rows don't
+        match the file.
+    """
+    checkpoint = f"{path}.import-checkpoint"
+    state = _load_checkpoint(checkpoint, resume)
+    shown = _Progress(progress)
+    database.setup()
+
+    with open(path, "rb") as file:
+        header = _read_header(file)
+        totals = header["tables"]
+        if state is None:
+            for table in totals:
+                if database.count(table):
+                    raise ValueError(f"The table {table!r} isn't empty!")
+            state = {"offset": file.tell(), "table": None, "done": {}}
+        else:
+            file.seek(state["offset"])
+
+        table, pending = state["table"], []
+        checksum = Checksum.from_json(state) if table else Checksum()
+        # the rows committed after the last checkpoint are skipped
+        skip_to = database.last_key(table) if table else None
+
+        def flush(offset):
+            if pending:
+                getattr(database, TABLES[table][2])(pending)
+                pending.clear()
+            state.update(offset=offset, table=table, **checksum.to_json())
+            _save_checkpoint(checkpoint, state)
+            shown.show(table, checksum.rows, totals.get(table))
+
+        for entry, offset in _read(file):
+            if entry["table"] != table:
+                table, checksum = entry["table"], Checksum()
+                skip_to = database.last_key(table)
+
+            if "row" in entry:
+                row = entry["row"]
+                checksum.add(row)
+                if skip_to is None or row[TABLES[table][0]] > skip_to:
+                    pending.append(row)
+                if len(pending) >= batch:
+                    flush(offset)
+                continue
+
+            if checksum != Checksum.from_json(entry):
+                raise ValueError(f"The rows of {table!r} don't match their checksum!")
+            state["done"][table] = checksum.to_json()
+            flush(offset)
+            shown.show(table, checksum.rows, totals.get(table), end=True)
+
+    if missing := set(totals) - set(state["done"]):
+        raise ValueError(f"The file is incomplete! (Missing {', '.join(missing)}!)")
+
+    # the rows as they're stored now
+    for table in state["done"]:
+        key, export, _ = TABLES[table]
+        stored, after = Checksum(), None
+        while rows := getattr(database, export)(after, batch):
+            for row in rows:
+                stored.add(row)
+            after = rows[-1][key]
+        if stored != Checksum.from_json(state["done"][table]):
+            raise ValueError(f"The imported {table!r} don't match the file!")
+
+    os.remove(checkpoint)
+    return state["done"]
+
+
+def main(argv: typing.Sequence[str] = None):
+    """
+    The command line interface (see the module's docstring).
+
+    Parameters
+    ----------
+    argv: typing.Sequence[str], optional
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m school_messenger.transfer",
+        description="Moves the accounts, messages and logs between two servers.",
+    )
+    parser.add_argument("command", choices=("export", "import", "verify"))
+    parser.add_argument("file", help="the NDJSON-file")
+    parser.add_argument(
+        "--database",
+        default=Config["database"]["file"],
+        help="the SQLite-file (default: from the config)",
+    )
+    parser.add_argument("--logs", action="store_true", help="export the logs too")
+    parser.add_argument("--batch", type=int, default=5000, help="rows per batch")
+    parser.add_argument(
+        "--resume", action="store_true", help="continue an interrupted transfer"
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "verify":
+        result = verify_file(args.file)
+    else:
+        if isinstance(default_database, DataBase) and os.path.abspath(
+            args.database
+        ) == os.path.abspath(default_database.database):
+            database = default_database
+        else:
+            database = DataBase(
+                args.database, journal_mode=Config["database"]["journal mode"]
+            )
+        start = perf_counter()
+        if args.command == "export":
+            result = export_data(
+                args.file,
+                database=database,
+                tables=("accounts", "messages", "logs")[: 3 if args.logs else 2],
+                batch=args.batch,
+                resume=args.resume,
+                progress=True,
+            )
+        else:
+            result = import_data(
+                args.file,
+                database=database,
+                batch=args.batch,
+                resume=args.resume,
+                progress=True,
+            )
+        print(f"done in {perf_counter() - start:.1f}s", file=sys.stderr)
+    for table, summary in result.items():
+        print(f"{table}: {summary['rows']} rows, checksum {summary['checksum']}")
+
+
+if __name__ == "__main__":
+    main()
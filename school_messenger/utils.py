@@ -1,40 +1,212 @@
+import os
+import sys
+import atexit
 import datetime
 import traceback
 import typing
 import functools
-from time import sleep
-from threading import Thread
+from random import uniform
+from time import sleep, time, monotonic
+from uuid import uuid4
+from threading import Lock
+from multiprocessing import Lock as ProcessLock, RawValue
 from .database import DataBase
-from .config import Config
-
+from .storage import MemoryStorage
+from .metrics import registry
+from .scheduler import Job, Scheduler
+from .workers import FileLock, RedisLock
+from .config import Config, redis
 
 __all__ = (
+    "CircuitOpenError",
+    "CircuitBreaker",
     "error_logger",
     "is_authorized",
     "has_user_agent",
     "generate_id",
+    "generate_ids",
     "get_id_type",
     "set_id_type",
     "get_user_type",
+    "consume_ratelimit",
+    "leader_lock",
     "database",
+    "scheduler",
     "create_log_deleter_runner",
     "create_message_deleter_runner",
+    "create_maintenance_runner",
+    "create_backup_runner",
+)
+
+
+if Config["database"]["engine"] == "memory":
+    if Config["workers"]["count"] > 1:
+        raise ValueError(
+            "The memory-engine can't be shared between workers! (Use one worker!)"
+        )
+    database = MemoryStorage(Config["database"]["log level"])
+elif Config["database"]["engine"] == "sqlite":
+    database = DataBase(
+        Config["database"]["file"],
+        Config["database"]["log level"],
+        Config["database"]["journal mode"],
+        # the copy is per process, the workers wouldn't see the writes of each other
+        Config["database"]["read replica"] and Config["workers"]["count"] <= 1,
+        (
+            {
+                "window": Config["database"]["group commit"]["window"],
+                "max_batch": Config["database"]["group commit"]["max batch"],
+                "durability": Config["database"]["group commit"]["durability"],
+            }
+            if Config["database"]["group commit"]["enabled"]
+            else None
+        ),
+    )
+else:
+    raise ValueError(f"Unknown database engine {Config['database']['engine']!r}!")
+
+# the background jobs of this process
+scheduler = Scheduler()
+atexit.register(scheduler.shutdown, timeout=Config["scheduler"]["shutdown timeout"])
+
+
+ERRORS = registry.counter(
+    "errors_total",
+    "Errors caught by error_logger (logged or not).",
+    ("function", "type"),
+)
+CIRCUIT_OPEN = registry.gauge(
+    "circuit_open",
+    "Whether the circuit breaker of a function is open.",
+    ("function",),
 )
 
 
-database = DataBase(Config["database"]["file"], Config["database"]["log level"])
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling a function whose circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after too many failures in a row, so a failing dependency (e.g.
+    the database or statuspage.io) isn't hammered. After the cooldown one
+    call is let through, which closes it again if it succeeds.
+    """
+
+    def __init__(self, *, threshold: int = 5, cooldown: float = 60):
+        """
+        Parameters
+        ----------
+        threshold: int
+            The failures in a row which open the breaker (0 to never open).
+        cooldown: float
+            How long the breaker stays open (in s).
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at: typing.Optional[float] = None
+        self._trial = False
+        self._lock = Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def remaining(self) -> float:
+        """
+        Returns
+        -------
+        float
+            The rest of the cooldown (in s).
+        """
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self._opened_at + self.cooldown - monotonic())
+
+    def allow(self) -> bool:
+        """
+        Returns
+        -------
+        bool
+            Whether a call may be made now.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or self.remaining() > 0:
+                return False
+            self._trial = True  # half-open, only one call at a time
+            return True
+
+    def success(self) -> bool:
+        """
+        Returns
+        -------
+        bool
+            Whether the breaker was closed by this.
+        """
+        with self._lock:
+            was_open = self._opened_at is not None
+            self.failures = 0
+            self._opened_at = None
+            self._trial = False
+            return was_open
+
+    def failure(self) -> bool:
+        """
+        Returns
+        -------
+        bool
+            Whether the breaker was opened by this.
+        """
+        with self._lock:
+            self.failures += 1
+            if self._opened_at is not None:
+                # the trial failed
+                self._opened_at = monotonic()
+                self._trial = False
+                return False
+            if self.threshold and self.failures >= self.threshold:
+                self._opened_at = monotonic()
+                return True
+            return False
+
+
+def _add_log_safely(**kwargs):
+    # the database may be the reason of the error
+    try:
+        database.add_log(**kwargs)
+    except Exception as e:  # noqa
+        print(
+            f"Couldn't log ({type(e).__name__}: {e}): {kwargs['msg']}",
+            file=sys.stderr,
+        )
 
 
 def error_logger(
     *,
     log_level: int = database.LOG_LEVEL["ERROR"],
     retry_on_error: bool = True,
-    retry_timeout: typing.Optional[float] = 0,
+    retry_timeout: typing.Optional[float] = 1,
+    max_retry_timeout: float = Config["errors"]["max retry timeout"],
     raise_on_error: bool = False,
+    breaker_threshold: int = Config["errors"]["breaker threshold"],
+    breaker_cooldown: float = Config["errors"]["breaker cooldown"],
+    dedup_window: float = Config["errors"]["dedup window"],
 ) -> typing.Callable[[typing.Callable], typing.Callable]:
     """
     Logs errors and restarts the task if needed.
 
+    The pause before a retry doubles with each failure in a row (with
+    jitter). After ``breaker_threshold`` failures in a row the circuit
+    breaker opens: until ``breaker_cooldown`` passed the task isn't called
+    (calls without retrying raise :class:`CircuitOpenError`).
+    An error which was already logged within ``dedup_window`` is only
+    counted, the count is logged with its next occurrence after the window.
+
     Parameters
     ----------
     log_level: int
@@ -42,9 +214,18 @@ def error_logger(
     retry_on_error: bool
         Whether the task should be restarted if it fails.
     retry_timeout: float, optional
-        The pause until the task 'll be rerun (in s).
+        The pause until the task 'll be rerun the first time (in s).
+    max_retry_timeout: float
+        The max pause between two reruns (in s). A task which ran longer
+        than this before failing starts with ``retry_timeout`` again.
     raise_on_error: bool
         Whether the error should be raised after it's logged.
+    breaker_threshold: int
+        The failures in a row which open the circuit breaker (0 to never open).
+    breaker_cooldown: float
+        How long the circuit breaker stays open (in s).
+    dedup_window: float
+        How long an error isn't logged again (in s).
 
     Returns
     -------
@@ -65,26 +246,85 @@ def error_logger(
         -------
         callable
         """
+        name = getattr(clb, "__qualname__", repr(clb))
+        breaker = CircuitBreaker(threshold=breaker_threshold, cooldown=breaker_cooldown)
+        # traceback -> (logged at, suppressed since)
+        logged: dict[str, tuple[float, int]] = {}
+        logged_lock = Lock()
+
+        def log(e: Exception, timeout: float, opened: bool):
+            ERRORS.inc(name, type(e).__name__)
+            msg = "".join(traceback.format_exception(None, e, e.__traceback__))
+            now = monotonic()
+            with logged_lock:
+                at, suppressed = logged.get(msg, (None, 0))
+                if at is not None and now - at < dedup_window:
+                    logged[msg] = (at, suppressed + 1)
+                    msg = None
+                else:
+                    if len(logged) > 256:
+                        logged.clear()
+                    logged[msg] = (now, 0)
+            if msg is not None:
+                _add_log_safely(
+                    level=log_level,
+                    version=None,
+                    ip=None,
+                    msg=msg.rstrip("\n"),
+                    headers={
+                        "retry": retry_on_error,
+                        "timeout": round(timeout, 3),
+                        "failures in a row": breaker.failures,
+                        "repeated": suppressed,  # since it was logged last
+                    },
+                )
+            if opened:
+                CIRCUIT_OPEN.set(name, value=1)
+                _add_log_safely(
+                    level=log_level,
+                    version=None,
+                    ip=None,
+                    msg=f"Circuit of {name} opened after {breaker.failures} "
+                    f"failures in a row, paused for {breaker.cooldown}s.",
+                    headers={},
+                )
 
         def inner(*args, **kwargs):
+            timeout = retry_timeout
             while True:
+                if not breaker.allow():
+                    if raise_on_error:
+                        raise CircuitOpenError(f"The circuit of {name} is open!")
+                    if not retry_on_error:
+                        return
+                    sleep(max(breaker.remaining(), 0.01))
+                    continue
+
+                started = monotonic()
                 try:
-                    return clb(*args, **kwargs)
+                    result = clb(*args, **kwargs)
                 except Exception as e:
-                    database.add_log(
-                        level=log_level,
-                        version=None,
-                        ip=None,
-                        msg="".join(
-                            traceback.format_exception(None, e, e.__traceback__)
-                        ).rstrip("\n"),
-                        headers={"retry": retry_on_error, "timeout": retry_timeout},
-                    )
+                    if monotonic() - started > max_retry_timeout:
+                        timeout = retry_timeout  # was healthy for a while
+                    opened = breaker.failure()
+                    log(e, timeout, opened)
                     if raise_on_error:
                         raise
                     if not retry_on_error:
                         return
-                    sleep(retry_timeout)
+                    sleep(timeout * uniform(0.5, 1))
+                    timeout = min(max_retry_timeout, timeout * 2 if timeout else 0.1)
+                else:
+                    if breaker.success():
+                        CIRCUIT_OPEN.set(name, value=0)
+                        _add_log_safely(
+                            level=database.LOG_LEVEL["INFO"],
+                            version=None,
+                            ip=None,
+                            msg=f"Circuit of {name} closed.",
+                            headers={},
+                        )
+                    return result
 
         return functools.update_wrapper(inner, clb)
 
@@ -133,7 +373,11 @@ def has_user_agent(request, *, user_agent_key="User-Agent", min_user_agent_len=2
         return False
 
 
-__INCREMENT = -1
+# in shared memory, created at import (before the workers are forked), so the
+# workers allocate from one counter and never hand out the same ID
+__INCREMENT = RawValue("Q", 0)  # the next free increment within __TIMESTAMP
+__TIMESTAMP = RawValue("Q", 0)  # in ms since 1970
+__INCREMENT_LOCK = ProcessLock()
 
 
 def generate_id(type=0):  # noqa
@@ -146,15 +390,38 @@ def generate_id(type=0):  # noqa
     -------
     int
     """
-    global __INCREMENT
-    if __INCREMENT == 2047:
-        __INCREMENT = 0
-    else:
-        __INCREMENT += 1
-    increment = __INCREMENT
-    now = datetime.datetime.utcnow()
-    unix = (now - datetime.datetime(1970, 1, 1)).total_seconds()
-    return (int(unix * 1000 - 1609455600000) << 16) + (type << 11) + increment
+    return generate_ids(type, 1)[0]
+
+
+def generate_ids(type=0, amount=1):  # noqa
+    """
+    Allocates ``amount`` IDs at once, they are ascending and share one
+    timestamp.
+
+    Parameters
+    ----------
+    type: int
+    amount: int
+        At most 2048 (the increments of one millisecond).
+
+    Returns
+    -------
+    list[int]
+    """
+    if not 0 < amount <= 2048:
+        raise ValueError(f"Invalid amount {amount!r}! (Must be within 1 - 2048!)")
+    increment, timestamp = __INCREMENT, __TIMESTAMP
+    with __INCREMENT_LOCK:
+        if (now := int(time() * 1000)) > timestamp.value:
+            timestamp.value, increment.value = now, 0
+        elif increment.value + amount > 2048:
+            # the millisecond is used up (or the clock went back), the next one
+            # is borrowed, so the IDs never wrap and stay ascending
+            timestamp.value, increment.value = timestamp.value + 1, 0
+        first = increment.value
+        increment.value += amount
+        timestamp = (timestamp.value - 1609455600000) << 16
+    return [timestamp + (type << 11) + first + i for i in range(amount)]  # noqa
 
 
 def get_id_type(
@@ -206,7 +473,7 @@ def get_user_type(request):
     if token:
         data = database.account_info(token=token)
         if data:
-            user_id = data[0]
+            user_id = data.id
             raw_user_type = get_id_type(user_id)
             if raw_user_type:
                 if raw_user_type == 1:
@@ -217,14 +484,82 @@ def get_user_type(request):
     return user_type, user_id
 
 
+def consume_ratelimit(request, cost):
+    """
+    Charges additional calls (e.g. the items of a batch) against the rate
+    limit of the requesting user.
+
+    The calls are recorded like :class:`AlbertUnruhUtils.ratelimit.ServerRateLimit`
+    records them, so they count against the same window.
+
+    Parameters
+    ----------
+    request: NAA.APIRequest
+    cost: int
+
+    Returns
+    -------
+    bool
+        Whether the cost could be charged (nothing is charged otherwise).
+    """
+    section, id = get_user_type(request)  # noqa
+    limit = Config["ratelimits"][section]
+    key = f"call-{section}-{id}"  # same key as ServerRateLimit
+
+    redis.zremrangebyscore(key, 0, time())
+    if limit["amount"] - int(redis.zcount(key, 0, 2**62) or 0) < cost:
+        return False
+    expires = time() + limit["interval"]
+    redis.zadd(key, {str(uuid4()): expires for _ in range(cost)})
+    redis.expire(key, limit["interval"])
+    return True
+
+
+_leader_locks: dict[str, typing.Union[FileLock, RedisLock]] = {}
+
+
+def leader_lock(name: str) -> typing.Union[FileLock, RedisLock, None]:
+    """
+    The leader-lock of a runner in this process, shared with its manual runs
+    (e.g. ``POST admin/backup``) so they never overlap a run of another worker.
+
+    Parameters
+    ----------
+    name: str
+        The runner (see ``Config["runner"]``).
+
+    Returns
+    -------
+    school_messenger.workers.FileLock, school_messenger.workers.RedisLock, optional
+        None with a single worker.
+    """
+    if Config["workers"]["count"] <= 1:
+        return None
+    if name not in _leader_locks:
+        if Config["workers"]["leader lock"] == "redis":
+            ttl = 2 * Config["runner"][name]["interval"]
+            _leader_locks[name] = RedisLock(redis, name, ttl=ttl)
+        else:
+            _leader_locks[name] = FileLock(
+                os.path.join(
+                    Config["workers"]["lock directory"],
+                    f"{name.replace(' ', '-')}.lock",
+                )
+            )
+    return _leader_locks[name]
+
+
 def create_log_deleter_runner(
     *,
     up_to: typing.Union[datetime.datetime, int] = 7,
     start_after: float = 5,
     interval: float = 60 * 60,
-) -> Thread:
+    cron: str = None,
+    jitter: float = 0,
+    lock=None,
+) -> Job:
     """
-    Creates a thread which automatically deletes old logs.
+    Schedules a job which automatically deletes old logs.
 
     Parameters
     ----------
@@ -235,26 +570,32 @@ def create_log_deleter_runner(
         The pause before deleting first time (in s).
     interval: float
         The delete-interval (in s).
+    cron: str, optional
+        A schedule like ``"0 3 * * *"``, used instead of ``interval`` if given
+        (see :class:`school_messenger.scheduler.Cron`).
+    jitter: float
+        The max random delay of a run (in s).
+    lock: school_messenger.workers.FileLock, school_messenger.workers.RedisLock, optional
+        If given, only deletes while this process holds the lock.
 
     Returns
     -------
-    Thread
+    Job
     """
 
-    @error_logger()
-    def runner():
-        sleep(start_after)
-        while True:
+    @error_logger(retry_on_error=False, raise_on_error=True)
+    def delete_logs():
+        if lock is None or lock.acquire():
             database.delete_old_logs(up_to=up_to)
-            sleep(interval)
 
-    deleter = Thread(
-        target=runner,
-        name="<Thread: Automatic Log Deleter>",
-        daemon=True,
+    return scheduler.add(
+        "log deleter",
+        delete_logs,
+        interval=interval,
+        cron=cron,
+        start_after=start_after,
+        jitter=jitter,
     )
-    deleter.start()
-    return deleter
 
 
 def create_message_deleter_runner(
@@ -262,9 +603,12 @@ def create_message_deleter_runner(
     up_to: typing.Union[datetime.datetime, int] = 7,
     start_after: float = 5,
     interval: float = 60 * 60,
-) -> Thread:
+    cron: str = None,
+    jitter: float = 0,
+    lock=None,
+) -> Job:
     """
-    Creates a thread which automatically deletes old messages.
+    Schedules a job which automatically deletes old messages.
 
     Parameters
     ----------
@@ -275,23 +619,151 @@ def create_message_deleter_runner(
         The pause before deleting first time (in s).
     interval: float
         The delete-interval (in s).
+    cron: str, optional
+        A schedule like ``"0 3 * * *"``, used instead of ``interval`` if given
+        (see :class:`school_messenger.scheduler.Cron`).
+    jitter: float
+        The max random delay of a run (in s).
+    lock: school_messenger.workers.FileLock, school_messenger.workers.RedisLock, optional
+        If given, only deletes while this process holds the lock.
 
     Returns
     -------
-    Thread
+    Job
     """
 
-    @error_logger()
-    def runner():
-        sleep(start_after)
-        while True:
+    @error_logger(retry_on_error=False, raise_on_error=True)
+    def delete_messages():
+        if lock is None or lock.acquire():
             database.delete_old_messages(up_to=up_to)
-            sleep(interval)
 
-    deleter = Thread(
-        target=runner,
-        name="<Thread: Automatic Message Deleter>",
-        daemon=True,
+    return scheduler.add(
+        "message deleter",
+        delete_messages,
+        interval=interval,
+        cron=cron,
+        start_after=start_after,
+        jitter=jitter,
+    )
+
+
+def create_maintenance_runner(
+    *,
+    start_after: float = 60 * 2,
+    interval: float = 60 * 60 * 6,
+    cron: str = None,
+    jitter: float = 0,
+    vacuum_pages: int = 256,
+    vacuum_pause: float = 0.05,
+    max_vacuum_steps: int = 1000,
+    convert: bool = False,
+    lock=None,
+) -> Job:
+    """
+    Schedules a job which automatically maintains the database
+    (see :meth:`school_messenger.database.DataBase.maintain`).
+
+    Parameters
+    ----------
+    start_after: float
+        The pause before maintaining first time (in s).
+    interval: float
+        The maintenance-interval (in s).
+    cron: str, optional
+        A schedule like ``"0 3 * * *"``, used instead of ``interval`` if given
+        (see :class:`school_messenger.scheduler.Cron`).
+    jitter: float
+        The max random delay of a run (in s).
+    vacuum_pages: int
+        The max amount of pages freed per vacuum-step.
+    vacuum_pause: float
+        The pause between two vacuum-steps (in s).
+    max_vacuum_steps: int
+        The max amount of vacuum-steps per maintenance.
+    convert: bool
+        Whether an old database is converted to incremental auto-vacuum (one
+        full ``VACUUM``, see :meth:`school_messenger.database.DataBase.maintain`).
+    lock: school_messenger.workers.FileLock, school_messenger.workers.RedisLock, optional
+        If given, only maintains while this process holds the lock.
+
+    Returns
+    -------
+    Job
+    """
+
+    @error_logger(retry_on_error=False, raise_on_error=True)
+    def maintain():
+        if lock is None or lock.acquire():
+            database.maintain(
+                vacuum_pages=vacuum_pages,
+                vacuum_pause=vacuum_pause,
+                max_vacuum_steps=max_vacuum_steps,
+                convert=convert,
+            )
+
+    return scheduler.add(
+        "maintenance",
+        maintain,
+        interval=interval,
+        cron=cron,
+        start_after=start_after,
+        jitter=jitter,
+    )
+
+
+def create_backup_runner(
+    *,
+    start_after: float = 60 * 10,
+    interval: float = 60 * 60 * 24,
+    cron: str = None,
+    jitter: float = 0,
+    directory: str = "./backups",
+    pages: int = 256,
+    pause: float = 0.05,
+    keep: int = 7,
+    lock=None,
+) -> Job:
+    """
+    Schedules a job which automatically backs the database up
+    (see :meth:`school_messenger.database.DataBase.backup`).
+
+    Parameters
+    ----------
+    start_after: float
+        The pause before backing up first time (in s).
+    interval: float
+        The backup-interval (in s).
+    cron: str, optional
+        A schedule like ``"0 3 * * *"``, used instead of ``interval`` if given
+        (see :class:`school_messenger.scheduler.Cron`).
+    jitter: float
+        The max random delay of a run (in s).
+    directory: str
+        Where the backups are stored.
+    pages: int
+        The pages copied per step.
+    pause: float
+        The pause between two steps (in s).
+    keep: int
+        How many backups are kept.
+    lock: school_messenger.workers.FileLock, school_messenger.workers.RedisLock, optional
+        If given, only backs up while this process holds the lock.
+
+    Returns
+    -------
+    Job
+    """
+
+    @error_logger(retry_on_error=False, raise_on_error=True)
+    def backup():
+        if lock is None or lock.acquire():
+            database.backup(directory, pages=pages, pause=pause, keep=keep)
+
+    return scheduler.add(
+        "backup",
+        backup,
+        interval=interval,
+        cron=cron,
+        start_after=start_after,
+        jitter=jitter,
     )
-    deleter.start()
-    return deleter
@@ -1,5 +1,75 @@
+import re
+import typing
 from ..utils import database
 
 
+__all__ = (
+    "ResponseShape",
+    "VersionBase",
+)
+
+
+class ResponseShape:
+    """
+    The key casing of a version's responses.
+
+    Each key is translated once and then served from a lookup table, so
+    handlers build their responses directly in the final form.
+    """
+
+    def __init__(self, key_case: typing.Optional[typing.Callable[[str], str]] = None):
+        """
+        Parameters
+        ----------
+        key_case: typing.Callable[[str], str], optional
+            E.g. ``str.lower``, the keys are kept as they are if None.
+        """
+        self.key_case = key_case
+        self._keys = {}
+
+    def __getitem__(self, key: str) -> str:
+        try:
+            return self._keys[key]
+        except KeyError:
+            cased = key if self.key_case is None else self.key_case(key)
+            self._keys[key] = cased
+            return cased
+
+
+_SHAPES: dict[str, ResponseShape] = {}
+_DEFAULT_SHAPE = ResponseShape()
+_VERSION_RE = re.compile(r"\d+")
+
+
 class VersionBase:
     database = database
+    version: int
+    key_case: typing.Optional[typing.Callable[[str], str]] = None
+
+    def __init__(self, api):
+        """
+        Registers the response shape of this version, must be called
+        (via ``super().__init__``) when the version is added to the API.
+
+        Parameters
+        ----------
+        api: NAA.web.API
+        """
+        _SHAPES.setdefault(str(self.version), ResponseShape(self.key_case))
+
+    @staticmethod
+    def shape(request) -> ResponseShape:
+        """
+        Parameters
+        ----------
+        request: NAA.APIRequest
+
+        Returns
+        -------
+        ResponseShape
+            The shape of the requested version (handlers are shared between
+            the versions via the fallbacks).
+        """
+        if match := _VERSION_RE.search(str(request.version)):
+            return _SHAPES.get(match.group(), _DEFAULT_SHAPE)
+        return _DEFAULT_SHAPE
@@ -1,3 +1,4 @@
+from json import loads
 from NAA import APIRequest
 from NAA.web import API
 from AlbertUnruhUtils.ratelimit import ServerRateLimit
@@ -8,7 +9,10 @@ from .base import VersionBase
 
 
 class V0(VersionBase):
+    version = 0
+
     def __init__(self, api: API):
+        super().__init__(api)
         api.add_global_request_check(401)(has_user_agent)
 
         @api.add(ignore_invalid_methods=True)
@@ -19,6 +23,14 @@ class V0(VersionBase):
         @users.add("GET")
         @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
         def info(request: APIRequest):
+            if queries := request.get("Queries"):
+                try:
+                    queries = loads(queries)
+                    assert isinstance(queries, list) and queries
+                    assert all(isinstance(q, str) and q for q in queries)
+                except (ValueError, AssertionError):
+                    return 400, "Incorrect `Queries`! (Must be a JSON-list of strings!)"
+                return {"Users": {q: {"name": "", "id": ""} for q in queries}}
             if not all([(query := request.get("Query"))]):
                 return 400, "Missing `Query`!"
             return {"name": "", "id": ""}
@@ -97,3 +109,28 @@ class V0(VersionBase):
                 return 201, {"ID": ""}
 
         messages.add_request_check(401)(is_authorized)
+
+        @messages.add("POST")
+        @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
+        def batch(request: APIRequest):
+            try:
+                contents = loads(request.get("Contents", ""))
+                assert isinstance(contents, list) and contents
+            except (ValueError, AssertionError):
+                return 400, "Incorrect `Contents`! (Must be a non-empty JSON-list!)"
+            return 201, {"IDs": ["" for _ in contents], "Errors": []}
+
+        batch.add_request_check(401)(is_authorized)
+
+        @messages.add("GET")
+        @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
+        def search(request: APIRequest):
+            if not request.get("Query", "").strip():
+                return 400, "Missing `Query`!"
+            return {
+                "messages": [
+                    {"id": "", "content": "", "author": {"id": "", "name": ""}}
+                ]
+            }
+
+        search.add_request_check(401)(is_authorized)
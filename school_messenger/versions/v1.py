@@ -1,14 +1,21 @@
+from json import loads
 from NAA import APIRequest
 from NAA.web import API
 from AlbertUnruhUtils.ratelimit import ServerRateLimit
 
-from ..utils import has_user_agent, is_authorized, get_user_type
+from ..utils import has_user_agent, is_authorized, get_user_type, consume_ratelimit
+from ..cache import not_modified
 from ..config import Config, redis
+from ..metrics import CACHE_HITS, CACHE_MISSES
+from ..requestlog import request_log
 from .base import VersionBase
 
 
 class V1(VersionBase):
+    version = 1
+
     def __init__(self, api: API):
+        super().__init__(api)
         database = self.database
 
         api.add_global_request_check(401)(has_user_agent)
@@ -16,13 +23,7 @@ class V1(VersionBase):
 
         @api.add_global_request_check(-1)
         def log_requests(request: APIRequest):
-            database.add_log(
-                level=database.LOG_LEVEL["DEBUG"],
-                version=request.version,
-                ip=request.ip,
-                msg=f"{request.method} {request.url}",
-                headers=request.headers,
-            )
+            request_log.stage(request)
             return True
 
         @api.add(ignore_invalid_methods=True)
@@ -33,6 +34,25 @@ class V1(VersionBase):
         @users.add("GET")
         @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
         def info(request: APIRequest):
+            if not_modified():
+                return 304
+            if queries := request.get("Queries"):
+                try:
+                    queries = loads(queries)
+                    assert isinstance(queries, list) and queries
+                    assert all(isinstance(q, str) and q for q in queries)
+                except (ValueError, AssertionError):
+                    return 400, "Incorrect `Queries`! (Must be a JSON-list of strings!)"
+                if len(queries) > (maximum := Config["users"]["max bulk lookup"]):
+                    return 400, f"Too many `Queries`! (Max. {maximum} per request!)"
+                data = database.accounts_info(queries)
+                shape = self.shape(request)
+                return {
+                    shape["Users"]: {
+                        q: data[q].to_json(shape) if q in data else None
+                        for q in queries
+                    }
+                }
             if not all([(query := request.get("Query"))]):
                 return 400, "Missing `Query`!"
             data = database.account_info(query=query)
@@ -42,19 +62,21 @@ class V1(VersionBase):
                     version=request.version,
                     ip=request.ip,
                     msg=f"user {query!r} not found",
-                    headers=request.headers,
+                    headers=request_log.sanitize_headers(request.headers),
                 )
                 return 404, "User Not Found!"
-            return {"name": data[1], "id": str(data[0])}
+            return data.to_json(self.shape(request))
 
         info.add_request_check(401)(is_authorized)
 
         @users.add("GET")
         @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
         def whoami(request: APIRequest):
+            if not_modified():
+                return 304
             token = request.get("Authorization").split()[1]  # noqa
             data = database.account_info(token=token)
-            return {"name": data[1], "id": str(data[0])}
+            return data.to_json(self.shape(request))
 
         whoami.add_request_check(401)(is_authorized)
 
@@ -73,7 +95,7 @@ class V1(VersionBase):
                         version=request.version,
                         ip=request.ip,
                         msg=f"missing name/password while creating account",
-                        headers=request.headers,
+                        headers=request_log.sanitize_headers(request.headers),
                     )
                     return 400, "Missing `Name` and/or `Password`!"
                 data = database.add_account(name, password)
@@ -83,7 +105,7 @@ class V1(VersionBase):
                         version=request.version,
                         ip=request.ip,
                         msg=f"can't create account {name!r} (already registered/is numeric)",
-                        headers=request.headers,
+                        headers=request_log.sanitize_headers(request.headers),
                     )
                     return 400, "Incorrect `Name`! (Already registered or numeric!)"
                 database.add_log(
@@ -93,7 +115,7 @@ class V1(VersionBase):
                     msg=f"add account {name!r}",
                     headers={},
                 )
-                return 201, {"Token": data}
+                return 201, {self.shape(request)["Token"]: data}
 
             if request.method == "DELETE":
                 if not is_authorized(request):
@@ -101,7 +123,7 @@ class V1(VersionBase):
                 if not all([(password := request.get("Password", ""))]):
                     return 400, "Missing `Password`!"
                 token = request.get("Authorization").split()[1]  # noqa
-                name = database.account_info(token=token)[1]
+                name = database.account_info(token=token).name
                 data = database.account_delete(token, password)
                 if data is False:
                     database.add_log(
@@ -109,7 +131,7 @@ class V1(VersionBase):
                         version=request.version,
                         ip=request.ip,
                         msg=f"trying delete account {name!r}",
-                        headers=request.headers,
+                        headers=request_log.sanitize_headers(request.headers),
                     )
                     return 401, "Password incorrect!"
                 database.add_log(
@@ -117,7 +139,7 @@ class V1(VersionBase):
                     version=request.version,
                     ip=request.ip,
                     msg=f"delete account {name!r}",
-                    headers=request.headers,
+                    headers=request_log.sanitize_headers(request.headers),
                 )
                 return 204
 
@@ -140,7 +162,7 @@ class V1(VersionBase):
                     version=request.version,
                     ip=request.ip,
                     msg=f"missing name/password while requesting token",
-                    headers=request.headers,
+                    headers=request_log.sanitize_headers(request.headers),
                 )
                 return 400, "Missing `Name` and/or `Password`!"
             data = database.account_token(name, password)
@@ -150,10 +172,24 @@ class V1(VersionBase):
                     version=request.version,
                     ip=request.ip,
                     msg=f"invalid name/password while requesting token",
-                    headers=request.headers,
+                    headers=request_log.sanitize_headers(request.headers),
                 )
                 return 401
-            return {"Token": data}
+            return {self.shape(request)["Token"]: data}
+
+        def render_messages(shape, data):
+            cached_authors = {}
+            msgs = []
+            for msg in data:
+                if msg.author not in cached_authors:
+                    CACHE_MISSES.inc("message authors")
+                    cached_authors[msg.author] = database.account_info(
+                        query=str(msg.author)
+                    )
+                else:
+                    CACHE_HITS.inc("message authors")
+                msgs.append(msg.to_json(cached_authors[msg.author], shape))
+            return msgs
 
         @api.add("POST", "GET")
         @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
@@ -177,31 +213,17 @@ class V1(VersionBase):
                         version=request.version,
                         ip=request.ip,
                         msg=f"invalid amount/before/after while requesting message history",
-                        headers=request.headers,
+                        headers=request_log.sanitize_headers(request.headers),
                     )
                     return (
                         400,
                         "Incorrect `Amount`, `Before` and/or `After`! (They must all be numeric!)",
                     )
-                cached_authors = {}
-                msgs = []
+                if not_modified():
+                    return 304
                 (data) = database.get_messages(int(amount), int(before), int(after))
-                for msg in data:
-                    if msg[1] not in cached_authors:
-                        cached_authors[msg[1]] = database.account_info(
-                            query=str(msg[1])
-                        )
-                    msgs.append(
-                        {
-                            "id": msg[0],
-                            "content": msg[2],
-                            "author": {
-                                "id": cached_authors[msg[1]][0],
-                                "name": cached_authors[msg[1]][1],
-                            },
-                        }
-                    )
-                return {"messages": msgs}
+                shape = self.shape(request)
+                return {shape["messages"]: render_messages(shape, data)}
 
             if request.method == "POST":
                 if not all([(content := request.get("Content", ""))]):
@@ -210,13 +232,105 @@ class V1(VersionBase):
                         version=request.version,
                         ip=request.ip,
                         msg=f"can't create empty message",
-                        headers=request.headers,
+                        headers=request_log.sanitize_headers(request.headers),
                     )
                     return 400, "Missing `Content`!"
                 author = database.account_info(
                     token=request.get("Authorization").split()[1]
                 )
-                data = database.add_message(author[0], content)
-                return 201, {"ID": data}
+                data = database.add_message(author.id, content)
+                return 201, {self.shape(request)["ID"]: data}
 
         messages.add_request_check(401)(is_authorized)
+
+        @messages.add("POST")
+        @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
+        def batch(request: APIRequest):
+            try:
+                contents = loads(request.get("Contents", ""))
+                assert isinstance(contents, list) and contents
+            except (ValueError, AssertionError):
+                database.add_log(
+                    level=database.LOG_LEVEL["DEBUG"],
+                    version=request.version,
+                    ip=request.ip,
+                    msg=f"invalid contents while sending a batch",
+                    headers=request_log.sanitize_headers(request.headers),
+                )
+                return 400, "Incorrect `Contents`! (Must be a non-empty JSON-list!)"
+            if len(contents) > (maximum := Config["messages"]["max batch size"]):
+                return 400, f"Too many `Contents`! (Max. {maximum} per batch!)"
+
+            shape = self.shape(request)
+            ids = [None] * len(contents)
+            errors = []
+            valid = []
+            for index, content in enumerate(contents):
+                if not isinstance(content, str):
+                    errors.append(
+                        {shape["index"]: index, shape["message"]: "Must be a string!"}
+                    )
+                elif not content:
+                    errors.append(
+                        {shape["index"]: index, shape["message"]: "Missing content!"}
+                    )
+                else:
+                    valid.append(index)
+            if not valid:
+                return 400, {shape["IDs"]: ids, shape["Errors"]: errors}
+
+            # the request itself is already charged by ServerRateLimit
+            if len(valid) > 1 and not consume_ratelimit(request, len(valid) - 1):
+                return 429, "Batch exceeds your rate limit!"
+
+            author = database.account_info(
+                token=request.get("Authorization").split()[1]
+            )
+            data = database.add_messages(author.id, [contents[i] for i in valid])
+            for index, id in zip(valid, data):  # noqa
+                ids[index] = id
+            return 201, {shape["IDs"]: ids, shape["Errors"]: errors}
+
+        batch.add_request_check(401)(is_authorized)
+
+        @messages.add("GET")
+        @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
+        def search(request: APIRequest):
+            if not all([(query := request.get("Query", "")).strip()]):
+                return 400, "Missing `Query`!"
+            if not all(
+                [
+                    (amount := request.get("Amount", "20")).isnumeric(),
+                    (offset := request.get("Offset", "0")).isnumeric(),
+                    (before := request.get("Before", "-1"))
+                    .removeprefix("-")
+                    .isnumeric(),
+                    (after := request.get("After", "-1")).removeprefix("-").isnumeric(),
+                ]
+            ):
+                return (
+                    400,
+                    "Incorrect `Amount`, `Offset`, `Before` and/or `After`! "
+                    "(They must all be numeric!)",
+                )
+            if int(amount) > (maximum := Config["messages"]["max search results"]):
+                return 400, f"Too big `Amount`! (Max. {maximum} per request!)"
+
+            author = None
+            if author_query := request.get("Author"):
+                if not (author := database.account_info(query=author_query)):
+                    return 404, "User Not Found!"
+                author = author.id
+
+            data = database.search_messages(
+                query,
+                author=author,
+                maximum=int(amount),
+                offset=int(offset),
+                before=int(before),
+                after=int(after),
+            )
+            shape = self.shape(request)
+            return {shape["messages"]: render_messages(shape, data)}
+
+        search.add_request_check(401)(is_authorized)
@@ -1,4 +1,3 @@
-from NAA import APIResponse
 from NAA.web import API
 
 from .base import VersionBase
@@ -9,11 +8,8 @@ __all__ = ("V2",)
 
 # all from v1
 class V2(VersionBase):
+    version = 2
+    key_case = str.lower  # all keys in (json-) responses are lowercase
+
     def __init__(self, api: API):
-        @api.add_global_response_check()
-        def lower_all_json(response: APIResponse):
-            json = {}
-            for k, v in response.response.items():
-                json[k.lower()] = v
-            response._response = json  # noqa
-            return response
+        super().__init__(api)
@@ -1,24 +1,28 @@
+import os
 from NAA import APIRequest
 from NAA.web import API
 from AlbertUnruhUtils.ratelimit import ServerRateLimit
 
-from ..utils import is_authorized, get_user_type
+from ..utils import is_authorized, get_user_type, leader_lock, scheduler
 from ..config import Config, redis
+from ..requestlog import request_log
 from .base import VersionBase
 
-
 __all__ = ("V3",)
 
 
 # all from v2
 class V3(VersionBase):
+    version = 3
+    key_case = str.lower  # like v2
+
     def __init__(self, api: API):
+        super().__init__(api)
         database = self.database
 
         @api.add(ignore_invalid_methods=True)
         @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
-        def admin(_: APIRequest):
-            ...
+        def admin(_: APIRequest): ...
 
         @admin.add("GET")
         @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
@@ -39,25 +43,14 @@ class V3(VersionBase):
                     version=request.version,
                     ip=request.ip,
                     msg=f"invalid amount/before/after while requesting log history",
-                    headers=request.headers,
+                    headers=request_log.sanitize_headers(request.headers),
                 )
                 return (
                     400,
                     "Incorrect `Amount`, `Before` and/or `After`! (They must all be numeric!)",
                 )
-            logs = []  # noqa
-            (data) = database.get_logs(int(amount), int(before), int(after))
-            for log in data:
-                logs.append(
-                    {
-                        "date": log[0],
-                        "level": log[1],
-                        "version": log[2],
-                        "ip": log[3],
-                        "message": log[4],
-                        "headers": log[5],
-                    }
-                )
+            data = database.get_logs(int(amount), int(before), int(after))
+            logs = [log.to_json() for log in data]  # noqa
             database.add_log(
                 level=database.LOG_LEVEL["INFO"],
                 version=request.version,
@@ -69,6 +62,46 @@ class V3(VersionBase):
 
         logs.add_request_check(401)(is_authorized)
 
+        @admin.add("GET")
+        @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
+        def jobs(_: APIRequest):
+            # of the process which handles the request
+            return {"jobs": scheduler.status()}
+
+        jobs.add_request_check(401)(is_authorized)
+
+        @admin.add("GET", "POST")
+        @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
+        def backup(request: APIRequest):
+            settings = Config["runner"]["backup"]
+            if request.method == "POST":
+                # like the runner, so it never overlaps a backup of another worker
+                if (lock := leader_lock("backup")) is not None and not lock.acquire():
+                    return 409, "The backups are run by another worker!"
+                try:
+                    status = database.backup(
+                        settings["directory"],
+                        pages=settings["pages"],
+                        pause=settings["pause"],
+                        keep=settings["keep"],
+                        background=True,
+                    )
+                except RuntimeError:
+                    return 409, "A backup is already running!"
+                except NotImplementedError:
+                    return 501, "The database can't be backed up! (In memory!)"
+                return 202, status
+            return {
+                # of the process which handles the request
+                **database.backup_status(),
+                "backups": [
+                    {"file": os.path.basename(file), "size": os.path.getsize(file)}
+                    for file in database.backups(settings["directory"])
+                ],
+            }
+
+        backup.add_request_check(401)(is_authorized)
+
         @admin.add("DELETE", "PUT")
         @ServerRateLimit(Config["ratelimits"], get_user_type, redis=redis)
         def user(request: APIRequest):
@@ -110,10 +143,16 @@ class V3(VersionBase):
                 return 400, "Incorrect `Id`! (Must be numeric!)"
             if not (msg := database.delete_message(id)):
                 return 400, "Invalid `Id`! (Not in database!)"
-            return {"id": str(msg[0]), "author": str(msg[1]), "content": msg[2]}
+            return {
+                "id": str(msg.id),
+                "author": str(msg.author),
+                "content": msg.content,
+            }
 
         @admin.add_request_check(401)
         @logs.add_request_check(401)
+        @jobs.add_request_check(401)
+        @backup.add_request_check(401)
         @user.add_request_check(401)
         @messages.add_request_check(401)
         def is_admin(request: APIRequest) -> bool:
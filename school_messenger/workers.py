@@ -0,0 +1,190 @@
+import os
+import sys
+import signal
+import socket
+import traceback
+import typing
+from time import monotonic, sleep
+from uuid import uuid4
+
+
+__all__ = (
+    "FileLock",
+    "RedisLock",
+    "run_workers",
+)
+
+
+class FileLock:
+    """
+    A leader-lock between the processes of one host (``flock``).
+
+    The lock is held until :meth:`release` is called or the holding process
+    dies, so another process takes over with its next :meth:`acquire`.
+    """
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path: str
+            The lock-file.
+        """
+        self.path = path
+        self._fd = None
+
+    def acquire(self) -> bool:
+        """
+        Tries to acquire (or keep) the lock without blocking.
+
+        Returns
+        -------
+        bool
+            Whether this process holds the lock.
+        """
+        import fcntl
+
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)  # releases the flock
+            self._fd = None
+
+
+class RedisLock:
+    """
+    A leader-lock over redis which expires if the holder stops refreshing it.
+    """
+
+    _REFRESH = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+    )
+    _RELEASE = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('del', KEYS[1]) else return 0 end"
+    )
+
+    def __init__(self, redis, name: str, *, ttl: float):
+        """
+        Parameters
+        ----------
+        redis: redis.Redis
+        name: str
+            The name of the lock.
+        ttl: float
+            After how many seconds without :meth:`acquire` the lock expires.
+        """
+        self.redis = redis
+        self.key = f"school-messenger:leader:{name}"
+        self.ttl = int(ttl * 1000)
+        self.token = uuid4().hex
+
+    def acquire(self) -> bool:
+        """
+        Tries to acquire (or refresh) the lock without blocking.
+
+        Returns
+        -------
+        bool
+            Whether this process holds the lock.
+        """
+        if self.redis.set(self.key, self.token, nx=True, px=self.ttl):
+            return True
+        return bool(self.redis.eval(self._REFRESH, 1, self.key, self.token, self.ttl))
+
+    def release(self):
+        self.redis.eval(self._RELEASE, 1, self.key, self.token)
+
+
+def run_workers(
+    target: typing.Callable[[socket.socket], typing.Any],
+    *,
+    count: int,
+    host: str,
+    port: int,
+    restart_delay: float = 1,
+):
+    """
+    Binds the server socket once and forks ``count`` workers which serve on it.
+
+    Crashed workers are replaced, SIGINT/SIGTERM stop all workers.
+
+    Parameters
+    ----------
+    target: typing.Callable[[socket.socket], typing.Any]
+        Serves on the given socket (is called in the worker).
+    count: int
+        The amount of workers.
+    host: str
+    port: int
+    restart_delay: float
+        The pause before a worker which crashed right after its start is
+        replaced (in s).
+    """
+    if not hasattr(os, "fork"):
+        raise RuntimeError("The worker mode requires os.fork!")
+
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.create_server((host, port), family=family, backlog=1024)
+    sock.set_inheritable(True)
+
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                target(sock)
+            except BaseException:  # noqa
+                traceback.print_exc(file=sys.stderr)
+                code = 1
+            finally:
+                os._exit(code)  # noqa
+        children[pid] = monotonic()
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(count):
+        spawn()
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = children.pop(pid, None)
+        if not stopping:
+            if started is not None and monotonic() - started < restart_delay:
+                sleep(restart_delay)
+            spawn()
+
+    sock.close()
@@ -0,0 +1,34 @@
+import os
+import tempfile
+import unittest
+from school_messenger.database import DataBase
+from school_messenger.storage import MemoryStorage
+
+
+class MessageRangeTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        sqlite = DataBase(database=os.path.join(directory.name, "test.sqlite3"))
+        sqlite.setup()
+        self.engines = [sqlite, MemoryStorage()]
+        for engine in self.engines:
+            engine.add_message(1, "hello world")
+
+    def test_huge_bounds(self):
+        # the headers are only checked to be numeric (with an optional "-")
+        for engine in self.engines:
+            for huge in (10**20, -(10**20)):
+                for before, after in ((huge, -1), (-1, huge), (huge, huge)):
+                    with self.subTest(engine=type(engine).__name__, b=before, a=after):
+                        engine.get_messages(20, before, after)
+                        engine.search_messages("hello", before=before, after=after)
+
+    def test_negative_after(self):
+        for engine in self.engines:
+            self.assertEqual(len(engine.get_messages(20, -1, -(10**20))), 1)
+            self.assertEqual(len(engine.get_messages(20, -(10**20), -1)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
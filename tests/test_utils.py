@@ -0,0 +1,38 @@
+import os
+import unittest
+from school_messenger.utils import generate_id, generate_ids
+
+
+class GenerateIdsTest(unittest.TestCase):
+    def test_batch(self):
+        ids = generate_ids(2, 2048)
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertLess(ids[-1], generate_id(2))
+        with self.assertRaises(ValueError):
+            generate_ids(2, 2049)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_unique_across_workers(self):
+        workers, amount = 4, 500
+        children = []
+        for _ in range(workers):
+            read, write = os.pipe()
+            if (pid := os.fork()) == 0:
+                os.close(read)
+                with os.fdopen(write, "w") as f:
+                    f.write(" ".join(str(generate_id(2)) for _ in range(amount)))
+                os._exit(0)  # noqa
+            os.close(write)
+            children.append((pid, read))
+
+        ids = []
+        for pid, read in children:
+            with os.fdopen(read) as f:
+                ids += map(int, f.read().split())
+            os.waitpid(pid, 0)
+        self.assertEqual(len(ids), workers * amount)
+        self.assertEqual(len(set(ids)), len(ids))
+
+
+if __name__ == "__main__":
+    unittest.main()